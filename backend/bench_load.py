@@ -0,0 +1,579 @@
+"""Seeded load test: HTTP and chat scenarios against the ASGI app, with latency percentiles.
+
+Usage (from the backend directory):
+
+    python bench_load.py --mongomock                  # fully in-memory (pip install mongomock-motor)
+    python bench_load.py                              # local mongod from MONGO_URL, bench database
+    python bench_load.py --scenarios listings,search --concurrency 32 --requests 1000
+    python bench_load.py --sockets 200 --ws-messages 50 --scenarios ws
+    python bench_load.py --output after.json --compare before.json
+
+Each run drops and reseeds its own database (--db-name, never the configured
+DB_NAME) with users, listings, reviews, orders and chat histories generated
+from --seed, so runs at the same settings see the same data. Requests and
+WebSocket frames go through the app in-process and Stripe is replaced by a
+local stub, so nothing leaves the machine. Client and server share one event
+loop: absolute numbers include client overhead and are for comparing runs
+of this script, not for capacity planning.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv(Path(__file__).parent / '.env')
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "novomarket")
+os.environ.setdefault("JWT_SECRET", "bench-secret")
+
+import server  # noqa: E402
+from server import User, app, create_user_token, directory_fields, empty_rating_histogram, pwd_context  # noqa: E402
+
+CATEGORIES = ["Electronics", "Fashion", "Home", "Books", "Sports", "Beauty", "Toys", "Services"]
+WORDS = [
+    "vintage", "wireless", "leather", "organic", "handmade", "compact", "classic", "premium",
+    "portable", "ceramic", "bamboo", "carbon", "linen", "smart", "retro", "modern", "cotton",
+    "steel", "wooden", "deluxe", "mini", "travel", "kitchen", "garden", "studio", "outdoor",
+    "camera", "lamp", "jacket", "sneakers", "headphones", "backpack", "watch", "blender",
+    "novel", "puzzle", "yoga", "bicycle", "serum", "keyboard",
+]
+PASSWORD = "bench-password"
+WEBHOOK_SECRET = "whsec_bench"
+ALL_SCENARIOS = ["listings", "search", "listing", "reviews", "messages", "threads", "users", "checkout", "ws"]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seeded_id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+# ============ Stripe Stub ============
+
+class StripeStub:
+    """Just enough of the Stripe API for checkout: create and retrieve sessions."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.server = None
+        self.url = None
+        self.handlers = {}
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def stop(self):
+        self.server.close()
+        # Closing the transports ends each handler's read loop cleanly
+        for writer in list(self.handlers.values()):
+            writer.close()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        handler = asyncio.current_task()
+        self.handlers[handler] = writer
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                length = 0
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value)
+                await reader.readexactly(length)
+                status, body = self.respond(method, path.split("?")[0])
+                payload = json.dumps(body).encode()
+                writer.write(f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self.handlers.pop(handler, None)
+
+    def respond(self, method: str, path: str):
+        if method == "POST" and path == "/v1/checkout/sessions":
+            session_id = f"cs_bench_{uuid.uuid4().hex}"
+            self.sessions[session_id] = {
+                "id": session_id, "object": "checkout.session", "url": f"https://checkout.stripe.test/{session_id}",
+                "payment_status": "unpaid", "status": "open",
+            }
+            return 200, self.sessions[session_id]
+        session = self.sessions.get(path.rsplit("/", 1)[-1])
+        if method == "GET" and session:
+            return 200, session
+        return 404, {"error": {"type": "invalid_request_error", "message": f"No such resource: {path}"}}
+
+    def completed_event(self, session_id: str):
+        """Mark a session paid and return a signed checkout.session.completed webhook."""
+        session = self.sessions[session_id]
+        session.update(payment_status="paid", status="complete")
+        payload = json.dumps({
+            "id": f"evt_{uuid.uuid4().hex}", "object": "event", "type": "checkout.session.completed",
+            "data": {"object": session},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(WEBHOOK_SECRET.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return payload, f"t={timestamp},v1={signature}"
+
+
+# ============ Seed Data ============
+
+async def seed(db, rng: random.Random, args) -> dict:
+    """Insert a deterministic data set and return the ids scenarios pick from."""
+    now = datetime.now(timezone.utc)
+    password = pwd_context.hash(PASSWORD)
+
+    users = []
+    for i in range(args.users):
+        role = "seller" if i % 4 == 0 else "buyer"
+        users.append({
+            "id": seeded_id(rng), "email": f"bench{i}@example.com", "name": f"Bench {role.title()} {i}",
+            "role": role, "avatar": None, "verified": False, "password": password,
+            "timestamp": now - timedelta(days=rng.uniform(0, 365)),
+        })
+        users[-1].update(directory_fields(users[-1]["name"], users[-1]["email"]))
+    await db.users.insert_many(users)
+    sellers = [u for u in users if u["role"] == "seller"]
+    buyers = [u for u in users if u["role"] == "buyer"]
+
+    listings = []
+    for i in range(args.listings):
+        seller = rng.choice(sellers)
+        category = rng.choice(CATEGORIES)
+        listing_type = "service" if category == "Services" else "product"
+        listings.append({
+            "id": seeded_id(rng), "seller_id": seller["id"], "seller_name": seller["name"],
+            "title": " ".join(rng.sample(WORDS, rng.randint(2, 4))).title(),
+            "description": " ".join(rng.choices(WORDS, k=30)),
+            "price": round(rng.uniform(5, 500), 2), "category": category,
+            "images": [f"{server.UPLOAD_BASE_URL}/bench-{i}-{n}.jpg" for n in range(rng.randint(1, 4))],
+            "tags": rng.sample(WORDS, 2), "stock": rng.randint(50, 500) if listing_type == "product" else None,
+            "verified": rng.random() < 0.2, "rating": 0.0, "reviews_count": 0, "rating_sum": 0,
+            "rating_histogram": empty_rating_histogram(), "type": listing_type,
+            "timestamp": now - timedelta(minutes=rng.uniform(0, 90 * 24 * 60)),
+        })
+    await insert_batched(db.listings, listings)
+
+    reviews = []
+    for _ in range(args.reviews):
+        reviewer = rng.choice(buyers)
+        reviews.append({
+            "id": seeded_id(rng), "listing_id": rng.choice(listings)["id"], "user_id": reviewer["id"],
+            "user_name": reviewer["name"], "rating": rng.choices([1, 2, 3, 4, 5], weights=[1, 1, 2, 4, 6])[0],
+            "comment": " ".join(rng.choices(WORDS, k=12)), "timestamp": now - timedelta(minutes=rng.uniform(0, 60 * 24 * 60)),
+        })
+    await insert_batched(db.reviews, reviews)
+    await server.reconcile_rating_aggregates()
+
+    orders = []
+    for _ in range(args.orders):
+        buyer, listing = rng.choice(buyers), rng.choice(listings)
+        quantity = rng.randint(1, 3)
+        paid = rng.random() < 0.7
+        orders.append({
+            "id": seeded_id(rng), "buyer_id": buyer["id"], "buyer_name": buyer["name"],
+            "seller_id": listing["seller_id"], "listing_id": listing["id"], "listing_title": listing["title"],
+            "quantity": quantity, "total_amount": round(listing["price"] * quantity, 2),
+            "status": "confirmed" if paid else "expired", "payment_status": "paid" if paid else "pending",
+            "session_id": None, "reservation": ("committed" if paid else "released") if listing["type"] == "product" else None,
+            "timestamp": now - timedelta(minutes=rng.uniform(0, 60 * 24 * 60)),
+        })
+    await insert_batched(db.orders, orders)
+    await server.rebuild_order_analytics()
+
+    conversations = []
+    messages = []
+    for _ in range(args.conversations):
+        buyer, seller = rng.choice(buyers), rng.choice(sellers)
+        conversations.append((buyer["id"], seller["id"]))
+        sent_at = now - timedelta(days=rng.uniform(1, 30))
+        for n in range(args.messages_per_conversation):
+            sender, receiver = (buyer, seller) if n % 2 == 0 else (seller, buyer)
+            sent_at += timedelta(seconds=rng.uniform(5, 3600))
+            messages.append({
+                "id": seeded_id(rng), "sender_id": sender["id"], "receiver_id": receiver["id"],
+                "message": " ".join(rng.choices(WORDS, k=rng.randint(3, 20))),
+                "file_url": None, "file_type": None, "file_name": None,
+                "read": n < args.messages_per_conversation - 3, "timestamp": sent_at,
+                "seq": int(sent_at.timestamp() * 1_000_000),
+            })
+    await insert_batched(db.messages, messages)
+    await server.rebuild_conversations()
+
+    print(f"Seeded {len(users)} users, {len(listings)} listings, {len(reviews)} reviews, "
+          f"{len(orders)} orders, {len(messages)} messages in {len(conversations)} conversations")
+    return {
+        "tokens": {u["id"]: create_user_token(User(**u)) for u in users},
+        "buyers": [u["id"] for u in buyers],
+        "users": [u["id"] for u in users],
+        "listings": [p["id"] for p in listings],
+        "products": [p["id"] for p in listings if p["type"] == "product"],
+        "conversations": conversations,
+    }
+
+
+async def insert_batched(collection, docs: list, batch_size: int = 1000):
+    for i in range(0, len(docs), batch_size):
+        await collection.insert_many(docs[i:i + batch_size])
+
+
+# ============ HTTP Scenarios ============
+
+class Bench:
+    def __init__(self, http: httpx.AsyncClient, data: dict, stripe_stub: StripeStub):
+        self.http = http
+        self.data = data
+        self.stripe = stripe_stub
+        self.samples = defaultdict(list)
+        self.failures = Counter()
+        self.elapsed = {}
+
+    def auth(self, user_id: str) -> dict:
+        return {"Authorization": f"Bearer {self.data['tokens'][user_id]}"}
+
+    async def call(self, label: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, **kwargs)
+        except Exception:
+            self.failures[label] += 1
+            return None
+        self.samples[label].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.failures[label] += 1
+            return None
+        return response
+
+    async def run(self, name: str, scenario, concurrency: int, total: int, seed: int):
+        pending = iter(range(total))
+
+        async def worker(rng: random.Random):
+            for _ in pending:
+                await scenario(self, rng)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(random.Random(f"{seed}:{name}:{i}")) for i in range(concurrency)))
+        self.elapsed[name] = time.perf_counter() - started
+
+
+async def scenario_listings(bench: Bench, rng: random.Random):
+    params = {"sort": rng.choice(list(server.LISTING_SORTS)), "limit": 50}
+    if rng.random() < 0.5:
+        params["category"] = rng.choice(CATEGORIES)
+    response = await bench.call("listings", "GET", "/api/listings", params=params)
+    if response is not None and response.headers.get(server.NEXT_CURSOR_HEADER) and rng.random() < 0.5:
+        params["cursor"] = response.headers[server.NEXT_CURSOR_HEADER]
+        await bench.call("listings page 2", "GET", "/api/listings", params=params)
+
+
+async def scenario_search(bench: Bench, rng: random.Random):
+    params = {"search": " ".join(rng.sample(WORDS, rng.randint(1, 2)))}
+    if rng.random() < 0.3:
+        params["category"] = rng.choice(CATEGORIES)
+    await bench.call("search", "GET", "/api/listings", params=params)
+
+
+async def scenario_listing(bench: Bench, rng: random.Random):
+    await bench.call("listing", "GET", f"/api/listings/{rng.choice(bench.data['listings'])}")
+
+
+async def scenario_reviews(bench: Bench, rng: random.Random):
+    await bench.call("reviews", "GET", f"/api/reviews/{rng.choice(bench.data['listings'])}")
+
+
+async def scenario_messages(bench: Bench, rng: random.Random):
+    buyer_id, seller_id = rng.choice(bench.data["conversations"])
+    await bench.call("messages", "GET", f"/api/messages/{seller_id}", headers=bench.auth(buyer_id))
+
+
+async def scenario_threads(bench: Bench, rng: random.Random):
+    buyer_id, _ = rng.choice(bench.data["conversations"])
+    await bench.call("threads", "GET", "/api/threads", headers=bench.auth(buyer_id))
+
+
+async def scenario_users(bench: Bench, rng: random.Random):
+    params = {"q": rng.choice(["bench", "bench s", "bench b", "bench1"])} if rng.random() < 0.7 else {}
+    await bench.call("users", "GET", "/api/users", params=params, headers=bench.auth(rng.choice(bench.data["users"])))
+
+
+async def scenario_checkout(bench: Bench, rng: random.Random):
+    headers = bench.auth(rng.choice(bench.data["buyers"]))
+    params = {"listing_id": rng.choice(bench.data["products"]), "quantity": 1}
+    response = await bench.call("checkout order", "POST", "/api/orders", params=params, headers=headers)
+    if response is None:
+        return
+    response = await bench.call("checkout session", "POST", "/api/checkout/session",
+                                params={"order_id": response.json()["id"]}, headers=headers)
+    if response is None:
+        return
+    session_id = response.json()["session_id"]
+    payload, signature = bench.stripe.completed_event(session_id)
+    await bench.call("checkout webhook", "POST", "/api/webhook/stripe", content=payload,
+                     headers={"stripe-signature": signature})
+    await bench.call("checkout status", "GET", f"/api/checkout/status/{session_id}", headers=headers)
+
+
+HTTP_SCENARIOS = {
+    "listings": scenario_listings,
+    "search": scenario_search,
+    "listing": scenario_listing,
+    "reviews": scenario_reviews,
+    "messages": scenario_messages,
+    "threads": scenario_threads,
+    "users": scenario_users,
+    "checkout": scenario_checkout,
+}
+
+
+# ============ WebSocket Scenario ============
+
+class ASGIWebSocket:
+    """In-process WebSocket client that drives the ASGI app directly."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.to_app = asyncio.Queue()
+        self.from_app = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": self.path, "raw_path": self.path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 0), "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        self.task = asyncio.create_task(app(scope, self.to_app.get, self.from_app.put))
+        await self.to_app.put({"type": "websocket.connect"})
+        message = await self.from_app.get()
+        if message["type"] != "websocket.accept":
+            raise ConnectionError(f"WebSocket rejected: {message}")
+
+    async def send_json(self, data: dict):
+        await self.to_app.put({"type": "websocket.receive", "text": json.dumps(data)})
+
+    async def receive_json(self) -> dict:
+        message = await self.from_app.get()
+        if message["type"] == "websocket.close":
+            raise ConnectionError("WebSocket closed by server")
+        return json.loads(message["text"])
+
+    async def close(self):
+        await self.to_app.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait([self.task], timeout=5)
+
+
+async def run_ws_fanout(bench: Bench, rng: random.Random, sockets: int, per_socket: int, interval: float, timeout: float):
+    """Connect one socket per user, have every socket message random peers and time delivery."""
+    user_ids = bench.data["users"][:sockets]
+    if len(user_ids) < sockets:
+        print(f"ws: only {len(user_ids)} seeded users, using that many sockets")
+    expected = len(user_ids) * per_socket
+    sent_at = {}
+    delivered = asyncio.Event()
+    received = 0
+
+    async def open_socket(user_id: str) -> ASGIWebSocket:
+        ws = ASGIWebSocket(f"/ws/chat/{user_id}")
+        started = time.perf_counter()
+        await ws.connect()
+        bench.samples["ws connect"].append(time.perf_counter() - started)
+        return ws
+
+    async def read_frames(ws: ASGIWebSocket, user_id: str):
+        nonlocal received
+        while True:
+            try:
+                frame = await ws.receive_json()
+            except ConnectionError:
+                return
+            if frame.get("type") == "ping":
+                await ws.send_json({"type": "pong"})
+            elif frame.get("type") == "chat" and frame["data"]["receiver_id"] == user_id:
+                started = sent_at.pop(frame["data"]["message"], None)
+                if started is not None:
+                    bench.samples["ws delivery"].append(time.perf_counter() - started)
+                    received += 1
+                    if received == expected:
+                        delivered.set()
+
+    async def send_messages(ws: ASGIWebSocket, user_id: str, index: int):
+        peers = [u for u in user_ids if u != user_id]
+        for n in range(per_socket):
+            marker = f"bench {index}-{n}"
+            sent_at[marker] = time.perf_counter()
+            await ws.send_json({"receiver_id": rng.choice(peers), "message": marker})
+            await asyncio.sleep(interval)
+
+    started = time.perf_counter()
+    connections = await asyncio.gather(*(open_socket(user_id) for user_id in user_ids))
+    bench.elapsed["ws connect"] = time.perf_counter() - started
+    readers = [asyncio.create_task(read_frames(ws, user_id)) for ws, user_id in zip(connections, user_ids)]
+    started = time.perf_counter()
+    await asyncio.gather(*(send_messages(ws, user_id, i) for i, (ws, user_id) in enumerate(zip(connections, user_ids))))
+    try:
+        await asyncio.wait_for(delivered.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    bench.elapsed["ws"] = time.perf_counter() - started
+    bench.failures["ws delivery"] += len(sent_at)
+
+    await asyncio.gather(*(ws.close() for ws in connections))
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    print(f"ws: {len(connections)} sockets, {received}/{expected} messages delivered, "
+          f"{server.connection_manager.dropped_frames} frames dropped by send queues")
+
+
+# ============ Report ============
+
+def summarize(bench: Bench) -> dict:
+    results = {}
+    for label, samples in bench.samples.items():
+        scenario = label.split(" ")[0]
+        elapsed = bench.elapsed.get(label) or bench.elapsed.get(scenario)
+        results[label] = {
+            "count": len(samples),
+            "errors": bench.failures[label],
+            "per_second": len(samples) / elapsed if elapsed else 0.0,
+            **{f"p{p}": percentile(samples, p) * 1000 for p in (50, 95, 99)},
+            "max": max(samples) * 1000,
+        }
+    return results
+
+
+def print_report(results: dict, baseline: dict):
+    header = f"{'scenario':<18} {'count':>7} {'errors':>6} {'per sec':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+    print("\n" + header + ("  p95 vs base" if baseline else ""))
+    for label, row in results.items():
+        line = (f"{label:<18} {row['count']:>7} {row['errors']:>6} {row['per_second']:>9.1f} "
+                f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} {row['max']:>8.1f}")
+        base = baseline.get(label)
+        if base and base["p95"]:
+            line += f"  {(row['p95'] - base['p95']) / base['p95'] * 100:+10.1f}%"
+        print(line)
+
+
+# ============ Main ============
+
+async def bench(args) -> dict:
+    if args.mongomock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--mongomock needs the mongomock-motor package: pip install mongomock-motor")
+        server.client = AsyncMongoMockClient(tz_aware=True)
+    if args.db_name == os.environ["DB_NAME"]:
+        raise SystemExit(f"Refusing to reseed the configured database {args.db_name}; pick another --db-name")
+    server.db = server.client[args.db_name]
+    await server.client.drop_database(args.db_name)
+
+    if not args.response_cache:
+        server.response_cache.ttl = 0
+    stripe_stub = StripeStub()
+    await stripe_stub.start()
+    server.STRIPE_API_KEY = "sk_test_bench"
+    server.STRIPE_API_BASE = stripe_stub.url
+    server.STRIPE_WEBHOOK_SECRET = WEBHOOK_SECRET
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    data = await seed(server.db, rng, args)
+    print(f"Seeding took {time.perf_counter() - started:.1f}s")
+
+    await app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            runner = Bench(http, data, stripe_stub)
+            for name in args.scenarios:
+                if name == "ws":
+                    await run_ws_fanout(runner, rng, args.sockets, args.ws_messages, args.ws_interval, args.ws_timeout)
+                else:
+                    await runner.run(name, HTTP_SCENARIOS[name], args.concurrency, args.requests, args.seed)
+    finally:
+        await app.router.shutdown()
+        await stripe_stub.stop()
+        if not args.keep:
+            await server.client.drop_database(args.db_name)
+    return summarize(runner)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongomock", action="store_true", help="use in-memory mongomock-motor instead of MONGO_URL")
+    parser.add_argument("--db-name", default="novomarket_bench", help="database to (re)seed; dropped afterwards")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database after the run")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for data and request mix")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--listings", type=int, default=2000)
+    parser.add_argument("--reviews", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages-per-conversation", type=int, default=50)
+    parser.add_argument("--scenarios", default=",".join(ALL_SCENARIOS),
+                        help=f"comma-separated subset of {','.join(ALL_SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=16, help="HTTP requests in flight per scenario")
+    parser.add_argument("--requests", type=int, default=500, help="iterations per HTTP scenario")
+    parser.add_argument("--no-response-cache", dest="response_cache", action="store_false",
+                        help="measure listing/review reads without the response cache")
+    parser.add_argument("--sockets", type=int, default=100, help="concurrent chat sockets, one per seeded user")
+    parser.add_argument("--ws-messages", type=int, default=20, help="messages each socket sends")
+    parser.add_argument("--ws-interval", type=float, default=0.01, help="seconds between a socket's sends")
+    parser.add_argument("--ws-timeout", type=float, default=30, help="seconds to wait for every delivery")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON from an earlier run to diff p95 against")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(ALL_SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if not args.verbose:
+        for name in ("server", "httpx", "passlib", "stripe"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    try:
+        results = asyncio.run(bench(args))
+    finally:
+        server.client.close()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Measure login latency and event-loop stalls under concurrent authentication.
+
+Usage (from the backend directory, with the usual .env in place):
+
+    python bench_login.py                        # logins through the bcrypt pool
+    python bench_login.py --inline               # hash on the event loop, for comparison
+    python bench_login.py --concurrency 32 --requests 200
+
+Requests go through the ASGI app in-process, so no server needs to be running.
+A ticker task sleeps in short intervals alongside the logins; how late it
+wakes up is the time the loop was blocked and every socket on the worker
+would have waited.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import httpx
+
+import server
+from server import app, client, db, pwd_context
+
+TICK_SECONDS = 0.005
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def watch_loop(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def run_inline(func, *args):
+    return func(*args)
+
+
+async def bench(concurrency: int, total: int, inline: bool):
+    if inline:
+        server.run_password_job = run_inline
+
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    credentials = {"email": email, "password": "bench-password"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        response = await http.post("/api/auth/register", json={**credentials, "name": "Bench", "role": "buyer"})
+        response.raise_for_status()
+
+        latencies, lags, failures = [], [], 0
+        pending = iter(range(total))
+        stop = asyncio.Event()
+
+        async def worker():
+            nonlocal failures
+            for _ in pending:
+                started = time.perf_counter()
+                response = await http.post("/api/auth/login", json=credentials)
+                latencies.append(time.perf_counter() - started)
+                failures += response.status_code != 200
+
+        ticker = asyncio.create_task(watch_loop(lags, stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await ticker
+
+    await db.users.delete_one({"email": email})
+
+    mode = "inline" if inline else f"pool ({server.PASSWORD_HASH_WORKERS} workers)"
+    print(f"mode: {mode}, bcrypt rounds: {pwd_context.to_dict().get('bcrypt__rounds')}")
+    print(f"{total} logins at concurrency {concurrency} in {elapsed:.2f}s "
+          f"({total / elapsed:.1f}/s, {failures} failed)")
+    print("login latency ms  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+        *(percentile(latencies, p) * 1000 for p in (50, 95, 99, 100))))
+    print("loop lag ms       p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+        *(percentile(lags, p) * 1000 for p in (50, 95, 99, 100))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=16, help="logins in flight at once")
+    parser.add_argument("--requests", type=int, default=100, help="total logins to perform")
+    parser.add_argument("--inline", action="store_true", help="verify passwords on the event loop")
+    args = parser.parse_args()
+    try:
+        asyncio.run(bench(args.concurrency, args.requests, args.inline))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Microbenchmark: serializing a page of listings, model path vs lean path.
+
+Usage (from the backend directory, with the usual .env in place):
+
+    python bench_serialization.py
+    python bench_serialization.py --page-size 200 --repeat 500
+
+The model path is what list routes used to do: parse the ISO string
+timestamp, build a Listing per document and let the response_model validate
+and serialize the list again. The lean path is LeanSerializer: rename the
+native datetime and hand the documents to orjson. No database is touched.
+"""
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from pydantic import TypeAdapter
+
+from server import Listing, client, empty_rating_histogram, listing_serializer
+
+
+def make_page(page_size: int) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    page = []
+    for i in range(page_size):
+        page.append({
+            "id": str(uuid.uuid4()),
+            "seller_id": str(uuid.uuid4()),
+            "seller_name": "Seller Name",
+            "title": f"Listing title number {i}",
+            "description": "A reasonably sized description of the item for sale. " * 4,
+            "price": 19.99 + i,
+            "category": "electronics",
+            "images": [f"http://localhost:8000/uploads/{uuid.uuid4().hex * 2}.jpg" for _ in range(3)],
+            "tags": ["new", "popular"],
+            "stock": 5,
+            "verified": False,
+            "rating": 4.5,
+            "reviews_count": 12,
+            "rating_histogram": {**empty_rating_histogram(), "4": 6, "5": 6},
+            "image_variants": [None, None, None],
+            "type": "product",
+            "timestamp": now - timedelta(minutes=i),
+        })
+    return page
+
+
+def model_path(adapter: TypeAdapter, page: List[dict]) -> bytes:
+    listings = []
+    for doc in page:
+        p = dict(doc)
+        p['created_at'] = datetime.fromisoformat(p.pop('timestamp'))
+        listings.append(Listing(**p))
+    # FastAPI's response_model step: validate the returned models again, then serialize
+    return adapter.dump_json(adapter.validate_python([m.model_dump() for m in listings]))
+
+
+def lean_path(page: List[dict]) -> bytes:
+    return listing_serializer.dumps([dict(doc) for doc in page])
+
+
+def measure(label: str, func, repeat: int, page_size: int):
+    func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    median = samples[len(samples) // 2]
+    print(f"{label:<7} median {median * 1e6:8.0f} us/page  {median * 1e6 / page_size:6.1f} us/doc  "
+          f"p95 {samples[int(len(samples) * 0.95)] * 1e6:8.0f} us/page")
+    return median
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page-size", type=int, default=50, help="listings per page")
+    parser.add_argument("--repeat", type=int, default=200, help="timed iterations per path")
+    args = parser.parse_args()
+
+    page = make_page(args.page_size)
+    legacy_page = [{**doc, "timestamp": doc["timestamp"].isoformat()} for doc in page]
+    adapter = TypeAdapter(List[Listing])
+    try:
+        model = measure("model", lambda: model_path(adapter, legacy_page), args.repeat, args.page_size)
+        lean = measure("lean", lambda: lean_path(page), args.repeat, args.page_size)
+        print(f"lean path is {model / lean:.1f}x faster")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
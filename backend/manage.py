@@ -0,0 +1,208 @@
+"""Maintenance commands for the marketplace database.
+
+Usage (from the backend directory, with the usual .env in place):
+
+    python manage.py audit-queries [--create]
+    python manage.py migrate-timestamps [--batch-size N]
+    python manage.py backfill-user-directory [--batch-size N]
+    python manage.py reconcile-ratings [<listing_id>...] [--batch-size N]
+    python manage.py rebuild-conversations
+    python manage.py rebuild-analytics [--batch-size N]
+
+Every command runs against the database server.py is configured for
+(MONGO_URL / DB_NAME) and closes its client on exit. `python manage.py
+<command> --help` describes when each one is needed.
+"""
+import argparse
+import asyncio
+import inspect
+import sys
+from datetime import datetime, timezone
+
+from server import (
+    backfill_directory_fields,
+    client,
+    db,
+    ensure_indexes,
+    migrate_datetime_fields,
+    rebuild_conversations as rebuild_conversation_threads,
+    rebuild_order_analytics,
+    reconcile_rating_aggregates,
+)
+
+# ============ audit-queries ============
+
+SAMPLE_ID = "00000000-0000-0000-0000-000000000000"
+SAMPLE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+# (route, collection, filter, sort) for each lookup the API performs.
+QUERY_SHAPES = [
+    ("get_current_user", "users", {"id": SAMPLE_ID}, None),
+    ("register / login", "users", {"email": "someone@example.com"}, None),
+    ("get_users", "users", {"id": {"$ne": SAMPLE_ID}}, [("name_key", 1), ("id", 1)]),
+    ("get_users role", "users", {"id": {"$ne": SAMPLE_ID}, "role": "seller"}, [("name_key", 1), ("id", 1)]),
+    ("get_users search", "users", {"id": {"$ne": SAMPLE_ID}, "search_keys": {"$regex": "^sam"}}, [("name_key", 1), ("id", 1)]),
+    ("get_listing", "listings", {"id": SAMPLE_ID}, None),
+    ("get_listings newest", "listings", {}, [("timestamp", -1), ("id", -1)]),
+    ("get_listings category", "listings", {"category": "electronics"}, [("timestamp", -1), ("id", -1)]),
+    ("get_listings seller", "listings", {"seller_id": SAMPLE_ID}, [("timestamp", -1), ("id", -1)]),
+    ("get_listings price", "listings", {"price": {"$gte": 10}}, [("price", 1), ("id", 1)]),
+    ("get_listings rating", "listings", {}, [("rating", -1), ("id", -1)]),
+    ("get_listings page 2", "listings",
+     {"$or": [{"timestamp": {"$lt": SAMPLE_TIME}}, {"timestamp": SAMPLE_TIME, "id": {"$lt": SAMPLE_ID}}]},
+     [("timestamp", -1), ("id", -1)]),
+    ("export_listings", "listings", {"seller_id": SAMPLE_ID}, [("timestamp", -1)]),
+    ("build_image_variants", "listings", {"images": "http://localhost:8000/uploads/sample.jpg"}, None),
+    ("get_reviews", "reviews", {"listing_id": SAMPLE_ID}, [("timestamp", -1), ("id", -1)]),
+    ("get_orders buyer", "orders", {"buyer_id": SAMPLE_ID}, [("timestamp", -1), ("id", -1)]),
+    ("get_orders seller", "orders", {"seller_id": SAMPLE_ID}, [("timestamp", -1), ("id", -1)]),
+    ("get_order", "orders", {"id": SAMPLE_ID}, None),
+    ("release_expired_reservations", "orders", {"status": "pending", "reserved_until": {"$lt": SAMPLE_TIME}}, None),
+    ("get_messages", "messages", {"conversation_id": f"{SAMPLE_ID}:{SAMPLE_ID}"}, [("seq", -1), ("id", -1)]),
+    ("mark_conversation_read", "messages",
+     {"sender_id": SAMPLE_ID, "receiver_id": SAMPLE_ID, "read": False, "seq": {"$lt": 0}}, None),
+    ("get_threads", "conversations", {"participants": SAMPLE_ID}, [("last_message_time", -1), ("id", -1)]),
+    ("record_conversation_message", "conversations", {"id": f"{SAMPLE_ID}:{SAMPLE_ID}"}, None),
+    ("add_to_wishlist", "wishlist", {"user_id": SAMPLE_ID, "listing_id": SAMPLE_ID}, None),
+    ("check_wishlist", "wishlist", {"user_id": SAMPLE_ID, "listing_id": {"$in": [SAMPLE_ID]}}, None),
+    ("get_wishlist", "wishlist", {"user_id": SAMPLE_ID}, [("timestamp", -1), ("id", -1)]),
+    ("get_checkout_status", "payment_transactions", {"session_id": "cs_test"}, None),
+    ("stripe_webhook", "stripe_events", {"id": "evt_test"}, None),
+    ("get_analytics hour", "analytics_hourly",
+     {"seller_id": SAMPLE_ID, "start": {"$gte": SAMPLE_TIME, "$lt": SAMPLE_TIME}}, None),
+    ("get_analytics day", "analytics_daily",
+     {"seller_id": SAMPLE_ID, "start": {"$gte": SAMPLE_TIME, "$lt": SAMPLE_TIME}}, None),
+]
+
+
+def plan_stages(plan: dict) -> list:
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return [s for s in stages if s]
+
+
+async def explain(collection: str, query: dict, sort) -> list:
+    command = {"find": collection, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+    return plan_stages(result["queryPlanner"]["winningPlan"])
+
+
+async def audit_queries(args) -> int:
+    """Explain every query shape server.py issues and flag collection scans.
+
+    Exits non-zero when any query shape resolves to a COLLSCAN.
+    """
+    if args.create:
+        await ensure_indexes()
+
+    scans = 0
+    for route, collection, query, sort in QUERY_SHAPES:
+        stages = await explain(collection, query, sort)
+        flagged = "COLLSCAN" in stages
+        scans += flagged
+        status = "COLLSCAN" if flagged else "ok"
+        print(f"{status:<9} {route:<24} {collection:<22} {' > '.join(stages)}")
+
+    print(f"\n{len(QUERY_SHAPES)} query shapes, {scans} collection scans")
+    return 1 if scans else 0
+
+# ============ Backfills ============
+
+async def migrate_timestamps(args):
+    """Convert dates stored as ISO strings into native BSON datetimes.
+
+    The API also runs this at startup whenever a string date remains, since
+    cursor pagination skips such documents. Run it by hand to migrate ahead of a
+    deploy; re-running only touches documents that still hold strings.
+    """
+    converted = await migrate_datetime_fields(batch_size=args.batch_size)
+    for collection_name, count in converted.items():
+        print(f"{collection_name:<22} {count} documents converted")
+
+
+async def backfill_user_directory(args):
+    """Add user directory search keys to users registered before GET /api/users paginated.
+
+    The API also runs this at startup whenever a user lacks name_key, since
+    directory pages skip such users and searches never match them. Run it by
+    hand to backfill ahead of a deploy. Re-running only touches users that still
+    lack keys.
+    """
+    count = await backfill_directory_fields(batch_size=args.batch_size)
+    print(f"Added directory keys to {count} users")
+
+
+async def reconcile_ratings(args):
+    """Rebuild listing rating aggregates (sum, count, average, histogram) from reviews.
+
+    Run once after deploying running aggregates, and any time reviews are edited
+    or removed outside the API.
+    """
+    count = await reconcile_rating_aggregates(args.listing_ids or None, batch_size=args.batch_size)
+    print(f"Reconciled rating aggregates for {count} reviewed listings")
+
+
+async def rebuild_conversations(args):
+    """Rebuild the chat inbox (conversations collection) from stored messages.
+
+    Run once to backfill threads for message history that predates the
+    conversations collection.
+    """
+    count = await rebuild_conversation_threads()
+    print(f"Rebuilt {count} conversations")
+
+
+async def rebuild_analytics(args):
+    """Recompute seller analytics order, sales and revenue counters from the orders collection.
+
+    Run once after deploying analytics rollups to backfill existing orders, and any
+    time orders are changed outside the API. View counts are only ever recorded
+    live and are left untouched.
+    """
+    count = await rebuild_order_analytics(batch_size=args.batch_size)
+    print(f"Rebuilt analytics rollups from {count} orders")
+
+# ============ CLI ============
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    def add_command(run, batch_size=None):
+        summary, _, details = inspect.cleandoc(run.__doc__).partition("\n")
+        command = commands.add_parser(run.__name__.replace("_", "-"), help=summary,
+                                      description=f"{summary}\n{details}",
+                                      formatter_class=argparse.RawDescriptionHelpFormatter)
+        command.set_defaults(run=run)
+        if batch_size:
+            command.add_argument("--batch-size", type=int, default=batch_size,
+                                 help=f"writes per bulk_write (default: {batch_size})")
+        return command
+
+    add_command(audit_queries).add_argument(
+        "--create", action="store_true", help="create declared indexes before auditing")
+    add_command(migrate_timestamps, batch_size=1000)
+    add_command(backfill_user_directory, batch_size=1000)
+    add_command(reconcile_ratings, batch_size=500).add_argument(
+        "listing_ids", nargs="*", help="listing ids to reconcile (default: all)")
+    add_command(rebuild_conversations)
+    add_command(rebuild_analytics, batch_size=1000)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return asyncio.run(args.run(args)) or 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
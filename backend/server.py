@@ -1,94 +1,900 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, WebSocket, WebSocketDisconnect, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request, Response, Query, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+import anyio
 from starlette.middleware.cors import CORSMiddleware
+from python_multipart.multipart import MultipartParser, parse_options_header
+from python_multipart.exceptions import MultipartParseError
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne, ReturnDocument, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import PyMongoError, BulkWriteError, DuplicateKeyError
 import os
 import logging
-import shutil
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional, Dict, Any
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps, features as pil_features
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, AliasChoices, ValidationError
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
+import re
+import unicodedata
+import random
+import threading
+import multiprocessing
+import contextvars
+from contextlib import contextmanager
+import math
+import bisect
+import asyncio
+import base64
+import time
+import hashlib
+import hmac
+import mimetypes
+from urllib.parse import urlparse, urlencode
+from collections import OrderedDict, deque
 from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 import jwt
 import stripe
 import json
+import orjson
+import csv
+import io
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # shared cache backends are optional
+    aioredis = None
+
+try:
+    import fcntl
+except ImportError:  # Windows; see lock_segment
+    fcntl = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics and tracing
+# When set, GET /metrics requires "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '100'))
+# Fraction of HTTP requests whose spans (route, MongoDB commands, hot sections) are logged
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get('LOOP_LAG_INTERVAL_SECONDS', '0.5'))
+
+# ============ Metrics ============
+#
+# Prometheus text exposition without a client library. Metrics are per
+# process; with several workers, scrape each one or aggregate downstream.
+# MongoDB command events arrive on Motor's executor threads, hence the locks.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_metric_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def format_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.lock = threading.Lock()
+
+    def label_pairs(self, values: tuple) -> list:
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {values}")
+        return list(zip(self.label_names, values))
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{format_labels(pairs)} {format_metric_value(value)}" for name, pairs, value in self.samples()]
+        return lines
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), callback=None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[tuple, float] = {}
+        self.callback = callback
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.callback is not None:
+            yield self.name, [], self.callback()
+            return
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            yield self.name, self.label_pairs(labels), value
+
+class GaugeMetric(CounterMetric):
+    """A value that goes up and down; set() it, inc()/dec() it or read it from a callback at scrape time."""
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        with self.lock:
+            self.values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class HistogramMetric(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # labels -> [per-bucket counts, sum, count]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, *labels, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self.lock:
+            values = [(labels, list(counts), total, count) for labels, (counts, total, count) in self.values.items()]
+        for labels, counts, total, count in values:
+            pairs = self.label_pairs(labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", pairs + [("le", format_metric_value(bound))], cumulative
+            yield f"{self.name}_sum", pairs, total
+            yield f"{self.name}_count", pairs, count
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_requests_total = metrics.register(CounterMetric(
+    "http_requests_total", "HTTP responses by route template and status.", ("method", "route", "status")))
+http_request_duration = metrics.register(HistogramMetric(
+    "http_request_duration_seconds", "HTTP request latency, including streamed bodies.", ("method", "route")))
+http_requests_in_flight = metrics.register(GaugeMetric(
+    "http_requests_in_flight", "HTTP requests currently being served."))
+mongodb_command_duration = metrics.register(HistogramMetric(
+    "mongodb_command_duration_seconds", "MongoDB command latency.", ("collection", "command")))
+mongodb_command_errors_total = metrics.register(CounterMetric(
+    "mongodb_command_errors_total", "Failed MongoDB commands.", ("collection", "command")))
+mongodb_slow_commands_total = metrics.register(CounterMetric(
+    "mongodb_slow_commands_total", "MongoDB commands slower than SLOW_QUERY_MS.", ("collection", "command")))
+event_loop_lag = metrics.register(GaugeMetric(
+    "event_loop_lag_seconds", "How late the most recent event loop probe woke up."))
+event_loop_lag_distribution = metrics.register(HistogramMetric(
+    "event_loop_lag_distribution_seconds", "Event loop probe lateness."))
+for name, documentation, key in (
+    ("websocket_connections", "Open chat sockets on this worker.", "connections"),
+    ("websocket_users", "Users with at least one chat socket on this worker.", "users"),
+    ("websocket_send_queue_frames", "Frames waiting in chat send queues.", "queued_frames"),
+    ("websocket_send_queue_max_depth", "Deepest chat send queue.", "max_queue_depth"),
+):
+    metrics.register(GaugeMetric(name, documentation, callback=lambda key=key: connection_manager.metrics()[key]))
+metrics.register(CounterMetric("websocket_dropped_frames_total", "Frames dropped from full send queues.",
+                               callback=lambda: connection_manager.dropped_frames))
+metrics.register(CounterMetric("websocket_evicted_connections_total", "Sockets evicted as slow or unresponsive.",
+                               callback=lambda: connection_manager.evicted_connections))
+metrics.register(GaugeMetric("chat_write_behind_pending", "Chat messages acknowledged but not yet in MongoDB.",
+                             callback=lambda: len(message_writer.pending)))
+metrics.register(GaugeMetric("analytics_pending_buckets", "Buffered analytics counters awaiting a flush.",
+                             callback=lambda: len(analytics_recorder.pending)))
+
+class Trace:
+    """Spans collected for one sampled request, logged as a single line when it finishes."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans: List[dict] = []
+
+    def add(self, name: str, started: float, duration: float, **attributes):
+        # list.append is atomic, so MongoDB events from executor threads can add spans too
+        self.spans.append({"name": name, "offset_ms": round((started - self.started) * 1000, 3),
+                           "duration_ms": round(duration * 1000, 3), **attributes})
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """Time a block as a span of the current request's trace; a no-op when it is not sampled."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, started, time.perf_counter() - started, **attributes)
+
+def query_shape(value):
+    """A query with its values replaced by "?", safe to log."""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [query_shape(v) for v in value]
+    return "?"
+
+def command_filter(command_name: str, command: dict):
+    if command_name in ("find", "count", "distinct"):
+        return command.get("filter", command.get("query"))
+    if command_name == "findAndModify":
+        return command.get("query")
+    if command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        return statements[0].get("q")
+    if command_name == "aggregate":
+        return next((stage["$match"] for stage in command.get("pipeline", []) if "$match" in stage), None)
+    return None
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times MongoDB commands per collection and command, and logs slow ones by query shape."""
+    IGNORED = {"hello", "isMaster", "ismaster", "ping", "buildInfo", "saslStart", "saslContinue", "endSessions"}
+
+    def __init__(self):
+        self.inflight: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        if event.command_name in self.IGNORED:
+            return
+        command = event.command
+        target = command.get("collection") if event.command_name == "getMore" else command.get(event.command_name)
+        collection = target if isinstance(target, str) else "-"
+        self.inflight[(event.connection_id, event.request_id)] = (collection, command_filter(event.command_name, command))
+
+    def succeeded(self, event):
+        self.finish(event, failed=False)
+
+    def failed(self, event):
+        self.finish(event, failed=True)
+
+    def finish(self, event, failed: bool):
+        entry = self.inflight.pop((event.connection_id, event.request_id), None)
+        if entry is None:
+            return
+        collection, query = entry
+        seconds = event.duration_micros / 1e6
+        mongodb_command_duration.observe(collection, event.command_name, value=seconds)
+        if failed:
+            mongodb_command_errors_total.inc(collection, event.command_name)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            mongodb_slow_commands_total.inc(collection, event.command_name)
+            logger.warning(f"Slow MongoDB {event.command_name} on {collection}: {seconds * 1000:.0f} ms, "
+                           f"query {json.dumps(query_shape(query)) if query else '-'}")
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(f"mongodb.{event.command_name}", time.perf_counter() - seconds, seconds,
+                      collection=collection, failed=failed)
+
+class MetricsMiddleware:
+    """Per-route request counts and latency, plus sampled tracing.
+
+    Plain ASGI rather than BaseHTTPMiddleware, so streamed and ranged
+    responses pass through untouched. Routes are labelled by their template
+    (/api/listings/{listing_id}) to keep label cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        trace = Trace() if TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE else None
+        token = current_trace.set(trace)
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            current_trace.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_requests_total.inc(scope["method"], route, str(status))
+            http_request_duration.observe(scope["method"], route, value=elapsed)
+            if trace is not None:
+                logger.info("Trace " + json.dumps({
+                    "trace_id": trace.id, "method": scope["method"], "route": route, "status": status,
+                    "duration_ms": round(elapsed * 1000, 3), "spans": trace.spans,
+                }))
+
+async def monitor_event_loop_lag():
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        lag = max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL_SECONDS)
+        event_loop_lag.set(value=lag)
+        event_loop_lag_distribution.observe(value=lag)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '4'))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '64'))
+# min_rounds makes hashes below the configured cost "need update", so login rehashes them
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
 JWT_SECRET = os.environ.get('JWT_SECRET')
 JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+TRUST_TOKEN_CLAIMS = os.environ.get('TRUST_TOKEN_CLAIMS', 'false').lower() == 'true'
+
+# Caching
+REDIS_URL = os.environ.get('REDIS_URL')
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+# Public listing/review responses; 0 disables the cache
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '30'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+
+# Chat
+CHAT_BACKPLANE = os.environ.get('CHAT_BACKPLANE', 'memory')
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '30'))
+PRESENCE_DEBOUNCE_SECONDS = float(os.environ.get('PRESENCE_DEBOUNCE_SECONDS', '0.5'))
+SOCKET_SEND_TIMEOUT_SECONDS = float(os.environ.get('SOCKET_SEND_TIMEOUT_SECONDS', '5'))
+SEND_QUEUE_MAX = int(os.environ.get('SEND_QUEUE_MAX', '256'))
+SEND_QUEUE_OVERFLOW = os.environ.get('SEND_QUEUE_OVERFLOW', 'drop_oldest')  # or "disconnect"
+HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get('HEARTBEAT_INTERVAL_SECONDS', '25'))
+HEARTBEAT_TIMEOUT_SECONDS = float(os.environ.get('HEARTBEAT_TIMEOUT_SECONDS', '60'))
+CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'false').lower() == 'true'
+CHAT_FLUSH_MAX_BATCH = int(os.environ.get('CHAT_FLUSH_MAX_BATCH', '500'))
+CHAT_FLUSH_INTERVAL_SECONDS = float(os.environ.get('CHAT_FLUSH_INTERVAL_SECONDS', '0.05'))
+CHAT_JOURNAL_DIR = Path(os.environ.get('CHAT_JOURNAL_DIR', str(ROOT_DIR / "chat_journal")))
 
 # Stripe
 STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
-stripe.api_key = STRIPE_API_KEY
+# Point at a local stand-in such as stripe-mock (http://localhost:12111) for offline testing
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get('STRIPE_TIMEOUT_SECONDS', '10'))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', '2'))
+# Pending sessions are re-checked with Stripe at most this often, in case a webhook is late or lost
+CHECKOUT_STATUS_REFRESH_SECONDS = float(os.environ.get('CHECKOUT_STATUS_REFRESH_SECONDS', '15'))
+STRIPE_EVENT_RETENTION_SECONDS = int(os.environ.get('STRIPE_EVENT_RETENTION_SECONDS', str(7 * 24 * 3600)))
+# Stripe checkout sessions must stay open at least 30 minutes and at most 24 hours
+STRIPE_MIN_SESSION_SECONDS = 31 * 60
+STRIPE_MAX_SESSION_SECONDS = 24 * 3600 - 60
+
+# Orders hold stock from creation until paid or until the hold lapses
+ORDER_RESERVATION_SECONDS = int(os.environ.get('ORDER_RESERVATION_SECONDS', '3600'))
+ORDER_SWEEP_INTERVAL_SECONDS = float(os.environ.get('ORDER_SWEEP_INTERVAL_SECONDS', '60'))
+
+# Seller analytics
+ANALYTICS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL_SECONDS', '10'))
+# Daily buckets are kept indefinitely; hourly ones only back short-range charts
+ANALYTICS_HOURLY_RETENTION_DAYS = int(os.environ.get('ANALYTICS_HOURLY_RETENTION_DAYS', '90'))
+ANALYTICS_MAX_BUCKETS = 24 * 31
+
+# Bulk listing import and exports
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+MAX_IMPORT_LINE_BYTES = int(os.environ.get('MAX_IMPORT_LINE_BYTES', str(256 * 1024)))
+MAX_IMPORT_ERRORS = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Pagination
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Search
+SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', '300'))
+# Best-ranked matches re-sorted when a search is ordered by something other than relevance
+SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '1000'))
 
 # Create uploads directory
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+# In-progress uploads live outside the served directory, on the same filesystem
+UPLOAD_TMP_DIR = ROOT_DIR / "upload_tmp"
+UPLOAD_TMP_DIR.mkdir(exist_ok=True)
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+MAX_CHUNKED_UPLOAD_BYTES = int(os.environ.get('MAX_CHUNKED_UPLOAD_BYTES', str(200 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get('UPLOAD_SESSION_TTL_SECONDS', str(24 * 3600)))
+UPLOAD_READ_SIZE = 64 * 1024
+UPLOAD_WRITE_SIZE = 1024 * 1024
+# Public base for upload URLs; point it at a CDN that fronts /uploads in production
+UPLOAD_BASE_URL = os.environ.get('UPLOAD_BASE_URL', 'http://localhost:8000/uploads')
+
+# Image derivatives
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.environ.get('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',')]
+IMAGE_VARIANT_FORMATS = ["webp"] + (["avif"] if pil_features.check("avif") else [])
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', '2'))
+# A pending job older than this is assumed lost (e.g. its worker crashed) and may be claimed again
+IMAGE_JOB_TIMEOUT_SECONDS = int(os.environ.get('IMAGE_JOB_TIMEOUT_SECONDS', '600'))
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "gif", "webp", "bmp", "tif", "tiff"}
 
 # Create the main app
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
+# ============ Chat Backplane ============
+
+class Backplane:
+    """Routes chat events between API workers.
+
+    Payloads are pre-serialized JSON strings so a fan-out is encoded once. Each
+    worker registers a handler that receives {"user_id": ..., "payload": ...}
+    events; user_id is None for broadcasts. Workers subscribe to the users that
+    have a socket open locally and report them as present.
+    """
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def stop(self):
+        pass
+
+    async def subscribe_user(self, user_id: str):
+        raise NotImplementedError
+
+    async def unsubscribe_user(self, user_id: str):
+        raise NotImplementedError
+
+    async def publish_to_users(self, user_ids: List[str], payload: str):
+        raise NotImplementedError
+
+    async def broadcast(self, payload: str):
+        raise NotImplementedError
+
+    async def filter_online(self, user_ids: List[str]) -> List[str]:
+        """The subset of user_ids with a socket open on any worker."""
+        raise NotImplementedError
+
+class InMemoryBackplane(Backplane):
+    """Single-process backplane: events go straight to the local handler."""
+
+    def __init__(self):
+        self.handler = None
+        self.subscribed: set = set()
+
+    async def subscribe_user(self, user_id: str):
+        self.subscribed.add(user_id)
+
+    async def unsubscribe_user(self, user_id: str):
+        self.subscribed.discard(user_id)
+
+    async def publish_to_users(self, user_ids: List[str], payload: str):
+        for user_id in user_ids:
+            if user_id in self.subscribed:
+                await self.handler({"user_id": user_id, "payload": payload})
+
+    async def broadcast(self, payload: str):
+        await self.handler({"user_id": None, "payload": payload})
+
+    async def filter_online(self, user_ids: List[str]) -> List[str]:
+        return [u for u in user_ids if u in self.subscribed]
+
+class RedisBackplane(Backplane):
+    """Redis pub/sub backplane for running chat on several workers or nodes.
+
+    Messages for a user are published on a per-user channel that only workers
+    holding one of that user's sockets subscribe to. Presence is a per-worker
+    set that expires unless the worker keeps heartbeating, so a crashed worker's
+    users drop out after PRESENCE_TTL_SECONDS.
+    """
+    PREFIX = "chat:"
+
+    def __init__(self, redis_client=None, presence_ttl: int = PRESENCE_TTL_SECONDS):
+        self.redis = redis_client
+        self.presence_ttl = presence_ttl
+        self.worker_id = str(uuid.uuid4())
+        self.handler = None
+        self.pubsub = None
+        self._running = False
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def broadcast_channel(self) -> str:
+        return f"{self.PREFIX}broadcast"
+
+    @property
+    def workers_key(self) -> str:
+        return f"{self.PREFIX}presence:workers"
+
+    def presence_key(self, worker_id: str) -> str:
+        return f"{self.PREFIX}presence:worker:{worker_id}"
+
+    def user_channel(self, user_id: str) -> str:
+        return f"{self.PREFIX}user:{user_id}"
+
+    async def start(self, handler):
+        self.handler = handler
+        if self.redis is None:
+            self.redis = get_redis()
+        if self.redis is None:
+            raise RuntimeError("CHAT_BACKPLANE=redis requires REDIS_URL to be set")
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self.pubsub.subscribe(self.broadcast_channel)
+        await self._heartbeat()
+        self._running = True
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._heartbeat_loop())]
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            # redis-py can swallow a cancel inside get_message; the running flag ends the loop instead.
+            await asyncio.wait(self._tasks, timeout=5)
+        self._tasks = []
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+        await self.redis.delete(self.presence_key(self.worker_id))
+        await self.redis.zrem(self.workers_key, self.worker_id)
+
+    async def _listen(self):
+        user_prefix = f"{self.PREFIX}user:"
+        while self._running:
+            try:
+                item = await self.pubsub.get_message(timeout=1.0)
+                if item is None or item.get("type") != "message":
+                    continue
+                channel = item["channel"]
+                user_id = channel[len(user_prefix):] if channel.startswith(user_prefix) else None
+                await self.handler({"user_id": user_id, "payload": item["data"]})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Backplane listener error: {e}")
+                await asyncio.sleep(1)
+
+    async def _heartbeat(self):
+        await self.redis.zadd(self.workers_key, {self.worker_id: time.time()})
+        await self.redis.expire(self.presence_key(self.worker_id), self.presence_ttl)
+
+    async def _heartbeat_loop(self):
+        while self._running:
+            await asyncio.sleep(self.presence_ttl / 3)
+            try:
+                await self._heartbeat()
+            except Exception as e:
+                logger.error(f"Backplane heartbeat failed: {e}")
+
+    async def subscribe_user(self, user_id: str):
+        await self.pubsub.subscribe(self.user_channel(user_id))
+        await self.redis.sadd(self.presence_key(self.worker_id), user_id)
+        await self.redis.expire(self.presence_key(self.worker_id), self.presence_ttl)
+
+    async def unsubscribe_user(self, user_id: str):
+        await self.pubsub.unsubscribe(self.user_channel(user_id))
+        await self.redis.srem(self.presence_key(self.worker_id), user_id)
+
+    async def publish_to_users(self, user_ids: List[str], payload: str):
+        if len(user_ids) == 1:
+            await self.redis.publish(self.user_channel(user_ids[0]), payload)
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.publish(self.user_channel(user_id), payload)
+            await pipe.execute()
+
+    async def broadcast(self, payload: str):
+        await self.redis.publish(self.broadcast_channel, payload)
+
+    async def filter_online(self, user_ids: List[str]) -> List[str]:
+        if not user_ids:
+            return []
+        cutoff = time.time() - self.presence_ttl
+        await self.redis.zremrangebyscore(self.workers_key, "-inf", cutoff)
+        workers = await self.redis.zrange(self.workers_key, 0, -1)
+        if not workers:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for worker_id in workers:
+                pipe.smismember(self.presence_key(worker_id), user_ids)
+            results = await pipe.execute()
+        return [u for i, u in enumerate(user_ids) if any(flags[i] for flags in results)]
+
+def create_backplane() -> Backplane:
+    if CHAT_BACKPLANE == "redis":
+        return RedisBackplane()
+    if CHAT_BACKPLANE != "memory":
+        raise RuntimeError(f"Unknown CHAT_BACKPLANE: {CHAT_BACKPLANE}")
+    return InMemoryBackplane()
+
 # ============ WebSocket Connection Manager ============
+class ClientConnection:
+    """One chat socket with a bounded outbound queue drained by its own writer task.
+
+    Senders only enqueue, so a slow or stalled client can never block another
+    user's coroutine. When the queue is full the overflow policy either drops
+    the oldest pending frame or disconnects the client.
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: str, manager: "ConnectionManager",
+                 max_queue: int = SEND_QUEUE_MAX, overflow: str = SEND_QUEUE_OVERFLOW):
+        if overflow not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"Unknown send queue overflow policy: {overflow}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.manager = manager
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.queue: "deque[str]" = deque()
+        self.ready = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.dropped = 0
+        self.closed = False
+        self.writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write_loop())
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def enqueue(self, text: str):
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            if self.overflow == "disconnect":
+                logger.warning(f"Send queue full for {self.user_id}; disconnecting")
+                self.manager.evict(self)
+                return
+            self.queue.popleft()
+            self.dropped += 1
+            self.manager.dropped_frames += 1
+        self.queue.append(text)
+        self.ready.set()
+
+    async def _write_loop(self):
+        while not self.closed:
+            await self.ready.wait()
+            while self.queue:
+                text = self.queue.popleft()
+                try:
+                    await asyncio.wait_for(self.websocket.send_text(text), SOCKET_SEND_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Timed out sending to {self.user_id}; disconnecting")
+                    self.manager.evict(self)
+                    return
+                except Exception:
+                    self.manager.evict(self)
+                    return
+            self.ready.clear()
+
+    async def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), SOCKET_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    """Local sockets plus presence.
+
+    Presence is only shared with conversation partners. Changes are coalesced
+    for PRESENCE_DEBOUNCE_SECONDS and sent as joined/left diffs, so a reconnect
+    storm costs one contacts query and one message per affected partner.
+    A single heartbeat task pings every socket and evicts the ones that have
+    not answered within HEARTBEAT_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, backplane: Backplane):
+        self.backplane = backplane
+        self.active_connections: Dict[str, List[ClientConnection]] = {}
+        # user_id -> whether the user was online before the first pending change
+        self.pending_presence: Dict[str, bool] = {}
+        self._presence_flush: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks; evictions in flight live here
+        self._evictions: set = set()
+        self.dropped_frames = 0
+        self.evicted_connections = 0
+
+    async def start(self):
+        await self.backplane.start(self.deliver_local)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
 
-    async def connect(self, websocket: WebSocket, user_id: str):
+    async def stop(self):
+        for task in (self._presence_flush, self._heartbeat):
+            if task is not None:
+                task.cancel()
+        if self._evictions:
+            await asyncio.gather(*self._evictions, return_exceptions=True)
+        for connection in self.connections():
+            await connection.close(code=1001)
+        await self.backplane.stop()
+
+    def connections(self) -> List[ClientConnection]:
+        return [c for user_connections in self.active_connections.values() for c in user_connections]
+
+    async def connect(self, websocket: WebSocket, user_id: str) -> ClientConnection:
         await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
-        print(f"✅ User connected: {user_id}")
-        await self.broadcast_online_users()
-
-    async def disconnect(self, websocket: WebSocket, user_id: str):
-        if user_id in self.active_connections:
-            self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
-        print(f"❌ User disconnected: {user_id}")
-        await self.broadcast_online_users()
+        connection = ClientConnection(websocket, user_id, self)
+        connection.start()
+        # Register before any await, so a second tab connecting meanwhile joins this list
+        first_connection = user_id not in self.active_connections
+        self.active_connections.setdefault(user_id, []).append(connection)
+        if first_connection:
+            was_online = bool(await self.backplane.filter_online([user_id]))
+            await self.backplane.subscribe_user(user_id)
+            self.queue_presence_change(user_id, was_online)
+        logger.debug(f"User connected: {user_id}")
+        await self.send_presence_snapshot(connection, user_id)
+        return connection
+
+    async def disconnect(self, connection: ClientConnection):
+        user_id = connection.user_id
+        await connection.close()
+        user_connections = self.active_connections.get(user_id)
+        if user_connections is None or connection not in user_connections:
+            return
+        user_connections.remove(connection)
+        if not user_connections:
+            del self.active_connections[user_id]
+            await self.backplane.unsubscribe_user(user_id)
+            self.queue_presence_change(user_id, True)
+        logger.debug(f"User disconnected: {user_id}")
+
+    def evict(self, connection: ClientConnection):
+        """Drop a dead or overflowing connection without waiting on it."""
+        if connection.closed:
+            return
+        self.evicted_connections += 1
+        task = asyncio.create_task(self.disconnect(connection))
+        self._evictions.add(task)
+        task.add_done_callback(self._evictions.discard)
+
+    async def _heartbeat_loop(self):
+        ping = json.dumps({"type": "ping"})
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            cutoff = time.monotonic() - HEARTBEAT_TIMEOUT_SECONDS
+            for connection in self.connections():
+                if connection.last_seen < cutoff:
+                    logger.info(f"Evicting unresponsive socket for {connection.user_id}")
+                    self.evict(connection)
+                else:
+                    connection.enqueue(ping)
+
+    def metrics(self) -> dict:
+        depths = [len(c.queue) for c in self.connections()]
+        return {
+            "connections": len(depths),
+            "users": len(self.active_connections),
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_frames": self.dropped_frames,
+            "evicted_connections": self.evicted_connections,
+        }
+
+    async def deliver_local(self, event: dict):
+        """Backplane handler: queue an event on the matching sockets on this worker."""
+        if event["user_id"] is None:
+            connections = self.connections()
+        else:
+            connections = self.active_connections.get(event["user_id"], [])
+        for connection in connections:
+            connection.enqueue(event["payload"])
 
     async def send_personal_message(self, receiver_id: str, message: dict):
-        if receiver_id in self.active_connections:
-            for connection in self.active_connections[receiver_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except:
-                    pass
+        await self.backplane.publish_to_users([receiver_id], json.dumps(message))
 
     async def broadcast(self, message: dict):
-        for user_connections in self.active_connections.values():
-            for connection in user_connections:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except:
-                    pass
+        await self.backplane.broadcast(json.dumps(message))
+
+    async def contacts_of(self, user_ids: List[str]) -> Dict[str, set]:
+        """Map each conversation partner of user_ids to the subset of user_ids they talk to."""
+        contacts: Dict[str, set] = {}
+        changed = set(user_ids)
+        async for c in db.conversations.find({"participants": {"$in": user_ids}}, {"_id": 0, "participants": 1}):
+            a, b = c['participants']
+            if a in changed:
+                contacts.setdefault(b, set()).add(a)
+            if b in changed:
+                contacts.setdefault(a, set()).add(b)
+        return contacts
+
+    async def send_presence_snapshot(self, connection: ClientConnection, user_id: str):
+        contacts = list(await self.contacts_of([user_id]))
+        online = await self.backplane.filter_online(contacts)
+        connection.enqueue(json.dumps({"type": "presence", "online": online}))
 
-    async def broadcast_online_users(self):
-        online_users = list(self.active_connections.keys())
-        message = {"type": "online_users", "users": online_users}
-        await self.broadcast(message)
+    def queue_presence_change(self, user_id: str, was_online: bool):
+        self.pending_presence.setdefault(user_id, was_online)
+        if self._presence_flush is None:
+            self._presence_flush = asyncio.create_task(self._flush_presence_later())
 
-connection_manager = ConnectionManager()
+    async def _flush_presence_later(self):
+        await asyncio.sleep(PRESENCE_DEBOUNCE_SECONDS)
+        pending, self.pending_presence = self.pending_presence, {}
+        self._presence_flush = None
+        try:
+            await self.flush_presence(pending)
+        except Exception as e:
+            logger.error(f"Presence flush failed: {e}")
+
+    async def flush_presence(self, pending: Dict[str, bool]):
+        online_now = set(await self.backplane.filter_online(list(pending)))
+        joined = [u for u, was in pending.items() if not was and u in online_now]
+        left = [u for u, was in pending.items() if was and u not in online_now]
+        if not joined and not left:
+            return
+
+        recipients_by_diff: Dict[frozenset, List[str]] = {}
+        for contact, users in (await self.contacts_of(joined + left)).items():
+            recipients_by_diff.setdefault(frozenset(users), []).append(contact)
+
+        for users, recipients in recipients_by_diff.items():
+            payload = json.dumps({
+                "type": "presence",
+                "joined": [u for u in joined if u in users],
+                "left": [u for u in left if u in users],
+            })
+            await self.backplane.publish_to_users(recipients, payload)
+
+connection_manager = ConnectionManager(create_backplane())
 
 # ============ Models ============
 
+RATING_VALUES = range(1, 6)
+
+def empty_rating_histogram() -> Dict[str, int]:
+    return {str(r): 0 for r in RATING_VALUES}
+
+def created_at_field():
+    # Documents store creation time as a native datetime under "timestamp".
+    return Field(default_factory=lambda: datetime.now(timezone.utc),
+                 validation_alias=AliasChoices("created_at", "timestamp"))
+
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -97,7 +903,13 @@ class User(BaseModel):
     role: str = "buyer"
     avatar: Optional[str] = None
     verified: bool = False
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = created_at_field()
+
+class DirectoryUser(BaseModel):
+    id: str
+    name: str
+    avatar: Optional[str] = None
+    online: bool = False
 
 class UserCreate(BaseModel):
     email: EmailStr
@@ -105,161 +917,2251 @@ class UserCreate(BaseModel):
     name: str
     role: str = "buyer"
 
-class UserLogin(BaseModel):
-    email: EmailStr
-    password: str
+class UserLogin(BaseModel):
+    email: EmailStr
+    password: str
+
+class ImageVariants(BaseModel):
+    thumbnail: str
+    webp: Dict[str, str] = {}
+    avif: Dict[str, str] = {}
+
+class Listing(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    seller_id: str
+    seller_name: str
+    title: str
+    description: str
+    price: float
+    category: str
+    images: List[str]
+    tags: List[str] = []
+    stock: Optional[int] = 1
+    verified: bool = False
+    rating: float = 0.0
+    reviews_count: int = 0
+    rating_histogram: Dict[str, int] = Field(default_factory=lambda: empty_rating_histogram())
+    # Resized WebP/AVIF renditions keyed by width, aligned with images; None until generated.
+    image_variants: List[Optional[ImageVariants]] = []
+    type: str = "product"
+    created_at: datetime = created_at_field()
+
+class ListingCreate(BaseModel):
+    title: str
+    description: str
+    price: float
+    category: str
+    images: List[str]
+    tags: List[str] = []
+    stock: Optional[int] = 1
+    type: str = "product"
+
+class ListingUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    category: Optional[str] = None
+    images: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    stock: Optional[int] = None
+    type: Optional[str] = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportResult(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    errors: List[ImportRowError] = []
+    # True when more rows failed than MAX_IMPORT_ERRORS entries could report
+    errors_truncated: bool = False
+
+class Review(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    listing_id: str
+    user_id: str
+    user_name: str
+    rating: int
+    comment: str
+    created_at: datetime = created_at_field()
+
+class ReviewCreate(BaseModel):
+    listing_id: str
+    rating: int = Field(ge=1, le=5)
+    comment: str
+
+class Order(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    buyer_id: str
+    buyer_name: str
+    seller_id: str
+    listing_id: str
+    listing_title: str
+    quantity: int
+    total_amount: float
+    status: str = "pending"
+    payment_status: str = "pending"
+    session_id: Optional[str] = None
+    # held -> committed once paid, or released when the hold lapses; None for non-stocked listings
+    reservation: Optional[str] = None
+    reserved_until: Optional[datetime] = None
+    created_at: datetime = created_at_field()
+
+class AnalyticsBucket(BaseModel):
+    start: datetime
+    views: int = 0
+    orders: int = 0
+    sales: int = 0
+    units_sold: int = 0
+    revenue: float = 0
+
+class AnalyticsReport(BaseModel):
+    granularity: str
+    start: datetime
+    end: datetime
+    totals: AnalyticsBucket
+    buckets: List[AnalyticsBucket]
+
+class Message(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    sender_id: str
+    receiver_id: str
+    listing_id: Optional[str] = None
+    message: str
+    file_url: Optional[str] = None
+    file_type: Optional[str] = None
+    file_name: Optional[str] = None
+    read: bool = False
+    seq: Optional[int] = None
+    created_at: datetime = created_at_field()
+
+class MessageCreate(BaseModel):
+    receiver_id: str = Field(min_length=1)
+    listing_id: Optional[str] = None
+    message: str = ""
+    file_url: Optional[str] = None
+    file_type: Optional[str] = None
+    file_name: Optional[str] = None
+
+class ReadReceipt(BaseModel):
+    up_to_id: Optional[str] = None
+
+class ReadFrame(ReadReceipt):
+    """A "read" event sent over the chat socket."""
+    other_user_id: str = Field(min_length=1)
+
+class Thread(BaseModel):
+    id: str
+    other_user_id: str
+    other_user_name: str
+    other_user_avatar: Optional[str] = None
+    last_message: str
+    last_message_time: datetime
+    unread_count: int
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int = Field(gt=0)
+    content_type: Optional[str] = None
+
+class UploadSession(BaseModel):
+    upload_id: str
+    filename: str
+    size: int
+    received: int
+    chunk_size: int
+
+class Wishlist(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    listing_id: str
+    created_at: datetime = created_at_field()
+
+class WishlistBatch(BaseModel):
+    add: List[str] = Field(default=[], max_length=MAX_PAGE_SIZE)
+    remove: List[str] = Field(default=[], max_length=MAX_PAGE_SIZE)
+
+class PaymentTransaction(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    session_id: str
+    order_id: str
+    buyer_id: str
+    amount: float
+    currency: str = "usd"
+    payment_status: str = "pending"
+    session_status: str = "open"
+    metadata: Dict[str, Any] = {}
+    created_at: datetime = created_at_field()
+
+# ============ Serialization ============
+
+def as_utc(value) -> Optional[datetime]:
+    """Normalize a stored date (datetime, naive UTC datetime or legacy ISO string) to an aware datetime."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def orjson_default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError
+
+def dump_json(value) -> bytes:
+    return orjson.dumps(value, default=orjson_default, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC)
+
+class LeanSerializer:
+    """Encodes stored documents in a response model's JSON shape without building models.
+
+    Reads project just the model's fields, "timestamp" is renamed to
+    created_at, and defaults are filled in for fields older documents lack.
+    Values are trusted as written by the API, so nothing is re-validated.
+    """
+
+    def __init__(self, model):
+        self.fields = list(model.model_fields)
+        self.projection = {"_id": 0, **{("timestamp" if name == "created_at" else name): 1 for name in self.fields}}
+        self.defaults = {
+            name: field.get_default(call_default_factory=True)
+            for name, field in model.model_fields.items()
+            if not field.is_required() and name not in ("id", "created_at")
+        }
+
+    def prepare(self, doc: dict) -> dict:
+        if "timestamp" in doc:
+            doc["created_at"] = doc.pop("timestamp")
+        for name, default in self.defaults.items():
+            if name not in doc:
+                doc[name] = default
+        return doc
+
+    def dumps(self, docs: List[dict]) -> bytes:
+        with trace_span("serialize", documents=len(docs)):
+            return dump_json([self.prepare(doc) for doc in docs])
+
+    def dumps_one(self, doc: dict) -> bytes:
+        return dump_json(self.prepare(doc))
+
+listing_serializer = LeanSerializer(Listing)
+review_serializer = LeanSerializer(Review)
+order_serializer = LeanSerializer(Order)
+message_serializer = LeanSerializer(Message)
+
+def json_page_response(body: bytes, next_cursor: Optional[str] = None) -> Response:
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ============ Caching ============
+
+class TTLCache:
+    """Process-local LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+_redis = None
+
+def get_redis():
+    """Shared Redis client when REDIS_URL is configured, otherwise None."""
+    global _redis
+    if not REDIS_URL:
+        return None
+    if aioredis is None:
+        raise RuntimeError("REDIS_URL is set but the redis package is not installed")
+    if _redis is None:
+        _redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+    return _redis
+
+class UserCache:
+    """Caches user documents (without password) by id.
+
+    A process-local TTL/LRU layer sits in front of an optional Redis layer shared
+    by all workers. Invalidation clears both; other workers' local copies expire
+    within USER_CACHE_TTL_SECONDS.
+    """
+    KEY_PREFIX = "user:"
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.local = TTLCache(max_entries, ttl)
+        self.ttl = ttl
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        user = self.local.get(user_id)
+        if user is not None:
+            return user
+        shared = get_redis()
+        if shared is None:
+            return None
+        try:
+            raw = await shared.get(self.KEY_PREFIX + user_id)
+        except Exception as e:
+            logger.warning(f"Shared user cache read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        user = json.loads(raw)
+        self.local.set(user_id, user)
+        return user
+
+    async def set(self, user_id: str, user: dict):
+        self.local.set(user_id, user)
+        shared = get_redis()
+        if shared is None:
+            return
+        try:
+            await shared.set(self.KEY_PREFIX + user_id, json.dumps(user, default=str), ex=int(self.ttl))
+        except Exception as e:
+            logger.warning(f"Shared user cache write failed: {e}")
+
+    async def invalidate(self, user_id: str):
+        self.local.delete(user_id)
+        shared = get_redis()
+        if shared is None:
+            return
+        try:
+            await shared.delete(self.KEY_PREFIX + user_id)
+        except Exception as e:
+            logger.warning(f"Shared user cache invalidation failed: {e}")
+
+user_cache = UserCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+class ResponseCache:
+    """Caches serialized bodies of public read endpoints.
+
+    Keys combine the endpoint, its normalized parameters and the current
+    version of every tag the response depends on ("listings" for list pages,
+    "listing:{id}", "reviews:{id}"). Invalidating a tag bumps its version, so
+    dependent entries are never read again and simply age out. With REDIS_URL
+    the versions and entries are shared, so invalidation reaches every worker;
+    without it other workers may serve a stale page for up to the TTL.
+    """
+    KEY_PREFIX = "resp:"
+    VERSION_PREFIX = "resp:version:"
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.local = TTLCache(max_entries, ttl)
+        self.ttl = ttl
+        self.versions: Dict[str, int] = {}
+
+    async def tag_versions(self, tags: List[str]) -> Optional[List[int]]:
+        shared = get_redis()
+        if shared is None:
+            return [self.versions.get(tag, 0) for tag in tags]
+        try:
+            values = await shared.mget([self.VERSION_PREFIX + tag for tag in tags])
+        except Exception as e:
+            logger.warning(f"Response cache version read failed: {e}")
+            return None
+        return [int(v or 0) for v in values]
+
+    async def lookup(self, endpoint: str, params: dict, tags: List[str]) -> Tuple[Optional[str], Optional[dict]]:
+        """Return (key, entry); key is None when caching is disabled or unavailable."""
+        if self.ttl <= 0:
+            return None, None
+        versions = await self.tag_versions(tags)
+        if versions is None:
+            return None, None
+        normalized = urlencode(sorted((k, str(v)) for k, v in params.items() if v is not None))
+        key = f"{endpoint}?{normalized}#{'.'.join(map(str, versions))}"
+        
+        entry = self.local.get(key)
+        shared = get_redis()
+        if entry is not None or shared is None:
+            return key, entry
+        try:
+            raw = await shared.get(self.KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"Shared response cache read failed: {e}")
+            return key, None
+        if raw is None:
+            return key, None
+        entry = json.loads(raw)
+        self.local.set(key, entry)
+        return key, entry
+
+    async def store(self, key: Optional[str], body: bytes, headers: Dict[str, str]) -> dict:
+        entry = {"body": body.decode(), "etag": f'"{hashlib.sha1(body).hexdigest()}"', "headers": headers}
+        if key is None:
+            return entry
+        self.local.set(key, entry)
+        shared = get_redis()
+        if shared is not None:
+            try:
+                await shared.set(self.KEY_PREFIX + key, json.dumps(entry), ex=max(1, int(self.ttl)))
+            except Exception as e:
+                logger.warning(f"Shared response cache write failed: {e}")
+        return entry
+
+    async def invalidate(self, *tags: str):
+        for tag in tags:
+            self.versions[tag] = self.versions.get(tag, 0) + 1
+        shared = get_redis()
+        if shared is None:
+            return
+        try:
+            async with shared.pipeline(transaction=False) as pipe:
+                for tag in tags:
+                    pipe.incr(self.VERSION_PREFIX + tag)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Shared response cache invalidation failed: {e}")
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+
+async def invalidate_listing(*listing_ids: str):
+    """Drop cached responses showing these listings, including every list page."""
+    await response_cache.invalidate("listings", *(f"listing:{listing_id}" for listing_id in listing_ids))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]
+
+def cached_json_response(request: Request, entry: dict) -> Response:
+    # no-cache lets the browser keep the body but revalidate it with If-None-Match every time
+    headers = {**entry['headers'], "ETag": entry['etag'], "Cache-Control": "no-cache"}
+    if etag_matches(request, entry['etag']):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry['body'], media_type="application/json", headers=headers)
+
+# ============ Auth Helpers ============
+
+password_pool: Optional[ThreadPoolExecutor] = None
+# Bounds work queued behind the pool; beyond it requests fail fast instead of piling up
+password_slots = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+
+def get_password_pool() -> ThreadPoolExecutor:
+    global password_pool
+    if password_pool is None:
+        password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return password_pool
+
+async def run_password_job(func, *args):
+    if password_slots.locked():
+        raise HTTPException(status_code=503, detail="Too many authentication requests, please retry",
+                            headers={"Retry-After": "1"})
+    async with password_slots:
+        loop = asyncio.get_running_loop()
+        with trace_span("password_hash"):
+            return await loop.run_in_executor(get_password_pool(), func, *args)
+
+async def hash_password(password: str) -> str:
+    return await run_password_job(pwd_context.hash, password)
+
+async def verify_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Check a password off the event loop.
+
+    Returns (valid, new_hash); new_hash is set when the stored hash uses an
+    outdated scheme or cost factor and should be replaced.
+    """
+    if not hashed_password:
+        return False, None
+    try:
+        return await run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+    except ValueError:
+        return False, None
+
+def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + expires_delta
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def create_user_token(user: User) -> str:
+    # name and role ride along as signed claims so read-only routes can skip the user lookup.
+    return create_access_token({"user_id": user.id, "email": user.email, "name": user.name, "role": user.role})
+
+def decode_token(authorization: Optional[str]) -> dict:
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    token = authorization.split(" ")[1]
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    if not payload.get("user_id"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+async def load_user(user_id: str) -> Optional[User]:
+    user = await user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+        if not user:
+            return None
+        await user_cache.set(user_id, user)
+    return User(**user)
+
+async def get_current_user(authorization: str = Header(None)):
+    payload = decode_token(authorization)
+    user = await load_user(payload["user_id"])
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+async def get_token_user(authorization: str = Header(None)):
+    """Identity for read-only routes that only need id, name and role.
+
+    With TRUST_TOKEN_CLAIMS enabled the user is built from the signed token
+    alone; tokens issued before the claims were added fall back to a lookup.
+    """
+    payload = decode_token(authorization)
+    if TRUST_TOKEN_CLAIMS and all(payload.get(k) for k in ("email", "name", "role")):
+        return User(id=payload["user_id"], email=payload["email"], name=payload["name"], role=payload["role"])
+    
+    user = await load_user(payload["user_id"])
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+# ============ Search Index ============
+
+# Runs of letters and digits in any script; underscores separate words
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+def tokenize(text: str) -> List[str]:
+    """Casefolded words with accents stripped, so "Crème" and "creme" index alike."""
+    decomposed = unicodedata.normalize("NFKD", (text or "").casefold())
+    # Dropping every mark, not only accents, keeps e.g. Devanagari vowel signs from splitting words
+    stripped = "".join(c for c in decomposed if not unicodedata.category(c).startswith("M"))
+    # Recompose what is left, e.g. Hangul syllables, so terms stay whole characters
+    return TOKEN_RE.findall(unicodedata.normalize("NFC", stripped))
+
+def _deletes(term: str) -> set:
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True if a and b differ by at most one insert, delete, substitution or adjacent swap."""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    if la == lb:
+        diffs = [i for i in range(la) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return len(diffs) == 2 and diffs[1] == diffs[0] + 1 and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]]
+    if la > lb:
+        a, b = b, a
+    return any(a == b[:i] + b[i + 1:] for i in range(len(b)))
+
+class SearchIndex:
+    """In-process inverted index over listings.
+
+    Postings hold field-weighted term frequencies so title, tag and category hits
+    outrank description hits. Query terms are expanded to prefix matches (search as
+    you type) and to single-edit typo matches via a deletion neighbourhood.
+    """
+    FIELD_WEIGHTS = {"title": 3.0, "tags": 2.5, "category": 2.0, "description": 1.0}
+    EXACT_WEIGHT = 1.0
+    PREFIX_WEIGHT = 0.7
+    TYPO_WEIGHT = 0.5
+    MAX_EXPANSIONS = 50
+    MIN_PREFIX_LEN = 2
+    MIN_TYPO_LEN = 4
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.doc_terms: Dict[str, set] = {}
+        self.doc_category: Dict[str, str] = {}
+        self.delete_map: Dict[str, set] = {}
+        self._sorted_terms: List[str] = []
+        self._terms_dirty = False
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def add(self, listing: dict):
+        listing_id = listing['id']
+        self.remove(listing_id)
+
+        weights: Dict[str, float] = {}
+        fields = {
+            "title": listing.get('title', ''),
+            "description": listing.get('description', ''),
+            "category": listing.get('category', ''),
+            "tags": " ".join(listing.get('tags') or []),
+        }
+        for field, text in fields.items():
+            for term in tokenize(text):
+                weights[term] = weights.get(term, 0.0) + self.FIELD_WEIGHTS[field]
+
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self.postings[term] = {}
+                self._terms_dirty = True
+                for d in _deletes(term):
+                    self.delete_map.setdefault(d, set()).add(term)
+            self.postings[term][listing_id] = weight
+
+        self.doc_terms[listing_id] = set(weights)
+        self.doc_category[listing_id] = listing.get('category', '')
+
+    def remove(self, listing_id: str):
+        terms = self.doc_terms.pop(listing_id, None)
+        self.doc_category.pop(listing_id, None)
+        if not terms:
+            return
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(listing_id, None)
+            if not docs:
+                del self.postings[term]
+                self._terms_dirty = True
+                for d in _deletes(term):
+                    bucket = self.delete_map.get(d)
+                    if bucket:
+                        bucket.discard(term)
+                        if not bucket:
+                            del self.delete_map[d]
+
+    def _prefix_terms(self, token: str) -> List[str]:
+        if self._terms_dirty:
+            self._sorted_terms = sorted(self.postings)
+            self._terms_dirty = False
+        start = bisect.bisect_left(self._sorted_terms, token)
+        matches = []
+        for term in self._sorted_terms[start:start + self.MAX_EXPANSIONS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                matches.append(term)
+        return matches
+
+    def _typo_terms(self, token: str) -> List[str]:
+        candidates = set(self.delete_map.get(token, ()))
+        for d in _deletes(token):
+            if d in self.postings:
+                candidates.add(d)
+            candidates.update(self.delete_map.get(d, ()))
+        candidates.discard(token)
+        return [t for t in candidates if _within_one_edit(token, t)][:self.MAX_EXPANSIONS]
+
+    def _expand(self, token: str) -> Dict[str, float]:
+        expansions: Dict[str, float] = {}
+        if token in self.postings:
+            expansions[token] = self.EXACT_WEIGHT
+        if len(token) >= self.MIN_PREFIX_LEN:
+            for term in self._prefix_terms(token):
+                expansions.setdefault(term, self.PREFIX_WEIGHT)
+        if len(token) >= self.MIN_TYPO_LEN:
+            for term in self._typo_terms(token):
+                expansions.setdefault(term, self.TYPO_WEIGHT)
+        return expansions
+
+    def search(self, query: str, category: Optional[str] = None) -> List[tuple]:
+        """Return (listing_id, score) pairs matching every query token, best first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        total_docs = max(len(self.doc_terms), 1)
+        scores: Optional[Dict[str, float]] = None
+        for token in tokens:
+            token_scores: Dict[str, float] = {}
+            for term, match_weight in self._expand(token).items():
+                docs = self.postings[term]
+                idf = math.log(1 + (total_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                for listing_id, weight in docs.items():
+                    score = idf * weight * match_weight
+                    if score > token_scores.get(listing_id, 0.0):
+                        token_scores[listing_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {k: v + token_scores[k] for k, v in scores.items() if k in token_scores}
+            if not scores:
+                return []
+
+        if category:
+            scores = {k: v for k, v in scores.items() if self.doc_category.get(k) == category}
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+SEARCH_FIELDS = {"_id": 0, "id": 1, "title": 1, "description": 1, "category": 1, "tags": 1}
+
+search_index = SearchIndex()
+
+async def rebuild_search_index():
+    global search_index
+    index = SearchIndex()
+    async for listing in db.listings.find({}, SEARCH_FIELDS):
+        index.add(listing)
+    search_index = index
+    logger.info(f"Search index built with {len(index)} listings")
+
+async def refresh_search_index_periodically():
+    # Each worker keeps its own index; periodic rebuilds pick up writes made on other workers.
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_REFRESH_SECONDS)
+        try:
+            await rebuild_search_index()
+        except Exception as e:
+            logger.error(f"Search index refresh failed: {e}")
+
+# ============ Indexes ============
+
+# Every query shape used by the routes below should be covered here; run
+# `python manage.py audit-queries` after changing a query to check it still
+# avoids a COLLSCAN.
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("name_key", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("role", ASCENDING), ("name_key", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("search_keys", ASCENDING)]),
+    ],
+    "listings": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("timestamp", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("category", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("price", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("rating", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("seller_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("images", ASCENDING)]),
+    ],
+    "reviews": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("listing_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("buyer_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("seller_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("reserved_until", ASCENDING)]),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("sender_id", ASCENDING), ("receiver_id", ASCENDING), ("seq", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("conversation_id", ASCENDING), ("seq", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "wishlist": [
+        IndexModel([("user_id", ASCENDING), ("listing_id", ASCENDING)], unique=True),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "conversations": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("participants", ASCENDING), ("last_message_time", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "upload_sessions": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "image_variants": [
+        IndexModel([("key", ASCENDING)], unique=True),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], unique=True),
+        IndexModel([("order_id", ASCENDING)]),
+    ],
+    "stripe_events": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("received_at", ASCENDING)], expireAfterSeconds=STRIPE_EVENT_RETENTION_SECONDS),
+    ],
+    "analytics_hourly": [
+        IndexModel([("seller_id", ASCENDING), ("start", ASCENDING)], unique=True),
+        IndexModel([("start", ASCENDING)], expireAfterSeconds=ANALYTICS_HOURLY_RETENTION_DAYS * 24 * 3600),
+    ],
+    "analytics_daily": [
+        IndexModel([("seller_id", ASCENDING), ("start", ASCENDING)], unique=True),
+    ],
+}
+
+async def ensure_indexes():
+    """Create the declared indexes. create_indexes is a no-op for indexes that already exist."""
+    for collection_name, indexes in INDEXES.items():
+        try:
+            names = await db[collection_name].create_indexes(indexes)
+            logger.info(f"Indexes ready on {collection_name}: {', '.join(names)}")
+        except PyMongoError as e:
+            # Most likely existing duplicates blocking a unique index; keep serving and surface it.
+            logger.error(f"Failed to create indexes on {collection_name}: {e}")
+
+# ============ Data Migrations ============
+
+# Date fields that earlier versions stored as ISO strings.
+DATETIME_FIELDS = {
+    "users": ["timestamp"],
+    "listings": ["timestamp"],
+    "reviews": ["timestamp"],
+    "orders": ["timestamp"],
+    "messages": ["timestamp"],
+    "wishlist": ["timestamp"],
+    "conversations": ["last_message_time"],
+    "payment_transactions": ["timestamp", "status_checked_at"],
+}
+
+def string_dates_query(fields: List[str]) -> dict:
+    return {"$or": [{field: {"$type": "string"}} for field in fields]}
+
+async def migrate_datetime_fields(batch_size: int = 1000) -> Dict[str, int]:
+    """Rewrite ISO-string dates as native BSON datetimes. Safe to re-run.
+
+    Returns the number of documents converted per collection. Sorting and
+    range queries on these fields assume one type; startup runs this when
+    any string dates remain.
+    """
+    converted = {}
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        query = string_dates_query(fields)
+        count = 0
+        ops = []
+        async for doc in collection.find(query, {"_id": 1, **{field: 1 for field in fields}}):
+            update = {field: as_utc(doc[field]) for field in fields if isinstance(doc.get(field), str)}
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+            if len(ops) >= batch_size:
+                await collection.bulk_write(ops, ordered=False)
+                count += len(ops)
+                ops = []
+        if ops:
+            await collection.bulk_write(ops, ordered=False)
+            count += len(ops)
+        converted[collection_name] = count
+    return converted
+
+async def backfill_directory_fields(batch_size: int = 1000) -> int:
+    """Add user directory search keys to users registered before the directory existed. Safe to re-run."""
+    count = 0
+    ops = []
+    query = {"$or": [{"name_key": {"$exists": False}}, {"search_keys": {"$exists": False}}]}
+    async for user in db.users.find(query, {"_id": 1, "name": 1, "email": 1}):
+        ops.append(UpdateOne({"_id": user["_id"]}, {"$set": directory_fields(user.get("name") or "", user["email"])}))
+        if len(ops) >= batch_size:
+            await db.users.bulk_write(ops, ordered=False)
+            count += len(ops)
+            ops = []
+    if ops:
+        await db.users.bulk_write(ops, ordered=False)
+        count += len(ops)
+    return count
+
+async def backfill_message_sequence(batch_size: int = 1000) -> int:
+    """Add conversation_id and seq to messages stored before chat history paged by seq. Safe to re-run.
+
+    Old messages get a seq from their timestamp, on the same clock MessageWriter
+    uses, so they sort before anything sent after the upgrade.
+    """
+    count = 0
+    ops = []
+    query = {"$or": [{"conversation_id": {"$exists": False}}, {"seq": None}]}
+    projection = {"_id": 1, "sender_id": 1, "receiver_id": 1, "timestamp": 1, "seq": 1}
+    async for message in db.messages.find(query, projection):
+        fields = {"conversation_id": conversation_id(message["sender_id"], message["receiver_id"])}
+        if message.get("seq") is None:
+            fields["seq"] = clock_seq(message["timestamp"])
+        ops.append(UpdateOne({"_id": message["_id"]}, {"$set": fields}))
+        if len(ops) >= batch_size:
+            await db.messages.bulk_write(ops, ordered=False)
+            count += len(ops)
+            ops = []
+    if ops:
+        await db.messages.bulk_write(ops, ordered=False)
+        count += len(ops)
+    return count
+
+# ============ User Directory ============
+
+# Directory pages never carry emails, roles or password hashes.
+DIRECTORY_PROJECTION = {"_id": 0, "id": 1, "name": 1, "avatar": 1, "name_key": 1}
+
+def directory_key(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+def directory_fields(name: str, email: str) -> dict:
+    """Sort key and prefix-search keys: the full name, each later part of it, and the email."""
+    name_key = directory_key(name)
+    words = name_key.split(" ")
+    search_keys = {" ".join(words[i:]) for i in range(len(words))} | {email.casefold()}
+    return {"name_key": name_key, "search_keys": sorted(search_keys)}
+
+async def directory_entries(users: List[dict]) -> List[dict]:
+    """Shape projected user documents as DirectoryUser dicts, with one presence lookup for the page."""
+    online = set(await connection_manager.backplane.filter_online([u['id'] for u in users]))
+    for user in users:
+        user.pop('name_key', None)
+        user.setdefault('avatar', None)
+        user['online'] = user['id'] in online
+    return users
+
+# ============ Pagination ============
+
+LISTING_SORTS = {
+    "newest": ("timestamp", -1),
+    "price_asc": ("price", 1),
+    "price_desc": ("price", -1),
+    "rating": ("rating", -1),
+}
+
+def encode_cursor(values: list) -> str:
+    values = [{"$date": as_utc(v).isoformat()} if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        return [datetime.fromisoformat(v["$date"]) if isinstance(v, dict) else v for v in values]
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_after(sort_field: str, direction: int, value, last_id: str) -> dict:
+    """Match documents strictly after (value, last_id) in (sort_field, id) order."""
+    op = "$gt" if direction == 1 else "$lt"
+    return {"$or": [
+        {sort_field: {op: value}},
+        {sort_field: value, "id": {op: last_id}},
+    ]}
+
+def keyset_condition(sort_field: str, direction: int, cursor: str) -> dict:
+    value, last_id = decode_cursor(cursor)
+    return keyset_after(sort_field, direction, value, last_id)
+
+def combine_conditions(conditions: List[dict]) -> dict:
+    conditions = [c for c in conditions if c]
+    if not conditions:
+        return {}
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+async def fetch_page(collection, conditions: List[dict], sort_field: str, direction: int,
+                     limit: int, cursor: Optional[str] = None, projection: Optional[dict] = None):
+    """Keyset-paginate a collection on (sort_field, id). Returns (docs, next_cursor)."""
+    if cursor:
+        conditions = conditions + [keyset_condition(sort_field, direction, cursor)]
+    docs = await collection.find(
+        combine_conditions(conditions), projection or {"_id": 0}
+    ).sort([(sort_field, direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor([docs[-1].get(sort_field), docs[-1]['id']])
+    return docs, next_cursor
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+
+# ============ Rating Aggregates ============
+
+def average_rating(rating_sum: float, count: int) -> float:
+    return round(rating_sum / count, 1) if count else 0.0
+
+async def apply_review_rating(listing_id: str, rating: int):
+    """Fold one new review into the listing's running sum, count and histogram."""
+    updated = await db.listings.find_one_and_update(
+        {"id": listing_id},
+        {"$inc": {"rating_sum": rating, "reviews_count": 1, f"rating_histogram.{rating}": 1}},
+        projection={"_id": 0, "rating_sum": 1, "reviews_count": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not updated:
+        return
+    # Only write the average if no later review has bumped the count since; that
+    # review's own update will store the newer average.
+    await db.listings.update_one(
+        {"id": listing_id, "reviews_count": updated['reviews_count']},
+        {"$set": {"rating": average_rating(updated['rating_sum'], updated['reviews_count'])}}
+    )
+
+async def reconcile_rating_aggregates(listing_ids: Optional[List[str]] = None, batch_size: int = 500) -> int:
+    """Rebuild rating aggregates from the reviews collection.
+
+    Reconciles the given listings, or every listing when listing_ids is None.
+    Returns the number of listings with reviews that were rewritten.
+    """
+    pipeline = []
+    if listing_ids is not None:
+        pipeline.append({"$match": {"listing_id": {"$in": listing_ids}}})
+    pipeline += [
+        {"$group": {"_id": {"listing_id": "$listing_id", "rating": "$rating"}, "count": {"$sum": 1}}},
+        {"$sort": {"_id.listing_id": 1}},
+    ]
+
+    reconciled = 0
+    seen_ids = set()
+    ops = []
+    current_id = None
+    histogram = empty_rating_histogram()
+
+    def flush_listing():
+        count = sum(histogram.values())
+        rating_sum = sum(int(r) * n for r, n in histogram.items())
+        ops.append(UpdateOne({"id": current_id}, {"$set": {
+            "rating_sum": rating_sum,
+            "reviews_count": count,
+            "rating_histogram": histogram,
+            "rating": average_rating(rating_sum, count),
+        }}))
+
+    async for row in db.reviews.aggregate(pipeline):
+        listing_id = row['_id']['listing_id']
+        if listing_id != current_id:
+            if current_id is not None:
+                flush_listing()
+                reconciled += 1
+            current_id = listing_id
+            seen_ids.add(listing_id)
+            histogram = empty_rating_histogram()
+        rating = str(row['_id']['rating'])
+        if rating in histogram:
+            histogram[rating] += row['count']
+        if len(ops) >= batch_size:
+            await db.listings.bulk_write(ops, ordered=False)
+            ops = []
+    if current_id is not None:
+        flush_listing()
+        reconciled += 1
+    if ops:
+        await db.listings.bulk_write(ops, ordered=False)
+
+    zeroed = {"rating_sum": 0, "reviews_count": 0, "rating_histogram": empty_rating_histogram(), "rating": 0.0}
+    if listing_ids is None:
+        await db.listings.update_many({"rating_sum": {"$exists": False}}, {"$set": zeroed})
+    else:
+        unreviewed = [listing_id for listing_id in listing_ids if listing_id not in seen_ids]
+        if unreviewed:
+            await db.listings.update_many({"id": {"$in": unreviewed}}, {"$set": zeroed})
+    await invalidate_listing(*seen_ids, *(listing_ids or []))
+    return reconciled
+
+# ============ Conversations ============
+
+# One document per pair of users, kept current by chat_endpoint so the inbox
+# is a single indexed query instead of a scan over message histories.
+
+def conversation_id(user_a: str, user_b: str) -> str:
+    return ":".join(sorted([user_a, user_b]))
+
+def message_preview(message_doc: dict) -> str:
+    return message_doc.get('message') or message_doc.get('file_name') or ""
+
+def conversation_update(message_doc: dict) -> UpdateOne:
+    sender_id = message_doc['sender_id']
+    receiver_id = message_doc['receiver_id']
+    update = {
+        "$set": {
+            "participants": sorted([sender_id, receiver_id]),
+            "last_message": message_preview(message_doc),
+            "last_message_id": message_doc['id'],
+            "last_sender_id": sender_id,
+            "last_message_time": as_utc(message_doc['timestamp']),
+        },
+        "$inc": {f"unread.{receiver_id}": 1},
+        "$setOnInsert": {f"unread.{sender_id}": 0},
+    }
+    if sender_id == receiver_id:
+        # A note to self is never unread; MongoDB rejects $inc and $setOnInsert on one path
+        del update["$inc"]
+    return UpdateOne({"id": conversation_id(sender_id, receiver_id)}, update, upsert=True)
+
+async def record_conversation_message(message_doc: dict):
+    await db.conversations.bulk_write([conversation_update(message_doc)])
+
+async def find_message_anchor(message_id: str, query: dict) -> dict:
+    anchor = await db.messages.find_one({"id": message_id, **query}, {"_id": 0, "id": 1, "seq": 1})
+    if not anchor:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return anchor
+
+async def mark_conversation_read(reader_id: str, other_user_id: str, up_to_id: Optional[str] = None) -> dict:
+    """Mark messages from other_user_id to reader_id as read, up to and including up_to_id.
+
+    Without up_to_id everything received so far is marked read. The sender is
+    notified with a single "read" event per batch.
+    """
+    incoming = {"sender_id": other_user_id, "receiver_id": reader_id}
+    query = {**incoming, "read": False}
+    if up_to_id:
+        anchor = await find_message_anchor(up_to_id, incoming)
+        query["$or"] = [
+            {"seq": {"$lt": anchor['seq']}},
+            {"seq": anchor['seq'], "id": {"$lte": anchor['id']}},
+        ]
+    
+    result = await db.messages.update_many(query, {"$set": {"read": True}})
+    unread_count = await db.messages.count_documents({**incoming, "read": False}) if up_to_id else 0
+    await db.conversations.update_one(
+        {"id": conversation_id(reader_id, other_user_id)},
+        {"$set": {f"unread.{reader_id}": unread_count}}
+    )
+    
+    if result.modified_count:
+        await connection_manager.send_personal_message(other_user_id, {"type": "read", "data": {
+            "reader_id": reader_id,
+            "up_to_id": up_to_id,
+            "read_at": datetime.now(timezone.utc).isoformat(),
+        }})
+    return {"marked_read": result.modified_count, "unread_count": unread_count}
+
+async def rebuild_conversations() -> int:
+    """Rebuild the conversations collection from the messages collection."""
+    pipeline = [
+        {"$sort": {"seq": 1, "id": 1}},
+        {"$group": {
+            "_id": {"a": {"$min": ["$sender_id", "$receiver_id"]}, "b": {"$max": ["$sender_id", "$receiver_id"]}},
+            "last": {"$last": "$$ROOT"},
+            "unread": {"$push": {"$cond": [{"$eq": ["$read", False]}, "$receiver_id", "$$REMOVE"]}},
+        }},
+    ]
+    ops = []
+    rebuilt = 0
+    async for row in db.messages.aggregate(pipeline, allowDiskUse=True):
+        a, b = row['_id']['a'], row['_id']['b']
+        last = row['last']
+        unread = {a: 0, b: 0}
+        for receiver_id in row['unread'] if a != b else []:
+            unread[receiver_id] = unread.get(receiver_id, 0) + 1
+        ops.append(UpdateOne({"id": conversation_id(a, b)}, {"$set": {
+            "participants": [a, b],
+            "last_message": message_preview(last),
+            "last_message_id": last['id'],
+            "last_sender_id": last['sender_id'],
+            "last_message_time": as_utc(last['timestamp']),
+            "unread": unread,
+        }}, upsert=True))
+        rebuilt += 1
+        if len(ops) >= 500:
+            await db.conversations.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.conversations.bulk_write(ops, ordered=False)
+    return rebuilt
+
+# ============ Message Persistence ============
+
+class MessageWriter:
+    """Persists chat messages, optionally write-behind.
+
+    Every message gets a seq that strictly increases within its conversation
+    (a hybrid clock: microseconds since the epoch, bumped past the last seq
+    issued here). With CHAT_WRITE_BEHIND disabled, submit() inserts directly.
+
+    When it is enabled, submit() appends the message to a local journal segment
+    and returns. A flusher task writes the buffer with insert_many, in arrival
+    order, once CHAT_FLUSH_MAX_BATCH messages are pending or
+    CHAT_FLUSH_INTERVAL_SECONDS have passed, and deletes the segment once the
+    batch is stored. The writer holds an exclusive lock on each segment until
+    it is deleted, so segments that can be locked were left behind by a worker
+    that has exited; those are replayed at startup. The unique message id
+    index makes replays idempotent.
+    """
+
+    def __init__(self, enabled: bool = CHAT_WRITE_BEHIND, journal_dir: Path = CHAT_JOURNAL_DIR,
+                 max_batch: int = CHAT_FLUSH_MAX_BATCH, interval: float = CHAT_FLUSH_INTERVAL_SECONDS):
+        self.enabled = enabled
+        self.journal_dir = journal_dir
+        self.max_batch = max_batch
+        self.interval = interval
+        self.pending: List[dict] = []
+        self.last_seq = TTLCache(max_entries=100000, ttl=3600)
+        # Names this worker's segments; unlike a PID it is never reused
+        self.writer_id = uuid.uuid4().hex[:12]
+        self.segment_number = 0
+        self.segment = None
+        # (path, open file) for sealed segments, kept open and locked until deleted
+        self.sealed_segments: List[tuple] = []
+        self.wakeup = asyncio.Event()
+        self.flusher: Optional[asyncio.Task] = None
+        self.flush_lock = asyncio.Lock()
+
+    def next_seq(self, message_doc: dict) -> int:
+        key = conversation_id(message_doc['sender_id'], message_doc['receiver_id'])
+        seq = max(time.time_ns() // 1000, (self.last_seq.get(key) or 0) + 1)
+        self.last_seq.set(key, seq)
+        return seq
+
+    def _segment_path(self, number: int) -> Path:
+        return self.journal_dir / f"journal-{self.writer_id}-{number:08d}.ndjson"
+
+    def _open_segment(self):
+        self.segment_number += 1
+        # Locked under a name recovery ignores, so it never sees an unlocked live segment
+        staging_path = self.journal_dir / f"staging-{self.writer_id}"
+        self.segment = open(staging_path, "a", encoding="utf-8")
+        lock_segment(self.segment)
+        os.replace(staging_path, self._segment_path(self.segment_number))
+
+    async def start(self):
+        if not self.enabled:
+            return
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        await self.recover()
+        self._open_segment()
+        self.flusher = asyncio.create_task(self._flush_loop())
+
+    async def submit(self, message_doc: dict):
+        message_doc['seq'] = self.next_seq(message_doc)
+        if not self.enabled:
+            await db.messages.insert_one(stored_message(message_doc))
+            await record_conversation_message(message_doc)
+            return
+        self.segment.write(json.dumps(message_doc) + "\n")
+        self.segment.flush()
+        self.pending.append(message_doc)
+        if len(self.pending) >= self.max_batch:
+            self.wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Chat message flush failed, will retry: {e}")
+
+    async def flush(self):
+        async with self.flush_lock:
+            if self.pending:
+                batch, self.pending = self.pending, []
+                # Seal the segment holding this batch; new messages go to a fresh one.
+                self.sealed_segments.append((self._segment_path(self.segment_number), self.segment))
+                self._open_segment()
+                try:
+                    await self.persist(batch)
+                except Exception:
+                    self.pending = batch + self.pending
+                    raise
+            for path, segment in self.sealed_segments:
+                path.unlink(missing_ok=True)
+                segment.close()
+            self.sealed_segments = []
+
+    async def persist(self, batch: List[dict]):
+        """insert_many the batch, then apply conversation updates for the messages actually inserted."""
+        inserted = batch
+        try:
+            await db.messages.insert_many([stored_message(m) for m in batch], ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            duplicates = {err["index"] for err in errors}
+            inserted = [m for i, m in enumerate(batch) if i not in duplicates]
+        if inserted:
+            await db.conversations.bulk_write([conversation_update(m) for m in inserted], ordered=True)
+
+    def _claim_segment(self, path: Path) -> Optional[tuple]:
+        """Take over a segment whose writer has exited. Returns (claimed path, open file) or None.
+
+        The atomic rename means that when several workers start together, each
+        segment is claimed by exactly one of them; the others find it gone.
+        """
+        try:
+            segment = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        claimed_path = self.journal_dir / f"replay-{self.writer_id}-{path.name}"
+        try:
+            if not lock_segment(segment, blocking=False):
+                segment.close()
+                return None
+            os.rename(path, claimed_path)
+        except OSError:
+            # Renamed by another worker first, or (on Windows) still open in a live one
+            segment.close()
+            return None
+        return claimed_path, segment
+
+    async def recover(self):
+        """Replay journal segments left by workers that are no longer running.
+
+        This includes segments another worker claimed but died before finishing.
+        """
+        for path in sorted(self.journal_dir.glob("*.ndjson")):
+            claimed = self._claim_segment(path)
+            if claimed is None:
+                continue
+            claimed_path, segment = claimed
+            try:
+                batch = [json.loads(line) for line in segment if line.strip()]
+                for i in range(0, len(batch), self.max_batch):
+                    await self.persist(batch[i:i + self.max_batch])
+                claimed_path.unlink(missing_ok=True)
+            finally:
+                segment.close()
+            logger.info(f"Replayed {len(batch)} journaled chat messages from {path.name}")
+
+    async def close(self):
+        """Flush everything still buffered; called from the shutdown hook."""
+        if not self.enabled:
+            return
+        if self.flusher is not None:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+        await self.flush()
+        self._segment_path(self.segment_number).unlink(missing_ok=True)
+        self.segment.close()
+
+def lock_segment(segment, blocking: bool = True) -> bool:
+    """Exclusively lock an open journal segment; the OS releases it when the holder exits.
+
+    Without fcntl (Windows) this is a no-op: an open file cannot be renamed
+    there, which is what keeps _claim_segment off live segments.
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        return False
+    return True
+
+def clock_seq(moment: datetime) -> int:
+    """Microseconds since the epoch: the clock MessageWriter.next_seq starts from."""
+    return (as_utc(moment) - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1)
+
+def stored_message(message_doc: dict) -> dict:
+    # Chat frames and the journal carry ISO timestamps; MongoDB gets a native datetime.
+    return {
+        **message_doc,
+        "conversation_id": conversation_id(message_doc['sender_id'], message_doc['receiver_id']),
+        "timestamp": as_utc(message_doc['timestamp']),
+    }
+
+message_writer = MessageWriter()
+
+# ============ File Storage ============
+
+class StorageBackend:
+    """Content-addressed blob storage for uploads.
+
+    Keys are derived from the content hash, so storing the same bytes twice
+    keeps a single copy.
+    """
+
+    async def store(self, temp_path: Path, key: str) -> bool:
+        """Move a completed temp file into storage under key. Returns False if the key already existed."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> str:
+        raise NotImplementedError
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        """The storage key behind a URL this backend issued, or None for foreign URLs."""
+        raise NotImplementedError
+
+    def path(self, key: str) -> Path:
+        """A local filesystem path for reading the stored object."""
+        raise NotImplementedError
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: Path, base_url: str):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    async def store(self, temp_path: Path, key: str) -> bool:
+        target = self.root / key
+        if target.exists():
+            temp_path.unlink(missing_ok=True)
+            return False
+        os.replace(temp_path, target)
+        return True
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def key_for_url(self, url: str) -> Optional[str]:
+        if not url:
+            return None
+        prefix = f"{self.base_url}/"
+        if url.startswith(prefix):
+            key = url[len(prefix):]
+        else:
+            # URLs issued under an earlier base (e.g. before a CDN was configured)
+            path = urlparse(url).path
+            if not path.startswith("/uploads/"):
+                return None
+            key = path[len("/uploads/"):]
+        return key if key and "/" not in key else None
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+storage = LocalStorage(UPLOAD_DIR, UPLOAD_BASE_URL)
+
+def file_extension(filename: str) -> str:
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return ext if ext.isalnum() and len(ext) <= 10 else ""
+
+def content_key(digest: str, filename: str) -> str:
+    ext = file_extension(filename)
+    return f"{digest}.{ext}" if ext else digest
+
+def size_limit_detail(limit: int) -> str:
+    if limit >= 1024 * 1024:
+        return f"File size must be less than {limit // (1024 * 1024)}MB"
+    return f"File size must be less than {limit // 1024}KB"
+
+async def limit_stream(chunks, limit: int):
+    """Pass an async byte stream through, raising 413 once it exceeds limit bytes."""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=size_limit_detail(limit))
+        yield chunk
+
+def write_block(out, block: bytes, digest=None):
+    if digest is not None:
+        digest.update(block)
+    out.write(block)
+
+async def write_stream(out, chunks, digest=None) -> int:
+    """Copy an async byte stream into an open file, hashing it on the way.
+
+    Chunks are gathered into UPLOAD_WRITE_SIZE blocks and written (and hashed)
+    in a worker thread, so disk I/O never blocks the event loop. Returns the
+    number of bytes written.
+    """
+    size = 0
+    buffer = bytearray()
+    async for chunk in chunks:
+        size += len(chunk)
+        buffer += chunk
+        if len(buffer) >= UPLOAD_WRITE_SIZE:
+            await asyncio.to_thread(write_block, out, bytes(buffer), digest)
+            buffer.clear()
+    if buffer:
+        await asyncio.to_thread(write_block, out, bytes(buffer), digest)
+    return size
+
+async def stream_to_temp(chunks, limit: int):
+    """Write an async byte stream to a temp file, hashing as it goes and aborting past limit.
+
+    Returns (temp_path, sha256 hex digest, size).
+    """
+    temp_path = UPLOAD_TMP_DIR / str(uuid.uuid4())
+    digest = hashlib.sha256()
+    try:
+        with open(temp_path, "wb") as out:
+            size = await write_stream(out, limit_stream(chunks, limit), digest)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def partial_upload_path(upload_id: str) -> Path:
+    return UPLOAD_TMP_DIR / f"session-{upload_id}"
+
+def open_partial_upload(path: Path, offset: int):
+    """Open a session's partial file for writing at offset. Blocking; run it in a thread."""
+    out = open(path, "r+b")
+    out.truncate(offset)  # discard any tail left by an interrupted chunk
+    out.seek(offset)
+    return out
+
+async def purge_stale_uploads():
+    """Remove temp files for abandoned uploads (session documents expire via TTL index)."""
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    for path in UPLOAD_TMP_DIR.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+async def purge_stale_uploads_periodically():
+    while True:
+        try:
+            await purge_stale_uploads()
+        except Exception as e:
+            logger.error(f"Upload cleanup failed: {e}")
+        await asyncio.sleep(3600)
+
+# ============ Image Derivatives ============
+
+def render_image_variants(src_path: str, out_dir: str, digest: str, widths: List[int], formats: List[str]) -> List[tuple]:
+    """Resize and re-encode one image. Runs in the image process pool.
+
+    Returns (temp path, key, format, width) for each rendition. Widths at or
+    above the original are skipped; an image narrower than every target gets
+    a single rendition at its own width.
+    """
+    rendered = []
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        targets = sorted({w for w in widths if w < img.width}) or [img.width]
+        for width in targets:
+            height = max(1, round(img.height * width / img.width))
+            resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                key = f"{digest}-w{width}.{fmt}"
+                path = Path(out_dir) / f"{uuid.uuid4()}-{key}"
+                resized.save(path, format=fmt.upper(), quality=80 if fmt == "webp" else 60)
+                rendered.append((str(path), key, fmt, width))
+    return rendered
+
+image_pool: Optional[ProcessPoolExecutor] = None
+_image_jobs: set = set()
+
+def get_image_pool() -> ProcessPoolExecutor:
+    global image_pool
+    if image_pool is None:
+        # Forking a process that runs an event loop, Motor's threads and held locks can deadlock the child
+        image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return image_pool
+
+def reset_image_pool():
+    """Drop a pool whose worker died; a broken pool fails every later job, so the next one starts fresh."""
+    global image_pool
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+        image_pool = None
+
+def schedule_image_variants(key: str):
+    """Generate derivatives for a stored upload in the background if it is an image."""
+    if file_extension(key) not in IMAGE_EXTENSIONS:
+        return
+    task = asyncio.create_task(build_image_variants(key))
+    _image_jobs.add(task)
+    task.add_done_callback(_image_jobs.discard)
+
+async def claim_image_job(key: str) -> bool:
+    """Claim variant generation for key: new, failed and stale pending jobs can be claimed.
+
+    A job that is ready, or pending and claimed recently, does not match the
+    filter, so the upsert tries to insert a second document for the key and
+    the unique index rejects it.
+    """
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=IMAGE_JOB_TIMEOUT_SECONDS)
+    try:
+        await db.image_variants.update_one(
+            {"key": key, "$or": [
+                {"status": "failed"},
+                {"status": "pending", "claimed_at": {"$lt": stale}},
+                # Claimed before claimed_at was recorded
+                {"status": "pending", "claimed_at": {"$exists": False}, "created_at": {"$lt": stale}},
+            ]},
+            {"$set": {"status": "pending", "claimed_at": now}, "$unset": {"error": ""},
+             "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def build_image_variants(key: str):
+    if not await claim_image_job(key):
+        return  # already generated or in progress (content-addressed, so same bytes)
+    
+    try:
+        digest = key.split(".")[0]
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(
+            get_image_pool(), render_image_variants,
+            str(storage.path(key)), str(UPLOAD_TMP_DIR), digest, IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_FORMATS
+        )
+        variants: Dict[str, Dict[str, str]] = {fmt: {} for fmt in IMAGE_VARIANT_FORMATS}
+        for temp_path, variant_key, fmt, width in rendered:
+            await storage.store(Path(temp_path), variant_key)
+            variants[fmt][str(width)] = variant_key
+        await db.image_variants.update_one({"key": key}, {"$set": {"status": "ready", "variants": variants}})
+        using = await db.listings.find({"images": storage.url(key)}, {"_id": 0, "id": 1}).to_list(None)
+        if using:
+            await invalidate_listing(*(p['id'] for p in using))
+    except Exception as e:
+        logger.error(f"Image variant generation failed for {key}: {e}")
+        if isinstance(e, BrokenProcessPool):
+            reset_image_pool()
+        await db.image_variants.update_one({"key": key}, {"$set": {"status": "failed", "error": str(e)}})
+
+async def attach_image_variants(listings: List[dict]):
+    """Set image_variants on listing documents from one lookup for the whole page."""
+    keys = {key for p in listings for key in map(storage.key_for_url, p.get('images') or []) if key}
+    ready = {}
+    if keys:
+        async for doc in db.image_variants.find({"key": {"$in": list(keys)}, "status": "ready"}, {"_id": 0}):
+            ready[doc['key']] = doc['variants']
+    
+    for p in listings:
+        image_variants = []
+        for url in p.get('images') or []:
+            variants = ready.get(storage.key_for_url(url))
+            if not variants:
+                image_variants.append(None)
+                continue
+            by_format = {
+                fmt: {width: storage.url(variant_key) for width, variant_key in widths.items()}
+                for fmt, widths in variants.items()
+            }
+            smallest = min(variants["webp"], key=int)
+            image_variants.append({"thumbnail": by_format["webp"][smallest], "webp": {}, "avif": {}, **by_format})
+        p['image_variants'] = image_variants
+
+# ============ Seller Analytics ============
+
+ANALYTICS_COLLECTIONS = {"hour": "analytics_hourly", "day": "analytics_daily"}
+ANALYTICS_STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+ANALYTICS_DEFAULT_BUCKETS = {"hour": 24, "day": 30}
+ANALYTICS_ORDER_COUNTERS = ("orders", "sales", "units_sold", "revenue")
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    moment = as_utc(moment).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == "day" else moment
+
+def merge_counts(into: dict, counts: dict):
+    for field, amount in counts.items():
+        into[field] = into.get(field, 0) + amount
+
+def rollup_updates(buckets: dict, operator: str = "$inc") -> List[UpdateOne]:
+    return [
+        UpdateOne({"seller_id": seller_id, "start": start}, {operator: counts}, upsert=True)
+        for (seller_id, start), counts in buckets.items()
+    ]
+
+class AnalyticsRecorder:
+    """Buffers seller analytics counters and flushes them into rollup buckets.
+
+    record() only bumps an in-memory counter keyed by listing and hour, so it is
+    cheap enough for the listing detail path, cache hits included. Every
+    ANALYTICS_FLUSH_INTERVAL_SECONDS the buffer is folded into per-seller
+    hourly and daily documents with one unordered bulk_write of $inc upserts per
+    collection. Views are buffered by listing and resolved to a seller at flush
+    time. Updates that fail to write are retried on the next flush; counters
+    still buffered when a worker dies are lost.
+    """
+
+    def __init__(self, interval: float = ANALYTICS_FLUSH_INTERVAL_SECONDS):
+        self.interval = interval
+        self.pending: Dict[tuple, Dict[str, float]] = {}
+        self.unwritten: Dict[str, List[UpdateOne]] = {}
+        self.sellers = TTLCache(max_entries=100000, ttl=3600)
+        self.flusher: Optional[asyncio.Task] = None
+        self.flush_lock = asyncio.Lock()
+
+    def record(self, listing_id: str, seller_id: Optional[str] = None, **counts):
+        if seller_id:
+            self.sellers.set(listing_id, seller_id)
+        key = (listing_id, bucket_start(datetime.now(timezone.utc), "hour"))
+        merge_counts(self.pending.setdefault(key, {}), counts)
+
+    async def start(self):
+        self.flusher = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Analytics flush failed, will retry: {e}")
+
+    async def flush(self):
+        async with self.flush_lock:
+            batch, self.pending = self.pending, {}
+            try:
+                rollups = await self.rollup(batch) if batch else {}
+            except Exception:
+                for key, counts in batch.items():
+                    merge_counts(self.pending.setdefault(key, {}), counts)
+                raise
+            error = None
+            for name in ANALYTICS_COLLECTIONS.values():
+                ops = self.unwritten.pop(name, []) + rollups.get(name, [])
+                if not ops:
+                    continue
+                try:
+                    await db[name].bulk_write(ops, ordered=False)
+                except BulkWriteError as e:
+                    # Unordered: everything but the reported writes was applied
+                    failed = {err["index"] for err in e.details.get("writeErrors", [])}
+                    self.unwritten[name] = [op for i, op in enumerate(ops) if i in failed]
+                    error = error or e
+                except PyMongoError as e:
+                    self.unwritten[name] = ops
+                    error = error or e
+            if error:
+                raise error
+
+    async def rollup(self, batch: Dict[tuple, Dict[str, float]]) -> Dict[str, List[UpdateOne]]:
+        missing = list({listing_id for listing_id, _ in batch if self.sellers.get(listing_id) is None})
+        if missing:
+            async for doc in db.listings.find({"id": {"$in": missing}}, {"_id": 0, "id": 1, "seller_id": 1}):
+                self.sellers.set(doc['id'], doc['seller_id'])
+        
+        buckets = {granularity: {} for granularity in ANALYTICS_COLLECTIONS}
+        for (listing_id, hour), counts in batch.items():
+            seller_id = self.sellers.get(listing_id)
+            if seller_id is None:
+                continue  # listing deleted before the flush
+            for granularity, by_bucket in buckets.items():
+                merge_counts(by_bucket.setdefault((seller_id, bucket_start(hour, granularity)), {}), counts)
+        return {ANALYTICS_COLLECTIONS[g]: rollup_updates(by_bucket) for g, by_bucket in buckets.items()}
+
+    async def close(self):
+        """Flush everything still buffered; called from the shutdown hook."""
+        if self.flusher is not None:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            self.flusher = None
+        await self.flush()
+
+analytics_recorder = AnalyticsRecorder()
+
+async def seller_analytics(seller_id: str, granularity: str, start: datetime, end: datetime) -> AnalyticsReport:
+    """Read a seller's buckets in [start, end), filling gaps with zeroes."""
+    start = bucket_start(start, granularity)
+    stored = {}
+    query = {"seller_id": seller_id, "start": {"$gte": start, "$lt": end}}
+    async for doc in db[ANALYTICS_COLLECTIONS[granularity]].find(query, {"_id": 0, "seller_id": 0}):
+        doc['start'] = as_utc(doc['start'])
+        stored[doc['start']] = doc
+    
+    buckets = []
+    moment = start
+    while moment < end:
+        buckets.append(AnalyticsBucket(**stored.get(moment, {"start": moment})))
+        moment += ANALYTICS_STEPS[granularity]
+    
+    totals = AnalyticsBucket(start=start, **{
+        field: sum(getattr(bucket, field) for bucket in buckets)
+        for field in AnalyticsBucket.model_fields if field != "start"
+    })
+    return AnalyticsReport(granularity=granularity, start=start, end=end, totals=totals, buckets=buckets)
+
+async def rebuild_order_analytics(batch_size: int = 1000) -> int:
+    """Recompute the order-derived counters of every rollup bucket from the orders collection.
+
+    Views only exist in the rollups and are left as they are. Sales are counted
+    in the bucket the order was placed in, since payment times are not stored.
+    Orders placed while this runs can be counted twice or missed, so run it
+    when traffic is quiet. Returns the number of orders scanned.
+    """
+    buckets = {granularity: {} for granularity in ANALYTICS_COLLECTIONS}
+    scanned = 0
+    projection = {"_id": 0, "seller_id": 1, "quantity": 1, "total_amount": 1, "payment_status": 1, "timestamp": 1}
+    async for order in db.orders.find({}, projection):
+        counts = dict.fromkeys(ANALYTICS_ORDER_COUNTERS, 0)
+        counts["orders"] = 1
+        if order.get('payment_status') == "paid":
+            counts.update(sales=1, units_sold=order['quantity'], revenue=order['total_amount'])
+        for granularity, by_bucket in buckets.items():
+            key = (order['seller_id'], bucket_start(order['timestamp'], granularity))
+            merge_counts(by_bucket.setdefault(key, {}), counts)
+        scanned += 1
+    
+    for granularity, name in ANALYTICS_COLLECTIONS.items():
+        await db[name].update_many({}, {"$set": dict.fromkeys(ANALYTICS_ORDER_COUNTERS, 0)})
+        ops = rollup_updates(buckets[granularity], "$set")
+        for i in range(0, len(ops), batch_size):
+            await db[name].bulk_write(ops[i:i + batch_size], ordered=False)
+    return scanned
+
+# ============ Order State Machine ============
+#
+#   pending --paid--> confirmed
+#   pending --hold lapsed / session expired / payment failed--> expired
+#   expired --late payment--> confirmed
+#
+# Every transition is a single conditional find_one_and_update on the order's
+# current status and reservation, which move together (pending orders hold
+# their stock, expired ones have released it), so concurrent webhooks, status
+# polls and the sweeper can race freely: exactly one caller wins each
+# transition and only the winner touches stock.
+
+async def reserve_stock(listing_id: str, quantity: int) -> bool:
+    result = await db.listings.update_one(
+        {"id": listing_id, "stock": {"$gte": quantity}},
+        {"$inc": {"stock": -quantity}}
+    )
+    if result.modified_count != 1:
+        return False
+    await invalidate_listing(listing_id)
+    return True
+
+async def transition_order(order_id: str, from_status: List[str], update: dict, extra: Optional[dict] = None) -> Optional[dict]:
+    """Atomically move an order out of one of from_status.
+
+    Returns the order as it was before the transition, or None when it was not
+    in an allowed state (another caller already moved it).
+    """
+    query = {"id": order_id, "status": {"$in": from_status}, **(extra or {})}
+    return await db.orders.find_one_and_update(query, {"$set": update}, projection={"_id": 0})
+
+async def confirm_order_payment(order_id: str) -> Optional[dict]:
+    while True:
+        current = await db.orders.find_one({"id": order_id}, {"_id": 0, "status": 1, "reservation": 1})
+        if not current or current['status'] not in ("pending", "expired"):
+            return None
+        # Conditional on the reservation read above; if an expiry releases the
+        # stock in between, the update misses and the next pass sees "released".
+        reservation = current.get('reservation')
+        before = await transition_order(
+            order_id, [current['status']],
+            {"status": "confirmed", "payment_status": "paid", "reserved_until": None,
+             "reservation": "committed" if reservation == "held" else reservation},
+            {"reservation": reservation},
+        )
+        if before is not None:
+            break
+    
+    if reservation == "released":
+        # Paid after the hold lapsed; take the stock again if it is still there.
+        # The order is confirmed now, so nothing else competes for this update.
+        if await reserve_stock(before['listing_id'], before['quantity']):
+            reservation = "committed"
+        else:
+            reservation = "short"
+            logger.warning(f"Order {order_id} was paid after its stock was released and the listing is now short")
+        await db.orders.update_one({"id": order_id}, {"$set": {"reservation": reservation}})
+    analytics_recorder.record(before['listing_id'], seller_id=before['seller_id'],
+                              sales=1, units_sold=before['quantity'], revenue=before['total_amount'])
+    return before
+
+async def expire_order(order_id: str, extra: Optional[dict] = None, payment_status: Optional[str] = None) -> Optional[dict]:
+    update = {"status": "expired"}
+    if payment_status:
+        update["payment_status"] = payment_status
+    before = await transition_order(order_id, ["pending"], {**update, "reservation": "released"},
+                                    {**(extra or {}), "reservation": "held"})
+    if before is None:
+        # Orders for listings without stock tracking have nothing to release
+        return await transition_order(order_id, ["pending"], update, {**(extra or {}), "reservation": None})
+    
+    await db.listings.update_one({"id": before['listing_id']}, {"$inc": {"stock": before['quantity']}})
+    await invalidate_listing(before['listing_id'])
+    return before
+
+async def release_expired_reservations() -> int:
+    now = datetime.now(timezone.utc)
+    lapsed = {"reserved_until": {"$lt": now}}
+    released = 0
+    async for order in db.orders.find({"status": "pending", **lapsed}, {"_id": 0, "id": 1}):
+        released += await expire_order(order['id'], lapsed) is not None
+    return released
+
+async def release_expired_reservations_periodically():
+    while True:
+        try:
+            released = await release_expired_reservations()
+            if released:
+                logger.info(f"Released stock held by {released} lapsed orders")
+        except Exception as e:
+            logger.error(f"Order reservation sweep failed: {e}")
+        await asyncio.sleep(ORDER_SWEEP_INTERVAL_SECONDS)
+
+# ============ Stripe ============
+
+_stripe_http: Optional[stripe.HTTPXClient] = None
+_stripe_client: Optional[stripe.StripeClient] = None
+
+def get_stripe_client() -> stripe.StripeClient:
+    """Async Stripe client sharing one pooled httpx connection pool, with timeouts and retries."""
+    global _stripe_http, _stripe_client
+    if _stripe_client is None:
+        _stripe_http = stripe.HTTPXClient(timeout=STRIPE_TIMEOUT_SECONDS)
+        _stripe_client = stripe.StripeClient(
+            STRIPE_API_KEY,
+            http_client=_stripe_http,
+            max_network_retries=STRIPE_MAX_NETWORK_RETRIES,
+            base_addresses={"api": STRIPE_API_BASE} if STRIPE_API_BASE else None,
+        )
+    return _stripe_client
+
+async def close_stripe_client():
+    global _stripe_http, _stripe_client
+    if _stripe_http is not None:
+        await _stripe_http.close_async()
+    _stripe_http = _stripe_client = None
+
+async def apply_session_status(session_id: str, payment_status: str, session_status: Optional[str]) -> Optional[dict]:
+    """Record Stripe's view of a checkout session locally and drive the order state machine.
+
+    Both the webhook and status polling go through here, so polling can be
+    answered from payment_transactions without calling Stripe. "paid" is
+    terminal for a transaction; later updates never downgrade it.
+    """
+    update = {"payment_status": payment_status, "status_checked_at": datetime.now(timezone.utc)}
+    if session_status:
+        update["session_status"] = session_status
+    before = await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$ne": "paid"}},
+        {"$set": update},
+        projection={"_id": 0},
+    )
+    if not before:
+        transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+        if transaction and transaction['payment_status'] == "paid":
+            # An earlier call may have marked the transaction paid and then failed
+            # before confirming the order; confirming again is a no-op otherwise.
+            await confirm_order_payment(transaction['order_id'])
+        return None
+    transaction = {**before, **update}
+    
+    if payment_status == "paid":
+        await confirm_order_payment(transaction['order_id'])
+    elif payment_status == "failed" or session_status == "expired":
+        await expire_order(transaction['order_id'], payment_status=payment_status if payment_status == "failed" else None)
+    return transaction
+
+async def claim_webhook_event(event_id: str) -> bool:
+    """Record a webhook delivery; False when it was already processed.
+
+    A delivery that is still in flight, or failed before being marked
+    processed, is let through again, so handlers must be idempotent.
+    """
+    try:
+        seen = await db.stripe_events.find_one_and_update(
+            {"id": event_id},
+            {"$setOnInsert": {"id": event_id, "received_at": datetime.now(timezone.utc)}},
+            projection={"_id": 0},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return seen is None or not seen.get('processed_at')
+
+# ============ Upload Serving ============
+
+CONTENT_ADDRESSED_RE = re.compile(r"^[0-9a-f]{64}(-w\d+)?(\.[a-z0-9]+)?$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = "public, max-age=3600"
+
+def upload_etag(key: str, stat) -> str:
+    if CONTENT_ADDRESSED_RE.match(key):
+        return f'"{key.split(".")[0]}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def parse_range(header: str, size: int) -> Optional[tuple]:
+    """Parse a single "bytes=start-end" range into inclusive offsets.
+
+    Returns None when the header should be ignored (multiple ranges or bad
+    syntax), and raises 416 when the range cannot be satisfied.
+    """
+    if not header.startswith("bytes=") or "," in header:
+        return None
+    start_text, dash, end_text = header[len("bytes="):].strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            length = int(end_text)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, min(end, size - 1)
+
+async def iter_file_range(path: Path, start: int, length: int):
+    async with await anyio.open_file(path, "rb") as f:
+        await f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = await f.read(min(UPLOAD_READ_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+async def serve_upload(key: str, request: Request):
+    """Serve a stored upload with strong ETags, conditional GETs and single-range requests.
+
+    Content-addressed names never change, so they are cacheable forever by
+    browsers and any CDN in front of UPLOAD_BASE_URL.
+    """
+    if "/" in key or key.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = storage.path(key)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    etag = upload_etag(key, stat)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if CONTENT_ADDRESSED_RE.match(key) else MUTABLE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+    start, end, status_code = 0, stat.st_size - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, stat.st_size)
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    
+    length = max(end - start + 1, 0)
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(iter_file_range(path, start, length), status_code=status_code,
+                             headers=headers, media_type=media_type)
+
+# ============ Bulk Import/Export ============
 
-class Listing(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    seller_id: str
-    seller_name: str
-    title: str
-    description: str
-    price: float
-    category: str
-    images: List[str]
-    tags: List[str] = []
-    stock: Optional[int] = 1
-    verified: bool = False
-    rating: float = 0.0
-    reviews_count: int = 0
-    type: str = "product"
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+# Import accepts these columns (extra columns, such as an export's id, are ignored).
+# In CSV, list columns are "|"-separated and an empty cell is an empty list, an
+# empty nullable cell is None (e.g. a service's stock), and other empty cells
+# take the field's default, so an exported file re-imports unchanged.
+LISTING_IMPORT_COLUMNS = list(ListingCreate.model_fields)
+LISTING_LIST_COLUMNS = {"images", "tags"}
+LISTING_NULLABLE_COLUMNS = {"stock"}
+LISTING_EXPORT_COLUMNS = ["id"] + LISTING_IMPORT_COLUMNS + ["rating", "reviews_count", "created_at"]
+ORDER_EXPORT_COLUMNS = ["id", "created_at", "listing_id", "listing_title", "buyer_id", "buyer_name", "seller_id",
+                        "quantity", "total_amount", "status", "payment_status"]
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
 
-class ListingCreate(BaseModel):
-    title: str
-    description: str
-    price: float
-    category: str
-    images: List[str]
-    tags: List[str] = []
-    stock: Optional[int] = 1
-    type: str = "product"
+async def iter_lines(chunks, max_line_bytes: int):
+    """Split a byte stream into lines without buffering more than max_line_bytes.
 
-class ListingUpdate(BaseModel):
-    title: Optional[str] = None
-    description: Optional[str] = None
-    price: Optional[float] = None
-    category: Optional[str] = None
-    images: Optional[List[str]] = None
-    tags: Optional[List[str]] = None
-    stock: Optional[int] = None
-    type: Optional[str] = None
+    Yields None in place of a line that exceeded the limit.
+    """
+    buffer = b""
+    overflowed = False
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line, buffer = buffer[:newline], buffer[newline + 1:]
+            yield None if overflowed or len(line) > max_line_bytes else line.rstrip(b"\r")
+            overflowed = False
+        if len(buffer) > max_line_bytes:
+            overflowed = True
+            buffer = b""
+    if overflowed:
+        yield None
+    elif buffer.strip():
+        yield buffer.rstrip(b"\r")
 
-class Review(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    listing_id: str
-    user_id: str
-    user_name: str
-    rating: int
-    comment: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+async def iter_ndjson_rows(lines):
+    """Yield (row number, dict or error message) for each non-blank NDJSON line."""
+    row = 0
+    async for line in lines:
+        row += 1
+        if line is None:
+            yield row, f"Line longer than {MAX_IMPORT_LINE_BYTES} bytes"
+            continue
+        if not line.strip():
+            continue
+        try:
+            value = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield row, f"Invalid JSON: {e}"
+            continue
+        yield row, value if isinstance(value, dict) else "Each line must be a JSON object"
 
-class ReviewCreate(BaseModel):
-    listing_id: str
-    rating: int
-    comment: str
+async def iter_csv_rows(lines):
+    """Yield (row number, dict or error message) per CSV record after the header.
 
-class Order(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    buyer_id: str
-    buyer_name: str
-    seller_id: str
-    listing_id: str
-    listing_title: str
-    quantity: int
-    total_amount: float
-    status: str = "pending"
-    payment_status: str = "pending"
-    session_id: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    Quoted fields may span lines; a record is complete once its quotes balance.
+    """
+    header = None
+    record = ""
+    row = 0
+    async for line in lines:
+        if line is None:
+            row += 1
+            record = ""
+            yield row, f"Line longer than {MAX_IMPORT_LINE_BYTES} bytes"
+            continue
+        try:
+            text = line.decode("utf-8")
+        except UnicodeDecodeError:
+            row += 1
+            record = ""
+            yield row, "Invalid UTF-8"
+            continue
+        record = f"{record}\n{text}" if record else text
+        if record.count('"') % 2:
+            if len(record) > MAX_IMPORT_LINE_BYTES:
+                row += 1
+                record = ""
+                yield row, f"Record longer than {MAX_IMPORT_LINE_BYTES} bytes"
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if header is None:
+            header = [h.strip().lstrip("﻿") for h in values]
+            continue
+        row += 1
+        if not any(v.strip() for v in values):
+            continue
+        if len(values) > len(header):
+            yield row, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        fields = {}
+        for name, value in zip(header, values):
+            if name in LISTING_LIST_COLUMNS:
+                fields[name] = [v.strip() for v in value.split("|") if v.strip()]
+            elif value != "":
+                fields[name] = value
+            elif name in LISTING_NULLABLE_COLUMNS:
+                fields[name] = None
+        yield row, fields
 
-class Message(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    sender_id: str
-    receiver_id: str
-    listing_id: Optional[str] = None
-    message: str
-    file_url: Optional[str] = None
-    file_type: Optional[str] = None
-    file_name: Optional[str] = None
-    read: bool = False
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+def validation_message(error: ValidationError, whole: str = "row") -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or whole}: {e['msg']}" for e in error.errors())
 
-class MessageCreate(BaseModel):
-    receiver_id: str
-    listing_id: Optional[str] = None
-    message: str
-    file_url: Optional[str] = None
-    file_type: Optional[str] = None
-    file_name: Optional[str] = None
+async def import_listings(rows, seller: User, batch_size: int) -> ImportResult:
+    """Validate rows against ListingCreate and insert them in unordered batches.
 
-class Thread(BaseModel):
-    id: str
-    other_user_id: str
-    other_user_name: str
-    other_user_avatar: Optional[str] = None
-    last_message: str
-    last_message_time: datetime
-    unread_count: int
+    Only the current batch and up to MAX_IMPORT_ERRORS error entries are held
+    in memory, whatever the size of the upload.
+    """
+    result = ImportResult()
+    batch: List[Tuple[int, dict]] = []
 
-class Wishlist(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    user_id: str
-    listing_id: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    def fail(row: int, message: str):
+        result.failed += 1
+        if len(result.errors) < MAX_IMPORT_ERRORS:
+            result.errors.append(ImportRowError(row=row, error=message))
+        else:
+            result.errors_truncated = True
 
-class PaymentTransaction(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    session_id: str
-    order_id: str
-    buyer_id: str
-    amount: float
-    currency: str = "usd"
-    payment_status: str = "pending"
-    metadata: Dict[str, Any] = {}
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    async def flush():
+        docs = [doc for _, doc in batch]
+        failed = set()
+        try:
+            await db.listings.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                failed.add(err["index"])
+                fail(batch[err["index"]][0], "Could not be stored")
+        for i, doc in enumerate(docs):
+            if i not in failed:
+                search_index.add(doc)
+                result.imported += 1
+        batch.clear()
 
-# ============ Auth Helpers ============
+    async for row, fields in rows:
+        if isinstance(fields, str):
+            fail(row, fields)
+            continue
+        try:
+            listing_data = ListingCreate.model_validate(fields)
+        except ValidationError as e:
+            fail(row, validation_message(e))
+            continue
+        listing = Listing(seller_id=seller.id, seller_name=seller.name, **listing_data.model_dump())
+        listing_dict = listing.model_dump(exclude={'image_variants'})
+        listing_dict['timestamp'] = listing_dict.pop('created_at')
+        listing_dict['rating_sum'] = 0
+        batch.append((row, listing_dict))
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    if result.imported:
+        await response_cache.invalidate("listings")
+    return result
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+def csv_line(values: list) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue().encode()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+def csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return as_utc(value).isoformat().replace("+00:00", "Z")
+    if isinstance(value, list):
+        return "|".join(map(str, value))
+    return str(value)
 
-def create_access_token(data: dict, expires_delta: timedelta = timedelta(days=7)):
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + expires_delta
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
+async def stream_export(cursor, serializer: LeanSerializer, columns: List[str], format: str):
+    """Encode a cursor's documents as NDJSON or CSV, yielding ~EXPORT_CHUNK_BYTES at a time."""
+    chunk = bytearray(csv_line(columns) if format == "csv" else b"")
+    async for doc in cursor:
+        doc = serializer.prepare(doc)
+        if format == "csv":
+            chunk += csv_line([csv_value(doc.get(column)) for column in columns])
+        else:
+            chunk += dump_json({column: doc.get(column) for column in columns}) + b"\n"
+        if len(chunk) >= EXPORT_CHUNK_BYTES:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
 
-async def get_current_user(authorization: str = Header(None)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    token = authorization.split(" ")[1]
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        return User(**user)
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+def export_response(cursor, serializer: LeanSerializer, columns: List[str], format: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        stream_export(cursor, serializer, columns, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{format}"'},
+    )
 
 # ============ Routes ============
 
@@ -276,26 +3178,34 @@ async def register(user_data: UserCreate):
     )
     
     user_dict = user.model_dump()
-    user_dict['timestamp'] = user_dict.pop('created_at').isoformat()
-    user_dict['password'] = hash_password(user_data.password)
+    user_dict['timestamp'] = user_dict.pop('created_at')
+    user_dict['password'] = await hash_password(user_data.password)
+    user_dict.update(directory_fields(user.name, user.email))
     
     await db.users.insert_one(user_dict)
     
-    token = create_access_token({"user_id": user.id, "email": user.email})
+    await user_cache.invalidate(user.id)
+    
+    token = create_user_token(user)
     return {"token": token, "user": user.model_dump()}
 
 @api_router.post("/auth/login", response_model=dict)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user.get('password', '')):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    user.pop('password', None)
-    if isinstance(user.get('timestamp'), str):
-        user['created_at'] = datetime.fromisoformat(user.pop('timestamp'))
+    stored_hash = user.pop('password', '')
+    valid, new_hash = await verify_password(credentials.password, stored_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Conditional on the old hash so a concurrent password change is never overwritten
+        await db.users.update_one({"id": user['id'], "password": stored_hash}, {"$set": {"password": new_hash}})
     
-    token = create_access_token({"user_id": user['id'], "email": user['email']})
-    return {"token": token, "user": User(**user).model_dump()}
+    user = User(**user)
+    token = create_user_token(user)
+    return {"token": token, "user": user.model_dump()}
 
 @api_router.get("/auth/me", response_model=User)
 async def get_me(current_user: User = Depends(get_current_user)):
@@ -313,41 +3223,148 @@ async def create_listing(listing_data: ListingCreate, current_user: User = Depen
         **listing_data.model_dump()
     )
     
-    listing_dict = listing.model_dump()
-    listing_dict['timestamp'] = listing_dict.pop('created_at').isoformat()
+    listing_dict = listing.model_dump(exclude={'image_variants'})
+    listing_dict['timestamp'] = listing_dict.pop('created_at')
+    listing_dict['rating_sum'] = 0
     
     await db.listings.insert_one(listing_dict)
-    return listing
+    search_index.add(listing_dict)
+    await response_cache.invalidate("listings")
+    await attach_image_variants([listing_dict])
+    return Listing(**listing_dict)
+
+@api_router.post("/listings/import", response_model=ImportResult)
+async def import_listings_route(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    current_user: User = Depends(get_current_user),
+):
+    if current_user.role != "seller":
+        raise HTTPException(status_code=403, detail="Only sellers can import listings")
+    
+    format = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    lines = iter_lines(request.stream(), MAX_IMPORT_LINE_BYTES)
+    rows = iter_csv_rows(lines) if format == "csv" else iter_ndjson_rows(lines)
+    with trace_span("import_listings", format=format):
+        return await import_listings(rows, current_user, IMPORT_BATCH_SIZE)
+
+@api_router.get("/listings/export")
+async def export_listings(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: User = Depends(get_token_user),
+):
+    if current_user.role != "seller":
+        raise HTTPException(status_code=403, detail="Only sellers can export listings")
+    
+    cursor = db.listings.find(
+        {"seller_id": current_user.id}, listing_serializer.projection
+    ).sort("timestamp", -1).batch_size(IMPORT_BATCH_SIZE)
+    return export_response(cursor, listing_serializer, LISTING_EXPORT_COLUMNS, format, "listings")
 
 @api_router.get("/listings", response_model=List[Listing])
-async def get_listings(category: Optional[str] = None, search: Optional[str] = None, limit: int = 50):
-    query = {}
+async def get_listings(
+    request: Request,
+    category: Optional[str] = None,
+    seller_id: Optional[str] = None,
+    search: Optional[str] = None,
+    sort: Optional[str] = None,
+    price_min: Optional[float] = None,
+    price_max: Optional[float] = None,
+    in_stock: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    sort = sort or ("relevance" if search else "newest")
+    if sort != "relevance" and sort not in LISTING_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort: {sort}")
+    if sort == "relevance" and not search:
+        raise HTTPException(status_code=400, detail="Relevance sort requires a search query")
+
+    params = {"category": category, "seller_id": seller_id, "search": search, "sort": sort, "price_min": price_min,
+              "price_max": price_max, "in_stock": in_stock, "cursor": cursor, "limit": limit}
+    cache_key, cached = await response_cache.lookup("listings", params, ["listings"])
+    if cached:
+        return cached_json_response(request, cached)
+
+    conditions = []
     if category:
-        query['category'] = category
+        conditions.append({'category': category})
+    if seller_id:
+        conditions.append({'seller_id': seller_id})
+    if price_min is not None or price_max is not None:
+        price_range = {}
+        if price_min is not None:
+            price_range['$gte'] = price_min
+        if price_max is not None:
+            price_range['$lte'] = price_max
+        conditions.append({'price': price_range})
+    if in_stock:
+        conditions.append({'$or': [{'type': {'$ne': 'product'}}, {'stock': {'$gt': 0}}]})
+
     if search:
-        query['$or'] = [
-            {'title': {'$regex': search, '$options': 'i'}},
-            {'description': {'$regex': search, '$options': 'i'}}
-        ]
-    
-    listings = await db.listings.find(query, {"_id": 0}).limit(limit).to_list(limit)
-    
-    for p in listings:
-        if isinstance(p.get('timestamp'), str):
-            p['created_at'] = datetime.fromisoformat(p.pop('timestamp'))
+        with trace_span("search_index.search"):
+            ranked_ids = [listing_id for listing_id, _ in search_index.search(search, category)]
+        if sort == "relevance":
+            listings, next_cursor = await fetch_ranked_page(ranked_ids, conditions, limit, cursor)
+        else:
+            # Bounds the $in list; a broad prefix on a large catalog can match most listings
+            candidates = ranked_ids[:SEARCH_MAX_CANDIDATES]
+            sort_field, direction = LISTING_SORTS[sort]
+            listings, next_cursor = await fetch_page(
+                db.listings, conditions + [{"id": {"$in": candidates}}], sort_field, direction, limit, cursor,
+                projection=listing_serializer.projection,
+            )
+    else:
+        sort_field, direction = LISTING_SORTS[sort]
+        listings, next_cursor = await fetch_page(
+            db.listings, conditions, sort_field, direction, limit, cursor, projection=listing_serializer.projection
+        )
+    await attach_image_variants(listings)
     
-    return [Listing(**p) for p in listings]
+    body = listing_serializer.dumps(listings)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    return cached_json_response(request, await response_cache.store(cache_key, body, headers))
+
+async def fetch_ranked_page(ranked_ids: List[str], conditions: List[dict], limit: int, cursor: Optional[str]):
+    """Page through search results in relevance order; the cursor is a rank offset."""
+    offset = 0
+    if cursor:
+        kind, offset = decode_cursor(cursor)
+        if kind != "rank" or not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    listings = []
+    while offset < len(ranked_ids) and len(listings) < limit:
+        chunk = ranked_ids[offset:offset + limit]
+        found = await db.listings.find(
+            combine_conditions(conditions + [{"id": {"$in": chunk}}]), listing_serializer.projection
+        ).to_list(len(chunk))
+        by_id = {p['id']: p for p in found}
+        for listing_id in chunk:
+            offset += 1
+            if listing_id in by_id:
+                listings.append(by_id[listing_id])
+                if len(listings) == limit:
+                    break
+
+    next_cursor = encode_cursor(["rank", offset]) if offset < len(ranked_ids) else None
+    return listings, next_cursor
 
 @api_router.get("/listings/{listing_id}", response_model=Listing)
-async def get_listing(listing_id: str):
-    listing = await db.listings.find_one({"id": listing_id}, {"_id": 0})
+async def get_listing(listing_id: str, request: Request):
+    cache_key, cached = await response_cache.lookup("listing", {"id": listing_id}, [f"listing:{listing_id}"])
+    if cached:
+        analytics_recorder.record(listing_id, views=1)
+        return cached_json_response(request, cached)
+    
+    listing = await db.listings.find_one({"id": listing_id}, listing_serializer.projection)
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found")
     
-    if isinstance(listing.get('timestamp'), str):
-        listing['created_at'] = datetime.fromisoformat(listing.pop('timestamp'))
-    
-    return Listing(**listing)
+    analytics_recorder.record(listing_id, seller_id=listing['seller_id'], views=1)
+    await attach_image_variants([listing])
+    body = listing_serializer.dumps_one(listing)
+    return cached_json_response(request, await response_cache.store(cache_key, body, {}))
 
 @api_router.put("/listings/{listing_id}", response_model=Listing)
 async def update_listing(listing_id: str, listing_data: ListingUpdate, current_user: User = Depends(get_current_user)):
@@ -362,9 +3379,9 @@ async def update_listing(listing_id: str, listing_data: ListingUpdate, current_u
     await db.listings.update_one({"id": listing_id}, {"$set": update_data})
     
     updated = await db.listings.find_one({"id": listing_id}, {"_id": 0})
-    if isinstance(updated.get('timestamp'), str):
-        updated['created_at'] = datetime.fromisoformat(updated.pop('timestamp'))
-    
+    search_index.add(updated)
+    await invalidate_listing(listing_id)
+    await attach_image_variants([updated])
     return Listing(**updated)
 
 @api_router.delete("/listings/{listing_id}")
@@ -377,6 +3394,8 @@ async def delete_listing(listing_id: str, current_user: User = Depends(get_curre
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.listings.delete_one({"id": listing_id})
+    search_index.remove(listing_id)
+    await invalidate_listing(listing_id)
     return {"message": "Listing deleted"}
 
 # Reviews
@@ -393,28 +3412,37 @@ async def create_review(review_data: ReviewCreate, current_user: User = Depends(
     )
     
     review_dict = review.model_dump()
-    review_dict['timestamp'] = review_dict.pop('created_at').isoformat()
+    review_dict['timestamp'] = review_dict.pop('created_at')
     
     await db.reviews.insert_one(review_dict)
     
-    reviews = await db.reviews.find({"listing_id": review_data.listing_id}, {"_id": 0}).to_list(1000)
-    avg_rating = sum(r['rating'] for r in reviews) / len(reviews)
-    await db.listings.update_one(
-        {"id": review_data.listing_id},
-        {"$set": {"rating": round(avg_rating, 1), "reviews_count": len(reviews)}}
-    )
+    if 'rating_sum' not in listing and listing.get('reviews_count', 0) > 0:
+        # Listing predates running aggregates; rebuild it from its reviews once.
+        await reconcile_rating_aggregates([review_data.listing_id])
+    else:
+        await apply_review_rating(review_data.listing_id, review.rating)
+    await response_cache.invalidate("listings", f"listing:{review_data.listing_id}", f"reviews:{review_data.listing_id}")
     
     return review
 
 @api_router.get("/reviews/{listing_id}", response_model=List[Review])
-async def get_reviews(listing_id: str):
-    reviews = await db.reviews.find({"listing_id": listing_id}, {"_id": 0}).to_list(1000)
+async def get_reviews(
+    listing_id: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+):
+    params = {"listing_id": listing_id, "cursor": cursor, "limit": limit}
+    cache_key, cached = await response_cache.lookup("reviews", params, [f"reviews:{listing_id}"])
+    if cached:
+        return cached_json_response(request, cached)
     
-    for r in reviews:
-        if isinstance(r.get('timestamp'), str):
-            r['created_at'] = datetime.fromisoformat(r.pop('timestamp'))
-    
-    return [Review(**r) for r in reviews]
+    reviews, next_cursor = await fetch_page(
+        db.reviews, [{"listing_id": listing_id}], "timestamp", -1, limit, cursor, projection=review_serializer.projection
+    )
+    body = review_serializer.dumps(reviews)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    return cached_json_response(request, await response_cache.store(cache_key, body, headers))
 
 # Orders
 @api_router.post("/orders", response_model=Order)
@@ -423,8 +3451,8 @@ async def create_order(listing_id: str, quantity: int, current_user: User = Depe
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found")
     
-    if listing.get('type') == "product" and listing.get('stock', 0) < quantity:
-        raise HTTPException(status_code=400, detail="Insufficient stock")
+    if quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
     
     order = Order(
         buyer_id=current_user.id,
@@ -436,106 +3464,455 @@ async def create_order(listing_id: str, quantity: int, current_user: User = Depe
         total_amount=listing['price'] * quantity
     )
     
+    if listing.get('type') == "product":
+        if not await reserve_stock(listing_id, quantity):
+            raise HTTPException(status_code=400, detail="Insufficient stock")
+        order.reservation = "held"
+        order.reserved_until = datetime.now(timezone.utc) + timedelta(seconds=ORDER_RESERVATION_SECONDS)
+    
     order_dict = order.model_dump()
-    order_dict['timestamp'] = order_dict.pop('created_at').isoformat()
+    order_dict['timestamp'] = order_dict.pop('created_at')
     
-    await db.orders.insert_one(order_dict)
+    try:
+        await db.orders.insert_one(order_dict)
+    except PyMongoError:
+        if order.reservation == "held":
+            await db.listings.update_one({"id": listing_id}, {"$inc": {"stock": quantity}})
+            await invalidate_listing(listing_id)
+        raise
+    analytics_recorder.record(listing_id, seller_id=order.seller_id, orders=1)
     return order
 
 @api_router.get("/orders", response_model=List[Order])
-async def get_orders(current_user: User = Depends(get_current_user)):
+async def get_orders(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_token_user),
+):
+    query = {"buyer_id": current_user.id} if current_user.role == "buyer" else {"seller_id": current_user.id}
+    orders, next_cursor = await fetch_page(
+        db.orders, [query], "timestamp", -1, limit, cursor, projection=order_serializer.projection
+    )
+    return json_page_response(order_serializer.dumps(orders), next_cursor)
+
+@api_router.get("/orders/export")
+async def export_orders(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: User = Depends(get_token_user),
+):
     query = {"buyer_id": current_user.id} if current_user.role == "buyer" else {"seller_id": current_user.id}
-    orders = await db.orders.find(query, {"_id": 0}).to_list(1000)
+    cursor = db.orders.find(query, order_serializer.projection).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).batch_size(IMPORT_BATCH_SIZE)
+    return export_response(cursor, order_serializer, ORDER_EXPORT_COLUMNS, format, "orders")
+
+@api_router.get("/orders/{order_id}", response_model=Order)
+async def get_order(order_id: str, current_user: User = Depends(get_token_user)):
+    order = await db.orders.find_one({"id": order_id}, order_serializer.projection)
+    if not order or current_user.id not in (order['buyer_id'], order['seller_id']):
+        raise HTTPException(status_code=404, detail="Order not found")
+    return json_page_response(order_serializer.dumps_one(order))
+
+# Analytics
+@api_router.get("/analytics", response_model=AnalyticsReport)
+async def get_analytics(
+    granularity: str = Query("day", pattern="^(hour|day)$"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user: User = Depends(get_token_user),
+):
+    if current_user.role != "seller":
+        raise HTTPException(status_code=403, detail="Only sellers have analytics")
     
-    for o in orders:
-        if isinstance(o.get('timestamp'), str):
-            o['created_at'] = datetime.fromisoformat(o.pop('timestamp'))
+    step = ANALYTICS_STEPS[granularity]
+    end = as_utc(end) if end else datetime.now(timezone.utc)
+    if start is None:
+        start = bucket_start(end, granularity) - step * (ANALYTICS_DEFAULT_BUCKETS[granularity] - 1)
+    start = as_utc(start)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - bucket_start(start, granularity)) / step > ANALYTICS_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {ANALYTICS_MAX_BUCKETS} {granularity} buckets")
     
-    return [Order(**o) for o in orders]
+    return await seller_analytics(current_user.id, granularity, start, end)
 
 # Messages & Chat
-@api_router.get("/users", response_model=List[User])
-async def get_users(current_user: User = Depends(get_current_user)):
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    filtered_users = [User(**u) for u in users if u["id"] != current_user.id]
-    return filtered_users
+@api_router.get("/users", response_model=List[DirectoryUser])
+async def get_users(
+    q: Optional[str] = Query(None, max_length=100, description="Prefix of a name, of a later word in it, or of an email"),
+    role: Optional[str] = Query(None, pattern="^(buyer|seller)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_token_user),
+):
+    conditions = [{"id": {"$ne": current_user.id}}]
+    prefix = directory_key(q or "")
+    if prefix:
+        # Anchored and case-sensitive against casefolded keys, so it is an index range scan
+        conditions.append({"search_keys": {"$regex": f"^{re.escape(prefix)}"}})
+    if role:
+        conditions.append({"role": role})
+    
+    users, next_cursor = await fetch_page(
+        db.users, conditions, "name_key", 1, limit, cursor, projection=DIRECTORY_PROJECTION
+    )
+    return json_page_response(dump_json(await directory_entries(users)), next_cursor)
+
+@api_router.get("/users/{user_id}", response_model=DirectoryUser)
+async def get_directory_user(user_id: str, current_user: User = Depends(get_token_user)):
+    user = await db.users.find_one({"id": user_id}, DIRECTORY_PROJECTION)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return (await directory_entries([user]))[0]
 
 @api_router.get("/messages/{other_user_id}", response_model=List[Message])
-async def get_messages(other_user_id: str, current_user: User = Depends(get_current_user)):
+async def get_messages(
+    other_user_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_token_user),
+):
+    """Windowed chat history, always returned oldest first.
+
+    By default returns the latest `limit` messages; `before` pages back from a
+    message id and `after` returns what arrived since a message id. When more
+    messages exist in that direction, the id to pass next is sent in the
+    X-Next-Cursor header. Reading history does not mark it read; see
+    POST /messages/{other_user_id}/read.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+    
+    # seq orders a conversation even when senders' clocks disagree
+    conversation = {"conversation_id": conversation_id(current_user.id, other_user_id)}
+    conditions = [conversation]
+    direction = 1 if after else -1
+    anchor_id = after or before
+    if anchor_id:
+        anchor = await find_message_anchor(anchor_id, conversation)
+        conditions.append(keyset_after("seq", direction, anchor['seq'], anchor['id']))
+    
     messages = await db.messages.find(
-        {"$or": [
-            {"sender_id": current_user.id, "receiver_id": other_user_id},
-            {"sender_id": other_user_id, "receiver_id": current_user.id}
-        ]},
-        {"_id": 0}
-    ).to_list(10000)
-    
-    await db.messages.update_many(
-        {"sender_id": other_user_id, "receiver_id": current_user.id},
-        {"$set": {"read": True}}
+        combine_conditions(conditions), message_serializer.projection
+    ).sort([("seq", direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+    
+    next_id = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        next_id = messages[-1]['id']
+    if direction == -1:
+        messages.reverse()
+    
+    return json_page_response(message_serializer.dumps(messages), next_id)
+
+@api_router.post("/messages/{other_user_id}/read")
+async def mark_messages_read(other_user_id: str, receipt: ReadReceipt, current_user: User = Depends(get_token_user)):
+    return await mark_conversation_read(current_user.id, other_user_id, receipt.up_to_id)
+
+@api_router.get("/threads", response_model=List[Thread])
+async def get_threads(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_token_user),
+):
+    conversations, next_cursor = await fetch_page(
+        db.conversations, [{"participants": current_user.id}], "last_message_time", -1, limit, cursor
     )
+    set_next_cursor(response, next_cursor)
     
-    for m in messages:
-        if isinstance(m.get('timestamp'), str):
-            m['created_at'] = datetime.fromisoformat(m.pop('timestamp'))
+    other_ids = [next((p for p in c['participants'] if p != current_user.id), current_user.id) for c in conversations]
+    users = await db.users.find({"id": {"$in": other_ids}}, {"_id": 0, "id": 1, "name": 1, "avatar": 1}).to_list(None)
+    users_by_id = {u['id']: u for u in users}
     
-    return sorted([Message(**m) for m in messages], key=lambda x: x.created_at)
+    threads = []
+    for c, other_id in zip(conversations, other_ids):
+        other = users_by_id.get(other_id, {})
+        threads.append(Thread(
+            id=c['id'],
+            other_user_id=other_id,
+            other_user_name=other.get('name', 'Unknown user'),
+            other_user_avatar=other.get('avatar'),
+            last_message=c.get('last_message', ''),
+            last_message_time=c['last_message_time'],
+            unread_count=c.get('unread', {}).get(current_user.id, 0),
+        ))
+    return threads
+
+class MultipartFileStream:
+    """The "file" part of a multipart/form-data request, streamed as it is parsed.
+
+    Iterating yields the part's bytes chunk by chunk, so the upload is hashed
+    and written once instead of being spooled to a temp file first. filename
+    is set as soon as the part's headers have been read. Other fields are
+    skipped, and the whole body is cut off once it passes body_limit.
+    """
+
+    def __init__(self, request: Request, body_limit: int):
+        self.request = request
+        self.body_limit = body_limit
+        self.filename: Optional[str] = None
+        _, params = parse_options_header(request.headers.get("content-type", ""))
+        boundary = params.get(b"boundary")
+        if not boundary:
+            raise HTTPException(status_code=400, detail="Missing boundary in multipart upload")
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+        })
+        self.disposition = b""
+        self.header_name = b""
+        self.header_value = b""
+        self.in_file = False
+        self.pending: List[bytes] = []
+
+    def on_part_begin(self):
+        self.disposition = b""
+        self.in_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        if self.header_name.lower() == b"content-disposition":
+            self.disposition = self.header_value
+        self.header_name = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.disposition)
+        if options.get(b"name") == b"file" and b"filename" in options and self.filename is None:
+            self.filename = options[b"filename"].decode("utf-8", errors="replace")
+            self.in_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.in_file:
+            self.pending.append(data[start:end])
+
+    async def __aiter__(self):
+        size = 0
+        try:
+            async for chunk in self.request.stream():
+                size += len(chunk)
+                if size > self.body_limit:
+                    raise HTTPException(status_code=413, detail=size_limit_detail(MAX_UPLOAD_BYTES))
+                self.parser.write(chunk)
+                if self.pending:
+                    yield b"".join(self.pending)
+                    self.pending.clear()
+            self.parser.finalize()
+        except MultipartParseError:
+            raise HTTPException(status_code=400, detail="Malformed multipart upload")
+        if self.filename is None:
+            raise HTTPException(status_code=400, detail="Missing file field")
 
 @api_router.post("/upload")
-async def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
+async def upload_file(request: Request, current_user: User = Depends(get_current_user)):
+    """Multipart upload of a single "file" field, hashed and size-checked as it streams in."""
+    # Allow for the multipart boundaries and part headers around the file
+    body_limit = MAX_UPLOAD_BYTES + UPLOAD_READ_SIZE
     try:
-        file.file.seek(0, 2)
-        file_size = file.file.tell()
-        file.file.seek(0)
-        
-        if file_size > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File size must be less than 10MB")
-        
-        file_extension = file.filename.split(".")[-1] if "." in file.filename else ""
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        file_url = f"http://localhost:8000/uploads/{unique_filename}"
-        return {"file_url": file_url, "file_name": file.filename}
-    except HTTPException:
+        if int(request.headers.get("content-length") or 0) > body_limit:
+            raise HTTPException(status_code=413, detail=size_limit_detail(MAX_UPLOAD_BYTES))
+        if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+            raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+        upload = MultipartFileStream(request, body_limit)
+        temp_path, digest, _ = await stream_to_temp(upload, MAX_UPLOAD_BYTES)
+    except HTTPException as e:
+        # This endpoint has always answered oversized files with a 400
+        if e.status_code == 413:
+            raise HTTPException(status_code=400, detail=e.detail)
         raise
+    
+    try:
+        key = content_key(digest, upload.filename)
+        await storage.store(temp_path, key)
+        schedule_image_variants(key)
+        return {"file_url": storage.url(key), "file_name": upload.filename}
     except Exception as e:
+        temp_path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
 
+@api_router.put("/upload/stream")
+async def upload_stream(filename: str, request: Request, current_user: User = Depends(get_current_user)):
+    """Upload a raw request body (no multipart), hashed and size-checked as it streams in."""
+    temp_path, digest, _ = await stream_to_temp(request.stream(), MAX_UPLOAD_BYTES)
+    key = content_key(digest, filename)
+    await storage.store(temp_path, key)
+    schedule_image_variants(key)
+    return {"file_url": storage.url(key), "file_name": filename}
+
+# Resumable uploads: create a session, PUT chunks at increasing offsets (resume
+# from the session's `received`), then complete it to get the file URL.
+@api_router.post("/upload/sessions", response_model=UploadSession)
+async def create_upload_session(session_data: UploadSessionCreate, current_user: User = Depends(get_current_user)):
+    if session_data.size > MAX_CHUNKED_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=size_limit_detail(MAX_CHUNKED_UPLOAD_BYTES))
+    
+    upload_id = str(uuid.uuid4())
+    partial_upload_path(upload_id).touch()
+    await db.upload_sessions.insert_one({
+        "id": upload_id,
+        "user_id": current_user.id,
+        "filename": session_data.filename,
+        "content_type": session_data.content_type,
+        "size": session_data.size,
+        "received": 0,
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS),
+    })
+    return UploadSession(upload_id=upload_id, filename=session_data.filename, size=session_data.size,
+                         received=0, chunk_size=UPLOAD_CHUNK_SIZE)
+
+async def get_upload_session_doc(upload_id: str, user_id: str) -> dict:
+    session = await db.upload_sessions.find_one({"id": upload_id}, {"_id": 0})
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session['user_id'] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return session
+
+@api_router.get("/upload/sessions/{upload_id}", response_model=UploadSession)
+async def get_upload_session(upload_id: str, current_user: User = Depends(get_current_user)):
+    session = await get_upload_session_doc(upload_id, current_user.id)
+    return UploadSession(upload_id=upload_id, filename=session['filename'], size=session['size'],
+                         received=session['received'], chunk_size=UPLOAD_CHUNK_SIZE)
+
+@api_router.put("/upload/sessions/{upload_id}", response_model=UploadSession)
+async def upload_chunk(upload_id: str, offset: int, request: Request, current_user: User = Depends(get_current_user)):
+    session = await get_upload_session_doc(upload_id, current_user.id)
+    if offset != session['received']:
+        raise HTTPException(status_code=409, detail=f"Expected offset {session['received']}")
+    
+    limit = min(UPLOAD_CHUNK_SIZE, session['size'] - offset)
+    received = offset
+    out = await asyncio.to_thread(open_partial_upload, partial_upload_path(upload_id), offset)
+    try:
+        received += await write_stream(out, limit_stream(request.stream(), limit))
+    except HTTPException as e:
+        if e.status_code == 413:
+            raise HTTPException(status_code=413, detail=f"Chunk exceeds {limit} bytes")
+        raise
+    finally:
+        await asyncio.to_thread(out.close)
+    
+    # Conditional on the offset so two racing PUTs of the same chunk cannot both advance it.
+    result = await db.upload_sessions.update_one(
+        {"id": upload_id, "received": offset},
+        {"$set": {"received": received}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Upload session changed concurrently")
+    return UploadSession(upload_id=upload_id, filename=session['filename'], size=session['size'],
+                         received=received, chunk_size=UPLOAD_CHUNK_SIZE)
+
+@api_router.post("/upload/sessions/{upload_id}/complete")
+async def complete_upload_session(upload_id: str, current_user: User = Depends(get_current_user)):
+    session = await get_upload_session_doc(upload_id, current_user.id)
+    if session['received'] != session['size']:
+        raise HTTPException(status_code=409, detail=f"Upload incomplete: {session['received']} of {session['size']} bytes")
+    
+    path = partial_upload_path(upload_id)
+    digest = await asyncio.to_thread(hash_file, path)
+    key = content_key(digest, session['filename'])
+    await storage.store(path, key)
+    schedule_image_variants(key)
+    await db.upload_sessions.delete_one({"id": upload_id})
+    return {"file_url": storage.url(key), "file_name": session['filename']}
+
 # Wishlist
+def wishlist_upsert(user_id: str, listing_id: str) -> UpdateOne:
+    # The unique (user_id, listing_id) index makes re-adding a no-op instead of a duplicate.
+    wishlist_dict = Wishlist(user_id=user_id, listing_id=listing_id).model_dump()
+    wishlist_dict['timestamp'] = wishlist_dict.pop('created_at')
+    return UpdateOne({"user_id": user_id, "listing_id": listing_id}, {"$setOnInsert": wishlist_dict}, upsert=True)
+
+async def apply_wishlist_upserts(ops: List[UpdateOne]) -> int:
+    """Run wishlist upserts; returns how many entries were newly added."""
+    try:
+        result = await db.wishlist.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        # Concurrent upserts of the same pair can both try to insert; the loser already exists.
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+        return e.details.get("nUpserted", 0)
+    return result.upserted_count
+
+@api_router.post("/wishlist/batch")
+async def update_wishlist_batch(batch: WishlistBatch, current_user: User = Depends(get_current_user)):
+    added = 0
+    if batch.add:
+        added = await apply_wishlist_upserts([wishlist_upsert(current_user.id, listing_id) for listing_id in dict.fromkeys(batch.add)])
+    removed = 0
+    if batch.remove:
+        result = await db.wishlist.delete_many({"user_id": current_user.id, "listing_id": {"$in": batch.remove}})
+        removed = result.deleted_count
+    return {"added": added, "removed": removed}
+
+@api_router.get("/wishlist/check")
+async def check_wishlist(listing_ids: str = Query(..., description="Comma-separated listing ids"),
+                         current_user: User = Depends(get_token_user)):
+    """Which of a page of listings the user has wishlisted, as {listing_id: bool}."""
+    ids = list(dict.fromkeys(i for i in listing_ids.split(",") if i))
+    if len(ids) > MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_SIZE} listing ids per request")
+    found = await db.wishlist.find(
+        {"user_id": current_user.id, "listing_id": {"$in": ids}}, {"_id": 0, "listing_id": 1}
+    ).to_list(None)
+    wishlisted = {item['listing_id'] for item in found}
+    return {listing_id: listing_id in wishlisted for listing_id in ids}
+
 @api_router.post("/wishlist/{listing_id}")
 async def add_to_wishlist(listing_id: str, current_user: User = Depends(get_current_user)):
-    existing = await db.wishlist.find_one({"user_id": current_user.id, "listing_id": listing_id}, {"_id": 0})
-    if existing:
-        return {"message": "Already in wishlist"}
-    
-    wishlist = Wishlist(user_id=current_user.id, listing_id=listing_id)
-    wishlist_dict = wishlist.model_dump()
-    wishlist_dict['timestamp'] = wishlist_dict.pop('created_at').isoformat()
-    
-    await db.wishlist.insert_one(wishlist_dict)
-    return {"message": "Added to wishlist"}
+    if await apply_wishlist_upserts([wishlist_upsert(current_user.id, listing_id)]):
+        return {"message": "Added to wishlist"}
+    return {"message": "Already in wishlist"}
 
 @api_router.delete("/wishlist/{listing_id}")
 async def remove_from_wishlist(listing_id: str, current_user: User = Depends(get_current_user)):
     await db.wishlist.delete_one({"user_id": current_user.id, "listing_id": listing_id})
     return {"message": "Removed from wishlist"}
 
+# Wishlist rows joined to just the listing fields the page returns
+WISHLIST_PAGE_PROJECTION = {
+    "_id": 0, "id": 1, "timestamp": 1,
+    **{f"listing.{field}": 1 for field in listing_serializer.projection if field != "_id"},
+}
+
 @api_router.get("/wishlist", response_model=List[Listing])
-async def get_wishlist(current_user: User = Depends(get_current_user)):
-    wishlist_items = await db.wishlist.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    listing_ids = [item['listing_id'] for item in wishlist_items]
-    
-    listings = await db.listings.find({"id": {"$in": listing_ids}}, {"_id": 0}).to_list(1000)
-    
-    for p in listings:
-        if isinstance(p.get('timestamp'), str):
-            p['created_at'] = datetime.fromisoformat(p.pop('timestamp'))
+async def get_wishlist(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: User = Depends(get_token_user),
+):
+    """Wishlisted listings, most recently added first, in one aggregation round-trip."""
+    conditions = [{"user_id": current_user.id}]
+    if cursor:
+        conditions.append(keyset_condition("timestamp", -1, cursor))
+    rows = await db.wishlist.aggregate([
+        {"$match": combine_conditions(conditions)},
+        {"$sort": {"timestamp": -1, "id": -1}},
+        {"$limit": limit + 1},
+        {"$lookup": {"from": "listings", "localField": "listing_id", "foreignField": "id", "as": "listing"}},
+        {"$unwind": {"path": "$listing", "preserveNullAndEmptyArrays": True}},
+        {"$project": WISHLIST_PAGE_PROJECTION},
+    ]).to_list(limit + 1)
     
-    return [Listing(**p) for p in listings]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['timestamp'], rows[-1]['id']])
+    # Entries whose listing was deleted keep their place in the cursor but are not returned
+    listings = [row['listing'] for row in rows if row.get('listing')]
+    await attach_image_variants(listings)
+    return json_page_response(listing_serializer.dumps(listings), next_cursor)
 
 # Payments
 class CheckoutSessionResponse(BaseModel):
@@ -551,77 +3928,98 @@ async def create_checkout_session(order_id: str, request: Request, current_user:
     if order['buyer_id'] != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
+    if order['status'] != "pending":
+        raise HTTPException(status_code=409, detail="Order is no longer awaiting payment")
+    
+    session_params = {}
+    if order.get('reservation') == "held":
+        # Stripe sessions stay open for at least 30 minutes, so stretch the hold to cover one
+        now = datetime.now(timezone.utc)
+        order = await db.orders.find_one_and_update(
+            {"id": order_id, "status": "pending"},
+            {"$max": {"reserved_until": now + timedelta(seconds=STRIPE_MIN_SESSION_SECONDS)}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+        if not order:
+            raise HTTPException(status_code=409, detail="Order is no longer awaiting payment")
+        reserved_until = as_utc(order['reserved_until'])
+        session_params['expires_at'] = int(min(reserved_until, now + timedelta(seconds=STRIPE_MAX_SESSION_SECONDS)).timestamp())
+    
     host_url = str(request.base_url)
     success_url = f"{host_url}payment-success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{host_url}payment-cancel"
 
     try:
-        checkout_session = stripe.checkout.Session.create(
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {'name': order['listing_title']},
-                    'unit_amount': int(order['total_amount'] * 100),
-                },
-                'quantity': order['quantity'],
-            }],
-            mode='payment',
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata={"order_id": order_id, "buyer_id": current_user.id}
-        )
-
-        transaction = PaymentTransaction(
-            session_id=checkout_session.id,
-            order_id=order_id,
-            buyer_id=current_user.id,
-            amount=float(order['total_amount']),
-            currency="usd",
-            payment_status="pending",
-            metadata={"order_id": order_id}
-        )
-        
-        transaction_dict = transaction.model_dump()
-        transaction_dict['timestamp'] = transaction_dict.pop('created_at').isoformat()
-        
-        await db.payment_transactions.insert_one(transaction_dict)
-        await db.orders.update_one({"id": order_id}, {"$set": {"session_id": checkout_session.id}})
-        
-        return CheckoutSessionResponse(session_id=checkout_session.id, url=checkout_session.url)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        with trace_span("stripe.checkout.sessions.create"):
+            checkout_session = await get_stripe_client().v1.checkout.sessions.create_async(params={
+                'line_items': [{
+                    'price_data': {
+                        'currency': 'usd',
+                        'product_data': {'name': order['listing_title']},
+                        'unit_amount': int(order['total_amount'] * 100),
+                    },
+                    'quantity': order['quantity'],
+                }],
+                'mode': 'payment',
+                'success_url': success_url,
+                'cancel_url': cancel_url,
+                'metadata': {"order_id": order_id, "buyer_id": current_user.id},
+                **session_params,
+            })
+    except stripe.StripeError as e:
+        raise HTTPException(status_code=502, detail=f"Payment provider error: {e.user_message or e}")
+    
+    transaction = PaymentTransaction(
+        session_id=checkout_session.id,
+        order_id=order_id,
+        buyer_id=current_user.id,
+        amount=float(order['total_amount']),
+        currency="usd",
+        payment_status="pending",
+        metadata={"order_id": order_id}
+    )
+    
+    transaction_dict = transaction.model_dump()
+    transaction_dict['timestamp'] = transaction_dict.pop('created_at')
+    transaction_dict['status_checked_at'] = transaction_dict['timestamp']
+    
+    await db.payment_transactions.insert_one(transaction_dict)
+    await db.orders.update_one({"id": order_id}, {"$set": {"session_id": checkout_session.id}})
+    
+    return CheckoutSessionResponse(session_id=checkout_session.id, url=checkout_session.url)
 
 class CheckoutStatusResponse(BaseModel):
     payment_status: str
+    status: Optional[str] = None
+
+def status_is_stale(transaction: dict) -> bool:
+    checked_at = transaction.get('status_checked_at') or transaction.get('timestamp')
+    if not checked_at:
+        return True
+    age = datetime.now(timezone.utc) - as_utc(checked_at)
+    return age.total_seconds() >= CHECKOUT_STATUS_REFRESH_SECONDS
 
 @api_router.get("/checkout/status/{session_id}", response_model=CheckoutStatusResponse)
-async def get_checkout_status(session_id: str, current_user: User = Depends(get_current_user)):
-    try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        payment_status = session.payment_status
-
-        if payment_status == "paid":
-            transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
-            if transaction and transaction['payment_status'] != "paid":
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {"$set": {"payment_status": "paid"}}
-                )
-                await db.orders.update_one(
-                    {"id": transaction['order_id']},
-                    {"$set": {"payment_status": "paid", "status": "confirmed"}}
-                )
-                
-                order = await db.orders.find_one({"id": transaction['order_id']}, {"_id": 0})
-                if order:
-                    await db.listings.update_one(
-                        {"id": order['listing_id']},
-                        {"$inc": {"stock": -order['quantity']}}
-                    )
-        
-        return CheckoutStatusResponse(payment_status=payment_status)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def get_checkout_status(session_id: str, current_user: User = Depends(get_token_user)):
+    transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+    if not transaction or transaction['buyer_id'] != current_user.id:
+        raise HTTPException(status_code=404, detail="Checkout session not found")
+    
+    payment_status = transaction['payment_status']
+    session_status = transaction.get('session_status')
+    if payment_status != "paid" and session_status != "expired" and status_is_stale(transaction):
+        try:
+            with trace_span("stripe.checkout.sessions.retrieve"):
+                session = await get_stripe_client().v1.checkout.sessions.retrieve_async(session_id)
+        except stripe.StripeError as e:
+            # Serve the cached status; the next poll or the webhook will catch up
+            logger.warning(f"Stripe status refresh failed for {session_id}: {e}")
+        else:
+            payment_status, session_status = session.payment_status, session.status
+            await apply_session_status(session_id, payment_status, session_status)
+    
+    return CheckoutStatusResponse(payment_status=payment_status, status=session_status)
 
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
@@ -635,66 +4033,84 @@ async def stripe_webhook(request: Request):
     except:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
-    if event['type'] == 'checkout.session.completed':
+    if not await claim_webhook_event(event['id']):
+        return {"status": "duplicate"}
+
+    if event['type'] in ('checkout.session.completed', 'checkout.session.expired',
+                         'checkout.session.async_payment_succeeded', 'checkout.session.async_payment_failed'):
         session = event['data']['object']
-        session_id = session['id']
         payment_status = session['payment_status']
+        if event['type'] == 'checkout.session.async_payment_failed':
+            payment_status = "failed"
+        await apply_session_status(session['id'], payment_status, getattr(session, 'status', None))
 
-        if payment_status == "paid":
-            transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
-            if transaction and transaction['payment_status'] != "paid":
-                await db.payment_transactions.update_one(
-                    {"session_id": session_id},
-                    {"$set": {"payment_status": "paid"}}
-                )
-                await db.orders.update_one(
-                    {"id": transaction['order_id']},
-                    {"$set": {"payment_status": "paid", "status": "confirmed"}}
-                )
-
+    await db.stripe_events.update_one({"id": event['id']}, {"$set": {"type": event['type'], "processed_at": datetime.now(timezone.utc)}})
     return {"status": "success"}
 
 # WebSocket for Chat
 @app.websocket("/ws/chat/{user_id}")
 async def chat_endpoint(websocket: WebSocket, user_id: str):
-    await connection_manager.connect(websocket, user_id)
+    connection = await connection_manager.connect(websocket, user_id)
     
     try:
         while True:
-            data = await websocket.receive_json()
-            receiver_id = data.get("receiver_id")
-            message_text = data.get("message", "")
-            file_url = data.get("file_url")
-            file_type = data.get("file_type")
-            file_name = data.get("file_name")
+            text = await websocket.receive_text()
+            connection.touch()
+            # A malformed frame gets an error event; it must not drop the socket
+            try:
+                data = json.loads(text)
+                frame_type = data.get("type") if isinstance(data, dict) else None
+                if frame_type == "pong":
+                    continue
+                if frame_type == "read":
+                    receipt = ReadFrame.model_validate(data)
+                    await mark_conversation_read(user_id, receipt.other_user_id, receipt.up_to_id)
+                    continue
+                chat = MessageCreate.model_validate(data)
+            except json.JSONDecodeError:
+                connection.enqueue(json.dumps({"type": "error", "detail": "Frame is not valid JSON"}))
+                continue
+            except ValidationError as e:
+                connection.enqueue(json.dumps({"type": "error", "detail": validation_message(e, "frame")}))
+                continue
+            except HTTPException as e:
+                connection.enqueue(json.dumps({"type": "error", "detail": e.detail}))
+                continue
 
             message_doc = {
                 "id": str(uuid.uuid4()),
                 "sender_id": user_id,
-                "receiver_id": receiver_id,
-                "message": message_text,
-                "file_url": file_url,
-                "file_type": file_type,
-                "file_name": file_name,
+                "receiver_id": chat.receiver_id,
+                "message": chat.message,
+                "file_url": chat.file_url,
+                "file_type": chat.file_type,
+                "file_name": chat.file_name,
                 "read": False,
                 "timestamp": datetime.now(timezone.utc).isoformat(),
             }
             
-            await db.messages.insert_one(message_doc.copy())
+            await message_writer.submit(message_doc)
 
             ws_message = {"type": "chat", "data": message_doc}
             
-            await connection_manager.send_personal_message(receiver_id, ws_message)
-            await websocket.send_json(ws_message)
+            await connection_manager.send_personal_message(chat.receiver_id, ws_message)
+            connection.enqueue(json.dumps(ws_message))
 
     except WebSocketDisconnect:
-        await connection_manager.disconnect(websocket, user_id)
+        await connection_manager.disconnect(connection)
     except Exception as e:
-        print(f"WebSocket error: {e}")
-        await connection_manager.disconnect(websocket, user_id)
+        logger.warning(f"WebSocket error for {user_id}: {e}")
+        await connection_manager.disconnect(connection)
 
-# Include router and mount static files
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+# Metrics
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: str = Header(None)):
+    if METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Include router and upload serving
+app.add_api_route("/uploads/{key}", serve_upload, methods=["GET", "HEAD"], include_in_schema=False)
 app.include_router(api_router)
 
 app.add_middleware(
@@ -703,11 +4119,80 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+# Outermost, so its timings include CORS handling
+app.add_middleware(MetricsMiddleware)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def migrate_timestamps():
+    # Keyset cursors compare dates as datetimes, which never match dates still stored as strings
+    for collection_name, fields in DATETIME_FIELDS.items():
+        if await db[collection_name].find_one(string_dates_query(fields), {"_id": 1}):
+            converted = await migrate_datetime_fields()
+            logger.info(f"Converted string dates to datetimes: {converted}")
+            return
+
+@app.on_event("startup")
+async def backfill_user_directory():
+    # get_users pages with name_key > cursor, which never matches users lacking the key
+    if await db.users.find_one({"name_key": {"$exists": False}}, {"_id": 1}):
+        count = await backfill_directory_fields()
+        logger.info(f"Added directory keys to {count} users")
+
+@app.on_event("startup")
+async def backfill_messages():
+    # Messages from before seq paging are invisible to chat history until backfilled
+    if await db.messages.find_one({"conversation_id": {"$exists": False}}, {"_id": 1}):
+        count = await backfill_message_sequence()
+        logger.info(f"Added conversation_id and seq to {count} messages")
+
+@app.on_event("startup")
+async def start_upload_cleanup():
+    asyncio.create_task(purge_stale_uploads_periodically())
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    asyncio.create_task(monitor_event_loop_lag())
+
+@app.on_event("startup")
+async def start_order_sweeper():
+    asyncio.create_task(release_expired_reservations_periodically())
+
+@app.on_event("startup")
+async def start_analytics_recorder():
+    await analytics_recorder.start()
+
+@app.on_event("startup")
+async def start_message_writer():
+    await message_writer.start()
+
+@app.on_event("startup")
+async def start_chat_backplane():
+    await connection_manager.start()
+
+@app.on_event("startup")
+async def build_search_index():
+    await rebuild_search_index()
+    asyncio.create_task(refresh_search_index_periodically())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    global password_pool
+    await connection_manager.stop()
+    await message_writer.close()
+    await analytics_recorder.close()
+    await close_stripe_client()
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+    if password_pool is not None:
+        password_pool.shutdown(wait=False, cancel_futures=True)
+        password_pool = None
     client.close()
\ No newline at end of file
@@ -3,10 +3,19 @@ import { useNavigate } from 'react-router-dom';
 import { Card, CardHeader, CardContent, CardFooter } from './ui/card';
 import { Button } from './ui/button';
 import { Badge } from './ui/badge';
-import { ShieldCheck, Star } from 'lucide-react';
+import { Heart, ShieldCheck, Star } from 'lucide-react';
 
-const ListingCard = ({ listing }) => {
+const FALLBACK_IMAGE = 'https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=400';
+
+// "url 320w, url 640w" from a { width: url } map of generated renditions
+const toSrcSet = (widths) =>
+  Object.entries(widths || {})
+    .map(([width, url]) => `${url} ${width}w`)
+    .join(', ');
+
+const ListingCard = ({ listing, wishlisted, onToggleWishlist }) => {
   const navigate = useNavigate();
+  const variants = listing.image_variants?.[0];
 
   return (
     <Card
@@ -15,12 +24,34 @@ const ListingCard = ({ listing }) => {
       data-testid="listing-card"
     >
       <div className="relative aspect-[4/3] overflow-hidden bg-muted">
-        <img
-          src={listing.images?.[0] || 'https://images.unsplash.com/photo-1505740420928-5e560c06d30e?w=400'}
-          alt={listing.title}
-          className="h-full w-full object-cover transition-transform duration-300 group-hover:scale-[1.02]"
-          loading="lazy"
-        />
+        <picture>
+          {variants?.avif && Object.keys(variants.avif).length > 0 && (
+            <source type="image/avif" srcSet={toSrcSet(variants.avif)} sizes="(min-width: 1024px) 25vw, 50vw" />
+          )}
+          {variants?.webp && (
+            <source type="image/webp" srcSet={toSrcSet(variants.webp)} sizes="(min-width: 1024px) 25vw, 50vw" />
+          )}
+          <img
+            src={variants?.thumbnail || listing.images?.[0] || FALLBACK_IMAGE}
+            alt={listing.title}
+            className="h-full w-full object-cover transition-transform duration-300 group-hover:scale-[1.02]"
+            loading="lazy"
+          />
+        </picture>
+        {onToggleWishlist && (
+          <button
+            type="button"
+            className="absolute left-2 top-2 rounded-full bg-background/80 p-1.5 hover:bg-background"
+            onClick={(e) => {
+              e.stopPropagation();
+              onToggleWishlist(listing.id);
+            }}
+            aria-label={wishlisted ? 'Remove from wishlist' : 'Add to wishlist'}
+            data-testid="wishlist-toggle"
+          >
+            <Heart size={16} className={wishlisted ? 'text-rose-500' : 'text-muted-foreground'} fill={wishlisted ? 'currentColor' : 'none'} />
+          </button>
+        )}
         {listing.verified && (
           <ShieldCheck
             className="absolute right-2 top-2 text-emerald-500"
@@ -0,0 +1,16 @@
+import React from 'react';
+import { Button } from './ui/button';
+
+const LoadMoreButton = ({ hasMore, loading, onClick, ...props }) => {
+  if (!hasMore) return null;
+
+  return (
+    <div className="flex justify-center mt-6">
+      <Button variant="outline" onClick={onClick} disabled={loading} {...props}>
+        {loading ? 'Loading...' : 'Load more'}
+      </Button>
+    </div>
+  );
+};
+
+export default LoadMoreButton;
@@ -0,0 +1,46 @@
+import { useRef, useState } from 'react';
+import api from '../utils/api';
+
+// List endpoints return one page at a time and put the cursor for the next
+// page in the X-Next-Cursor header (absent on the last page).
+const NEXT_CURSOR_HEADER = 'x-next-cursor';
+
+export function useCursorPages(path, params = {}) {
+  const [items, setItems] = useState([]);
+  const [cursor, setCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Bumped by reload so a "load more" still in flight doesn't append to the new list
+  const generation = useRef(0);
+
+  const fetchPage = async (from) => {
+    const response = await api.get(path, { params: from ? { ...params, cursor: from } : params });
+    return [response.data, response.headers[NEXT_CURSOR_HEADER] || null];
+  };
+
+  const reload = async () => {
+    const current = ++generation.current;
+    const [page, next] = await fetchPage(null);
+    if (current === generation.current) {
+      setItems(page);
+      setCursor(next);
+    }
+    return page;
+  };
+
+  const loadMore = async () => {
+    if (!cursor || loadingMore) return [];
+    const current = generation.current;
+    setLoadingMore(true);
+    try {
+      const [page, next] = await fetchPage(cursor);
+      if (current !== generation.current) return [];
+      setItems((prev) => [...prev, ...page]);
+      setCursor(next);
+      return page;
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  return { items, setItems, hasMore: Boolean(cursor), loadingMore, reload, loadMore };
+}
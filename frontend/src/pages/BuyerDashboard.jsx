@@ -3,13 +3,16 @@ import { Card, CardHeader, CardContent } from '../components/ui/card';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '../components/ui/tabs';
 import { Badge } from '../components/ui/badge';
 import ListingCard from '../components/ListingCard';
-import api from '../utils/api';
+import LoadMoreButton from '../components/LoadMoreButton';
+import { useCursorPages } from '../hooks/use-cursor-pages';
 import { toast } from 'sonner';
 import { ShoppingBag, Heart, Package } from 'lucide-react';
 
 const BuyerDashboard = ({ user }) => {
-  const [orders, setOrders] = useState([]);
-  const [wishlist, setWishlist] = useState([]);
+  const orderPages = useCursorPages('/orders');
+  const wishlistPages = useCursorPages('/wishlist');
+  const orders = orderPages.items;
+  const wishlist = wishlistPages.items;
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -18,12 +21,7 @@ const BuyerDashboard = ({ user }) => {
 
   const fetchData = async () => {
     try {
-      const [ordersRes, wishlistRes] = await Promise.all([
-        api.get('/orders'),
-        api.get('/wishlist')
-      ]);
-      setOrders(ordersRes.data);
-      setWishlist(wishlistRes.data);
+      await Promise.all([orderPages.reload(), wishlistPages.reload()]);
     } catch (error) {
       console.error('Error fetching data:', error);
       toast.error('Failed to load dashboard data');
@@ -68,7 +66,7 @@ const BuyerDashboard = ({ user }) => {
                   <ShoppingBag className="text-primary" size={24} />
                 </div>
                 <div>
-                  <p className="text-2xl font-bold" data-testid="total-orders">{orders.length}</p>
+                  <p className="text-2xl font-bold" data-testid="total-orders">{orders.length}{orderPages.hasMore ? '+' : ''}</p>
                   <p className="text-sm text-muted-foreground">Total Orders</p>
                 </div>
               </div>
@@ -81,7 +79,7 @@ const BuyerDashboard = ({ user }) => {
                   <Heart className="text-accent" size={24} />
                 </div>
                 <div>
-                  <p className="text-2xl font-bold" data-testid="wishlist-count">{wishlist.length}</p>
+                  <p className="text-2xl font-bold" data-testid="wishlist-count">{wishlist.length}{wishlistPages.hasMore ? '+' : ''}</p>
                   <p className="text-sm text-muted-foreground">Wishlist Items</p>
                 </div>
               </div>
@@ -163,6 +161,12 @@ const BuyerDashboard = ({ user }) => {
                 </CardContent>
               </Card>
             )}
+            <LoadMoreButton
+              hasMore={orderPages.hasMore}
+              loading={orderPages.loadingMore}
+              onClick={() => orderPages.loadMore().catch(() => toast.error('Failed to load more orders'))}
+              data-testid="load-more-orders"
+            />
           </TabsContent>
 
           <TabsContent value="wishlist" className="mt-6">
@@ -181,6 +185,12 @@ const BuyerDashboard = ({ user }) => {
                 </CardContent>
               </Card>
             )}
+            <LoadMoreButton
+              hasMore={wishlistPages.hasMore}
+              loading={wishlistPages.loadingMore}
+              onClick={() => wishlistPages.loadMore().catch(() => toast.error('Failed to load more wishlist items'))}
+              data-testid="load-more-wishlist"
+            />
           </TabsContent>
         </Tabs>
       </div>
@@ -15,10 +15,15 @@ const ChatPage = () => {
   const [searchParams] = useSearchParams();
 
   const [ws, setWs] = useState(null);
+  const [threads, setThreads] = useState([]);
+  const [threadsCursor, setThreadsCursor] = useState(null);
   const [users, setUsers] = useState([]);
+  const [usersCursor, setUsersCursor] = useState(null);
   const [searchTerm, setSearchTerm] = useState("");
   const [selectedUser, setSelectedUser] = useState(null);
   const [messages, setMessages] = useState([]);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const [newMessage, setNewMessage] = useState("");
   const [selectedFile, setSelectedFile] = useState(null);
   const [filePreview, setFilePreview] = useState(null);
@@ -31,30 +36,99 @@ const ChatPage = () => {
   const fileInputRef = useRef(null);
   const wsRef = useRef(null);
   const reconnectTimeoutRef = useRef(null);
+  // Read from the socket handler, which is created once per connection
+  const selectedUserRef = useRef(null);
+  const threadsRef = useRef([]);
+  const onlineRef = useRef(new Set());
 
-  // Fetch all users
   useEffect(() => {
-    const fetchUsers = async () => {
-      try {
-        const token = getToken();
-        const res = await axios.get(`${API_URL}/users`, {
-          headers: { Authorization: `Bearer ${token}` },
-        });
+    selectedUserRef.current = selectedUser;
+  }, [selectedUser]);
 
-        setUsers(
-          res.data
-            .filter((u) => u.id !== currentUser.id)
-            .map((u) => ({ ...u, _id: u.id, isOnline: false }))
-        );
-      } catch (error) {
-        console.error("Failed to fetch users:", error);
-        toast.error("Failed to load users");
-      }
-    };
+  useEffect(() => {
+    threadsRef.current = threads;
+  }, [threads]);
+
+  const threadEntry = (t) => ({
+    _id: t.other_user_id,
+    name: t.other_user_name,
+    avatar: t.other_user_avatar,
+    lastMessage: t.last_message,
+    unread: t.unread_count,
+    isOnline: onlineRef.current.has(t.other_user_id),
+  });
+
+  // Fetch a page of the inbox: one thread per conversation partner, most recent first
+  const fetchThreads = async (cursor = null) => {
+    try {
+      const token = getToken();
+      const res = await axios.get(`${API_URL}/threads`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { cursor: cursor || undefined, limit: 50 },
+      });
+
+      const page = res.data.map(threadEntry);
+      setThreads((prev) => (cursor ? [...prev, ...page] : page));
+      setThreadsCursor(res.headers["x-next-cursor"] || null);
+    } catch (error) {
+      console.error("Failed to fetch conversations:", error);
+      toast.error("Failed to load conversations");
+    }
+  };
 
-    if (currentUser?.id) fetchUsers();
+  useEffect(() => {
+    if (!currentUser?.id) return;
+    fetchThreads();
   }, [currentUser?.id]);
 
+  // Move a conversation to the top of the inbox when a message arrives in it
+  const bumpThread = (msg) => {
+    const otherId = msg.sender_id === currentUser.id ? msg.receiver_id : msg.sender_id;
+    if (!threadsRef.current.some((t) => t._id === otherId)) {
+      // A new conversation; the server has the partner's name and the counts
+      fetchThreads();
+      return;
+    }
+
+    const unseen = msg.sender_id !== currentUser.id && selectedUserRef.current?._id !== otherId;
+    setThreads((prev) => {
+      const thread = prev.find((t) => t._id === otherId);
+      if (!thread) return prev;
+      const updated = { ...thread, lastMessage: msg.message, unread: unseen ? thread.unread + 1 : thread.unread };
+      return [updated, ...prev.filter((t) => t._id !== otherId)];
+    });
+  };
+
+  // Fetch a page of the user directory, searched on the server by name/email prefix
+  const fetchUsers = async (cursor = null) => {
+    try {
+      const token = getToken();
+      const res = await axios.get(`${API_URL}/users`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { q: searchTerm.trim() || undefined, cursor: cursor || undefined, limit: 50 },
+      });
+
+      const page = res.data.map((u) => ({ ...u, _id: u.id, isOnline: u.online }));
+      setUsers((prev) => (cursor ? [...prev, ...page] : page));
+      setUsersCursor(res.headers["x-next-cursor"] || null);
+    } catch (error) {
+      console.error("Failed to fetch users:", error);
+      toast.error("Failed to load users");
+    }
+  };
+
+  // The directory is only searched to start new conversations; the inbox shows the rest
+  useEffect(() => {
+    if (!currentUser?.id) return;
+    if (!searchTerm.trim()) {
+      setUsers([]);
+      setUsersCursor(null);
+      return;
+    }
+    const timeout = setTimeout(() => fetchUsers(), 250);
+    return () => clearTimeout(timeout);
+  }, [currentUser?.id, searchTerm]);
+
   // Establish WebSocket connection with auto-reconnect
   useEffect(() => {
     if (!currentUser?.id) return;
@@ -80,13 +154,33 @@ const ChatPage = () => {
           const data = JSON.parse(event.data);
           console.log("📩 Received:", data);
 
-          if (data.type === "online_users") {
-            setUsers((prevUsers) =>
-              prevUsers.map((u) => ({
-                ...u,
-                isOnline: data.users.includes(u._id),
-              }))
-            );
+          if (data.type === "ping") {
+            socket.send(JSON.stringify({ type: "pong" }));
+            return;
+          }
+
+          if (data.type === "error") {
+            // The server rejected a frame; the socket stays open
+            toast.error(data.detail || "Message could not be sent");
+            return;
+          }
+
+          if (data.type === "presence") {
+            // Either a snapshot of online contacts on connect, or joined/left diffs.
+            // The snapshot only covers contacts; directory pages carry everyone else's status.
+            const online = onlineRef.current;
+            (data.online || data.joined || []).forEach((id) => online.add(id));
+            (data.left || []).forEach((id) => online.delete(id));
+            const applyPresence = (u) => {
+              if (data.online) {
+                return data.online.includes(u._id) ? { ...u, isOnline: true } : u;
+              }
+              if (data.joined?.includes(u._id)) return { ...u, isOnline: true };
+              if (data.left?.includes(u._id)) return { ...u, isOnline: false };
+              return u;
+            };
+            setUsers((prevUsers) => prevUsers.map(applyPresence));
+            setThreads((prevThreads) => prevThreads.map(applyPresence));
             return;
           }
 
@@ -99,6 +193,12 @@ const ChatPage = () => {
               if (exists) return prev;
               return [...prev, newMsg];
             });
+            bumpThread(newMsg);
+
+            // Acknowledge messages that arrive in the open conversation
+            if (newMsg.sender_id === selectedUserRef.current?._id) {
+              socket.send(JSON.stringify({ type: "read", other_user_id: newMsg.sender_id, up_to_id: newMsg.id }));
+            }
           }
         } catch (error) {
           console.error("Error parsing WebSocket message:", error);
@@ -147,6 +247,7 @@ const ChatPage = () => {
     if (!selectedUser) return;
 
     const loadMessages = async () => {
+      setOlderCursor(null);
       try {
         const token = getToken();
         const res = await axios.get(`${API_URL}/messages/${selectedUser._id}`, {
@@ -154,6 +255,15 @@ const ChatPage = () => {
         });
         console.log("📜 Loaded messages:", res.data.length);
         setMessages(res.data);
+        setOlderCursor(res.headers["x-next-cursor"] || null);
+
+        // Loading history no longer marks it read; acknowledge it explicitly.
+        await axios.post(
+          `${API_URL}/messages/${selectedUser._id}/read`,
+          {},
+          { headers: { Authorization: `Bearer ${token}` } }
+        );
+        setThreads((prev) => prev.map((t) => (t._id === selectedUser._id ? { ...t, unread: 0 } : t)));
       } catch (error) {
         console.error("Failed to load messages:", error);
         toast.error("Failed to load messages");
@@ -163,17 +273,44 @@ const ChatPage = () => {
     loadMessages();
   }, [selectedUser?._id]);
 
-  // Auto-select user from query parameter
+  // Page back through history from the oldest message loaded so far
+  const loadOlderMessages = async () => {
+    if (!olderCursor || loadingOlder) return;
+    setLoadingOlder(true);
+    try {
+      const token = getToken();
+      const res = await axios.get(`${API_URL}/messages/${selectedUser._id}`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { before: olderCursor },
+      });
+      setMessages((prev) => [...res.data.filter((m) => !prev.some((p) => p.id === m.id)), ...prev]);
+      setOlderCursor(res.headers["x-next-cursor"] || null);
+    } catch (error) {
+      console.error("Failed to load older messages:", error);
+      toast.error("Failed to load older messages");
+    } finally {
+      setLoadingOlder(false);
+    }
+  };
+
+  // Auto-select user from query parameter; they may not be on the loaded directory page
   useEffect(() => {
     const userId = searchParams.get("user");
-    if (userId && users.length > 0) {
-      const user = users.find((u) => u._id === userId);
-      if (user) {
-        console.log("🎯 Auto-selecting user:", user.name);
-        setSelectedUser(user);
-      }
+    if (!userId || selectedUser?._id === userId) return;
+
+    const user = threads.find((u) => u._id === userId) || users.find((u) => u._id === userId);
+    if (user) {
+      console.log("🎯 Auto-selecting user:", user.name);
+      setSelectedUser(user);
+      return;
     }
-  }, [searchParams, users]);
+
+    const token = getToken();
+    axios
+      .get(`${API_URL}/users/${userId}`, { headers: { Authorization: `Bearer ${token}` } })
+      .then((res) => setSelectedUser({ ...res.data, _id: res.data.id, isOnline: res.data.online }))
+      .catch((error) => console.error("Failed to load user:", error));
+  }, [searchParams]);
 
   // Filter messages for current conversation
   const displayedMessages = messages.filter(
@@ -184,10 +321,11 @@ const ChatPage = () => {
         msg.receiver_id === currentUser.id)
   );
 
-  // Auto scroll
+  // Auto scroll when a message is added at the bottom, not when older ones load above
+  const lastMessageId = displayedMessages[displayedMessages.length - 1]?.id;
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
-  }, [displayedMessages]);
+  }, [lastMessageId]);
 
   // Handle file selection
   const handleFileSelect = (e) => {
@@ -219,17 +357,15 @@ const ChatPage = () => {
     }
   };
 
-  // Upload file
+  // Upload file as a raw body so the server can size-check and hash it as it streams in
   const uploadFile = async (file) => {
-    const formData = new FormData();
-    formData.append("file", file);
-
     try {
       const token = getToken();
-      const res = await axios.post(`${API_URL}/upload`, formData, {
+      const res = await axios.put(`${API_URL}/upload/stream`, file, {
+        params: { filename: file.name },
         headers: {
           Authorization: `Bearer ${token}`,
-          "Content-Type": "multipart/form-data",
+          "Content-Type": file.type || "application/octet-stream",
         },
       });
       return res.data.file_url;
@@ -290,12 +426,6 @@ const ChatPage = () => {
     }
   };
 
-  const filteredUsers = users.filter(
-    (user) =>
-      user.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      user.email.toLowerCase().includes(searchTerm.toLowerCase())
-  );
-
   // Render message content
   const renderMessageContent = (msg) => {
     if (msg.file_url) {
@@ -339,6 +469,50 @@ const ChatPage = () => {
     return <p>{msg.message}</p>;
   };
 
+  // Sidebar entry for an inbox thread or a directory search result
+  const renderContact = (user) => (
+    <Card
+      key={user._id}
+      className={`mb-2 cursor-pointer transition-colors ${
+        selectedUser?._id === user._id
+          ? "bg-accent"
+          : user.isOnline
+          ? "border-l-4 border-green-500 hover:bg-green-50 dark:hover:bg-green-950/30"
+          : "hover:bg-gray-50 dark:hover:bg-gray-900/40"
+      }`}
+      onClick={() => setSelectedUser(user)}
+    >
+      <CardContent className="flex items-center justify-between gap-2 p-3">
+        <div className="flex items-center gap-2 min-w-0">
+          <span
+            className={`h-3 w-3 shrink-0 rounded-full ${
+              user.isOnline ? "bg-green-500" : "bg-gray-400"
+            }`}
+          ></span>
+          <div className="min-w-0">
+            <p className="font-medium">{user.name}</p>
+            {user.lastMessage && (
+              <p className="text-xs text-muted-foreground truncate">{user.lastMessage}</p>
+            )}
+          </div>
+        </div>
+        {user.unread > 0 ? (
+          <span className="shrink-0 rounded-full bg-blue-500 px-2 py-0.5 text-xs font-medium text-white">
+            {user.unread}
+          </span>
+        ) : (
+          <p
+            className={`shrink-0 text-sm font-medium ${
+              user.isOnline ? "text-green-500" : "text-gray-400"
+            }`}
+          >
+            {user.isOnline ? "Online" : "Offline"}
+          </p>
+        )}
+      </CardContent>
+    </Card>
+  );
+
   return (
     <div className="flex h-[calc(100vh-4rem)] bg-background">
       {/* Connection Status Indicator */}
@@ -360,45 +534,34 @@ const ChatPage = () => {
           className="mb-4"
         />
 
-        {filteredUsers.length === 0 ? (
-          <p className="text-muted-foreground text-sm">No users found</p>
+        {searchTerm.trim() ? (
+          <>
+            {users.length === 0 ? (
+              <p className="text-muted-foreground text-sm">No users found</p>
+            ) : (
+              users.map(renderContact)
+            )}
+            {usersCursor && (
+              <Button variant="outline" className="w-full" onClick={() => fetchUsers(usersCursor)}>
+                Load more
+              </Button>
+            )}
+          </>
         ) : (
-          filteredUsers.map((user) => (
-            <Card
-              key={user._id}
-              className={`mb-2 cursor-pointer transition-colors ${
-                selectedUser?._id === user._id
-                  ? "bg-accent"
-                  : user.isOnline
-                  ? "border-l-4 border-green-500 hover:bg-green-50 dark:hover:bg-green-950/30"
-                  : "hover:bg-gray-50 dark:hover:bg-gray-900/40"
-              }`}
-              onClick={() => setSelectedUser(user)}
-            >
-              <CardContent className="flex items-center justify-between p-3">
-                <div className="flex items-center gap-2">
-                  <span
-                    className={`h-3 w-3 rounded-full ${
-                      user.isOnline ? "bg-green-500" : "bg-gray-400"
-                    }`}
-                  ></span>
-                  <div>
-                    <p className="font-medium">{user.name}</p>
-                    <p className="text-xs text-muted-foreground">
-                      {user.email}
-                    </p>
-                  </div>
-                </div>
-                <p
-                  className={`text-sm font-medium ${
-                    user.isOnline ? "text-green-500" : "text-gray-400"
-                  }`}
-                >
-                  {user.isOnline ? "Online" : "Offline"}
-                </p>
-              </CardContent>
-            </Card>
-          ))
+          <>
+            {threads.length === 0 ? (
+              <p className="text-muted-foreground text-sm">
+                No conversations yet. Search for someone to start chatting.
+              </p>
+            ) : (
+              threads.map(renderContact)
+            )}
+            {threadsCursor && (
+              <Button variant="outline" className="w-full" onClick={() => fetchThreads(threadsCursor)}>
+                Load more
+              </Button>
+            )}
+          </>
         )}
       </div>
 
@@ -421,6 +584,13 @@ const ChatPage = () => {
             </div>
 
             <div className="flex-1 p-4 overflow-y-auto">
+              {olderCursor && (
+                <div className="flex justify-center mb-3">
+                  <Button variant="outline" size="sm" onClick={loadOlderMessages} disabled={loadingOlder}>
+                    {loadingOlder ? "Loading..." : "Load older messages"}
+                  </Button>
+                </div>
+              )}
               {displayedMessages.length === 0 ? (
                 <p className="text-center text-muted-foreground mt-8">
                   No messages yet. Start the conversation!
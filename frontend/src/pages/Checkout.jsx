@@ -18,14 +18,13 @@ const Checkout = ({ user }) => {
 
   const fetchOrder = async () => {
     try {
-      const response = await api.get('/orders');
-      const foundOrder = response.data.find(o => o.id === orderId);
-      if (foundOrder) {
-        setOrder(foundOrder);
-      } else {
+      const response = await api.get(`/orders/${orderId}`);
+      setOrder(response.data);
+    } catch (error) {
+      if (error.response?.status === 404) {
         toast.error('Order not found');
+        return;
       }
-    } catch (error) {
       console.error('Error fetching order:', error);
       toast.error('Failed to load order');
     } finally {
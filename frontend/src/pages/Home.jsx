@@ -5,7 +5,9 @@ import { Input } from '../components/ui/input';
 import { Badge } from '../components/ui/badge';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../components/ui/select';
 import ListingCard from '../components/ListingCard';
+import LoadMoreButton from '../components/LoadMoreButton';
 import api from '../utils/api';
+import { useCursorPages } from '../hooks/use-cursor-pages';
 import { Search, Package, ShoppingBag } from 'lucide-react';
 import { toast } from 'sonner';
 
@@ -13,22 +15,53 @@ const categories = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty
 
 const Home = ({ user }) => {
   const navigate = useNavigate();
-  const [listings, setListings] = useState([]);
   const [loading, setLoading] = useState(true);
   const [search, setSearch] = useState('');
+  const [query, setQuery] = useState('');
   const [selectedCategory, setSelectedCategory] = useState('');
+  const [wishlisted, setWishlisted] = useState({});
+  const listingPages = useCursorPages('/listings', query ? { search: query } : selectedCategory ? { category: selectedCategory } : {});
+  const listings = listingPages.items;
 
   useEffect(() => {
     fetchListings();
-  }, [selectedCategory]);
+  }, [selectedCategory, query]);
+
+  useEffect(() => {
+    const unchecked = listings.filter((listing) => !(listing.id in wishlisted));
+    if (user?.role === 'buyer' && unchecked.length > 0) {
+      fetchWishlisted(unchecked);
+    }
+  }, [listings, user]);
+
+  // One request per page of the grid instead of one per card
+  const fetchWishlisted = async (page) => {
+    try {
+      const response = await api.get('/wishlist/check', {
+        params: { listing_ids: page.map((listing) => listing.id).join(',') }
+      });
+      setWishlisted((prev) => ({ ...prev, ...response.data }));
+    } catch (error) {
+      console.error('Error checking wishlist:', error);
+    }
+  };
+
+  const toggleWishlist = async (listingId) => {
+    const adding = !wishlisted[listingId];
+    setWishlisted((prev) => ({ ...prev, [listingId]: adding }));
+    try {
+      await api.post('/wishlist/batch', adding ? { add: [listingId] } : { remove: [listingId] });
+    } catch (error) {
+      console.error('Error updating wishlist:', error);
+      setWishlisted((prev) => ({ ...prev, [listingId]: !adding }));
+      toast.error('Failed to update wishlist');
+    }
+  };
 
   const fetchListings = async () => {
     try {
       setLoading(true);
-      const params = {};
-      if (selectedCategory) params.category = selectedCategory;
-      const response = await api.get('/listings', { params });
-      setListings(response.data);
+      await listingPages.reload();
     } catch (error) {
       console.error('Error fetching listings:', error);
       toast.error('Failed to load listings');
@@ -37,20 +70,16 @@ const Home = ({ user }) => {
     }
   };
 
-  const handleSearch = async (e) => {
+  const handleSearch = (e) => {
     e.preventDefault();
     if (!search.trim()) return;
-    
-    try {
-      setLoading(true);
-      const response = await api.get('/listings', { params: { search } });
-      setListings(response.data);
-    } catch (error) {
-      console.error('Error searching listings:', error);
-      toast.error('Search failed');
-    } finally {
-      setLoading(false);
-    }
+    setQuery(search.trim());
+  };
+
+  // Picking a category leaves search results for the category feed
+  const selectCategory = (category) => {
+    setQuery('');
+    setSelectedCategory(category);
   };
 
   return (
@@ -104,7 +133,7 @@ const Home = ({ user }) => {
             <Badge
               variant={!selectedCategory ? 'default' : 'outline'}
               className="cursor-pointer"
-              onClick={() => setSelectedCategory('')}
+              onClick={() => selectCategory('')}
               data-testid="category-all"
             >
               All
@@ -114,7 +143,7 @@ const Home = ({ user }) => {
                 key={cat}
                 variant={selectedCategory === cat ? 'default' : 'outline'}
                 className="cursor-pointer whitespace-nowrap"
-                onClick={() => setSelectedCategory(cat)}
+                onClick={() => selectCategory(cat)}
                 data-testid={`category-${cat.toLowerCase()}`}
               >
                 {cat}
@@ -131,7 +160,12 @@ const Home = ({ user }) => {
           ) : listings.length > 0 ? (
             <div className="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-4 gap-5 md:gap-6" data-testid="listings-grid">
               {listings.map((listing) => (
-                <ListingCard key={listing.id} listing={listing} />
+                <ListingCard
+                  key={listing.id}
+                  listing={listing}
+                  wishlisted={!!wishlisted[listing.id]}
+                  onToggleWishlist={user?.role === 'buyer' ? toggleWishlist : undefined}
+                />
               ))}
             </div>
           ) : (
@@ -141,6 +175,14 @@ const Home = ({ user }) => {
               <p className="text-muted-foreground">Try adjusting your filters or search</p>
             </div>
           )}
+          {!loading && (
+            <LoadMoreButton
+              hasMore={listingPages.hasMore}
+              loading={listingPages.loadingMore}
+              onClick={() => listingPages.loadMore().catch(() => toast.error('Failed to load more listings'))}
+              data-testid="load-more-listings"
+            />
+          )}
         </div>
       </section>
     </div>
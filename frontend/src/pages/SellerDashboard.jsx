@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Button } from '../components/ui/button';
 import { Card, CardHeader, CardContent } from '../components/ui/card';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '../components/ui/tabs';
@@ -9,18 +9,25 @@ import { Label } from '../components/ui/label';
 import { Textarea } from '../components/ui/textarea';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../components/ui/select';
 import ListingCard from '../components/ListingCard';
+import LoadMoreButton from '../components/LoadMoreButton';
 import api from '../utils/api';
+import { useCursorPages } from '../hooks/use-cursor-pages';
 import { toast } from 'sonner';
-import { Plus, Package, DollarSign, Eye, TrendingUp } from 'lucide-react';
+import { Plus, Package, DollarSign, Eye, TrendingUp, Upload, Download } from 'lucide-react';
 import { AreaChart, Area, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts';
 
 const categories = ['Electronics', 'Fashion', 'Home', 'Books', 'Sports', 'Beauty', 'Toys', 'Services'];
 
 const SellerDashboard = ({ user }) => {
-  const [listings, setListings] = useState([]);
-  const [orders, setOrders] = useState([]);
+  const listingPages = useCursorPages('/listings', { seller_id: user.id });
+  const orderPages = useCursorPages('/orders');
+  const listings = listingPages.items;
+  const orders = orderPages.items;
+  const [analytics, setAnalytics] = useState(null);
   const [loading, setLoading] = useState(true);
   const [showAddListing, setShowAddListing] = useState(false);
+  const [importing, setImporting] = useState(false);
+  const importInput = useRef(null);
   const [formData, setFormData] = useState({
     title: '',
     description: '',
@@ -37,14 +44,12 @@ const SellerDashboard = ({ user }) => {
 
   const fetchData = async () => {
     try {
-      const [listingsRes, ordersRes] = await Promise.all([
-        api.get('/listings'),
-        api.get('/orders')
+      const [, , analyticsRes] = await Promise.all([
+        listingPages.reload(),
+        orderPages.reload(),
+        api.get('/analytics', { params: { granularity: 'day' } })
       ]);
-      
-      const myListings = listingsRes.data.filter(p => p.seller_id === user.id);
-      setListings(myListings);
-      setOrders(ordersRes.data);
+      setAnalytics(analyticsRes.data);
     } catch (error) {
       console.error('Error fetching data:', error);
       toast.error('Failed to load dashboard data');
@@ -95,17 +100,56 @@ const SellerDashboard = ({ user }) => {
     }
   };
 
-  const totalRevenue = orders.reduce((sum, order) => sum + order.total_amount, 0);
-  const totalViews = listings.reduce((sum, listing) => sum + (listing.reviews_count || 0), 0);
+  // The file is sent as the raw request body; the server parses it as a stream
+  const handleImport = async (e) => {
+    const file = e.target.files[0];
+    e.target.value = '';
+    if (!file) return;
 
-  // Chart data
-  const chartData = [
-    { day: 'Mon', sales: 1200, views: 4600 },
-    { day: 'Tue', sales: 980, views: 5200 },
-    { day: 'Wed', sales: 1400, views: 6100 },
-    { day: 'Thu', sales: 900, views: 4300 },
-    { day: 'Fri', sales: 1700, views: 7200 }
-  ];
+    const format = file.name.toLowerCase().endsWith('.csv') ? 'csv' : 'ndjson';
+    setImporting(true);
+    try {
+      const { data } = await api.post('/listings/import', file, {
+        params: { format },
+        headers: { 'Content-Type': format === 'csv' ? 'text/csv' : 'application/x-ndjson' }
+      });
+      if (data.failed) {
+        const first = data.errors[0];
+        toast.warning(`Imported ${data.imported}, ${data.failed} failed (row ${first.row}: ${first.error})`);
+      } else {
+        toast.success(`Imported ${data.imported} listings`);
+      }
+      fetchData();
+    } catch (error) {
+      console.error('Error importing listings:', error);
+      toast.error(error.response?.data?.detail || 'Failed to import listings');
+    } finally {
+      setImporting(false);
+    }
+  };
+
+  const handleExport = async (resource) => {
+    try {
+      const response = await api.get(`/${resource}/export`, { params: { format: 'csv' }, responseType: 'blob' });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `${resource}.csv`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error(`Error exporting ${resource}:`, error);
+      toast.error(`Failed to export ${resource}`);
+    }
+  };
+
+  // Totals and chart cover the last 30 days of rollups from /analytics
+  const totals = analytics?.totals || { revenue: 0, orders: 0, views: 0 };
+  const chartData = (analytics?.buckets || []).map(bucket => ({
+    day: new Date(bucket.start).toLocaleDateString(undefined, { month: 'short', day: 'numeric' }),
+    sales: bucket.revenue,
+    views: bucket.views
+  }));
 
   if (loading) {
     return (
@@ -123,62 +167,112 @@ const SellerDashboard = ({ user }) => {
             <h1 className="text-3xl font-semibold mb-2">Seller Dashboard</h1>
             <p className="text-muted-foreground">Welcome back, {user.name}!</p>
           </div>
-          <Dialog open={showAddListing} onOpenChange={setShowAddListing}>
-            <DialogTrigger asChild>
-              <Button data-testid="add-listing-button">
-                <Plus size={18} className="mr-2" />
-                Add Listing
-              </Button>
-            </DialogTrigger>
-            <DialogContent className="max-w-2xl max-h-[90vh] overflow-y-auto">
-              <DialogHeader>
-                <DialogTitle>Add New Listing</DialogTitle>
-              </DialogHeader>
-              <form onSubmit={handleAddListing} className="space-y-4" data-testid="add-listing-form">
-                <div className="space-y-2">
-                  <Label htmlFor="title">Listing Title*</Label>
-                  <Input
-                    id="title"
-                    value={formData.title}
-                    onChange={(e) => setFormData({ ...formData, title: e.target.value })}
-                    required
-                    data-testid="listing-title-input"
-                  />
-                </div>
-                <div className="space-y-2">
-                  <Label htmlFor="description">Description*</Label>
-                  <Textarea
-                    id="description"
-                    value={formData.description}
-                    onChange={(e) => setFormData({ ...formData, description: e.target.value })}
-                    required
-                    rows={4}
-                    data-testid="listing-description-input"
-                  />
-                </div>
-                <div className="grid grid-cols-2 gap-4">
+          <div className="flex items-center gap-2">
+            <input
+              ref={importInput}
+              type="file"
+              accept=".csv,.ndjson,.jsonl"
+              className="hidden"
+              onChange={handleImport}
+            />
+            <Button variant="outline" disabled={importing} onClick={() => importInput.current?.click()} data-testid="import-listings-button">
+              <Upload size={18} className="mr-2" />
+              {importing ? 'Importing...' : 'Import'}
+            </Button>
+            <Button variant="outline" onClick={() => handleExport('listings')} data-testid="export-listings-button">
+              <Download size={18} className="mr-2" />
+              Export
+            </Button>
+            <Dialog open={showAddListing} onOpenChange={setShowAddListing}>
+              <DialogTrigger asChild>
+                <Button data-testid="add-listing-button">
+                  <Plus size={18} className="mr-2" />
+                  Add Listing
+                </Button>
+              </DialogTrigger>
+              <DialogContent className="max-w-2xl max-h-[90vh] overflow-y-auto">
+                <DialogHeader>
+                  <DialogTitle>Add New Listing</DialogTitle>
+                </DialogHeader>
+                <form onSubmit={handleAddListing} className="space-y-4" data-testid="add-listing-form">
                   <div className="space-y-2">
-                    <Label htmlFor="price">Price (USD)*</Label>
+                    <Label htmlFor="title">Listing Title*</Label>
                     <Input
-                      id="price"
-                      type="number"
-                      step="0.01"
-                      min="0"
-                      value={formData.price}
-                      onChange={(e) => setFormData({ ...formData, price: e.target.value })}
+                      id="title"
+                      value={formData.title}
+                      onChange={(e) => setFormData({ ...formData, title: e.target.value })}
                       required
-                      data-testid="listing-price-input"
+                      data-testid="listing-title-input"
                     />
                   </div>
                   <div className="space-y-2">
-                    <Label htmlFor="type">Type*</Label>
+                    <Label htmlFor="description">Description*</Label>
+                    <Textarea
+                      id="description"
+                      value={formData.description}
+                      onChange={(e) => setFormData({ ...formData, description: e.target.value })}
+                      required
+                      rows={4}
+                      data-testid="listing-description-input"
+                    />
+                  </div>
+                  <div className="grid grid-cols-2 gap-4">
+                    <div className="space-y-2">
+                      <Label htmlFor="price">Price (USD)*</Label>
+                      <Input
+                        id="price"
+                        type="number"
+                        step="0.01"
+                        min="0"
+                        value={formData.price}
+                        onChange={(e) => setFormData({ ...formData, price: e.target.value })}
+                        required
+                        data-testid="listing-price-input"
+                      />
+                    </div>
+                    <div className="space-y-2">
+                      <Label htmlFor="type">Type*</Label>
+                      <Select
+                        value={formData.type}
+                        onValueChange={(value) => setFormData({ ...formData, type: value })}
+                        required
+                      >
+                        <SelectTrigger data-testid="listing-type-select">
+                          <SelectValue placeholder="Select type" />
+                        </SelectTrigger>
+                        <SelectContent>
+                          {categories.map((cat) => (
+                            <SelectItem key={cat} value={cat}>
+                              {cat}
+                            </SelectItem>
+                          ))}
+                        </SelectContent>
+                      </Select>
+                    </div>
+                  </div>
+                  {formData.type === 'product' && (
+                    <div className="space-y-2">
+                      <Label htmlFor="stock">Stock*</Label>
+                      <Input
+                        id="stock"
+                        type="number"
+                        min="1"
+                        value={formData.stock}
+                        onChange={(e) => setFormData({ ...formData, stock: e.target.value })}
+                        required
+                        data-testid="listing-stock-input"
+                      />
+                    </div>
+                  )}
+                  <div className="space-y-2">
+                    <Label htmlFor="category">Category*</Label>
                     <Select
-                      value={formData.type}
-                      onValueChange={(value) => setFormData({ ...formData, type: value })}
+                      value={formData.category}
+                      onValueChange={(value) => setFormData({ ...formData, category: value })}
                       required
                     >
-                      <SelectTrigger data-testid="listing-type-select">
-                        <SelectValue placeholder="Select type" />
+                      <SelectTrigger data-testid="listing-category-select">
+                        <SelectValue placeholder="Select category" />
                       </SelectTrigger>
                       <SelectContent>
                         {categories.map((cat) => (
@@ -189,57 +283,24 @@ const SellerDashboard = ({ user }) => {
                       </SelectContent>
                     </Select>
                   </div>
-                </div>
-                {formData.type === 'product' && (
                   <div className="space-y-2">
-                    <Label htmlFor="stock">Stock*</Label>
+                    <Label htmlFor="images">Image URLs (comma-separated)</Label>
                     <Input
-                      id="stock"
-                      type="number"
-                      min="1"
-                      value={formData.stock}
-                      onChange={(e) => setFormData({ ...formData, stock: e.target.value })}
-                      required
-                      data-testid="listing-stock-input"
+                      id="images"
+                      value={formData.images}
+                      onChange={(e) => setFormData({ ...formData, images: e.target.value })}
+                      placeholder="https://example.com/image1.jpg, https://example.com/image2.jpg"
+                      data-testid="listing-images-input"
                     />
+                    <p className="text-xs text-muted-foreground">Leave empty to use default image</p>
                   </div>
-                )}
-                <div className="space-y-2">
-                  <Label htmlFor="category">Category*</Label>
-                  <Select
-                    value={formData.category}
-                    onValueChange={(value) => setFormData({ ...formData, category: value })}
-                    required
-                  >
-                    <SelectTrigger data-testid="listing-category-select">
-                      <SelectValue placeholder="Select category" />
-                    </SelectTrigger>
-                    <SelectContent>
-                      {categories.map((cat) => (
-                        <SelectItem key={cat} value={cat}>
-                          {cat}
-                        </SelectItem>
-                      ))}
-                    </SelectContent>
-                  </Select>
-                </div>
-                <div className="space-y-2">
-                  <Label htmlFor="images">Image URLs (comma-separated)</Label>
-                  <Input
-                    id="images"
-                    value={formData.images}
-                    onChange={(e) => setFormData({ ...formData, images: e.target.value })}
-                    placeholder="https://example.com/image1.jpg, https://example.com/image2.jpg"
-                    data-testid="listing-images-input"
-                  />
-                  <p className="text-xs text-muted-foreground">Leave empty to use default image</p>
-                </div>
-                <Button type="submit" className="w-full" data-testid="submit-listing-button">
-                  Add Listing
-                </Button>
-              </form>
-            </DialogContent>
-          </Dialog>
+                  <Button type="submit" className="w-full" data-testid="submit-listing-button">
+                    Add Listing
+                  </Button>
+                </form>
+              </DialogContent>
+            </Dialog>
+          </div>
         </div>
 
         {/* Stats */}
@@ -251,7 +312,7 @@ const SellerDashboard = ({ user }) => {
                   <Package className="text-primary" size={24} />
                 </div>
                 <div>
-                  <p className="text-2xl font-bold" data-testid="total-listings">{listings.length}</p>
+                  <p className="text-2xl font-bold" data-testid="total-listings">{listings.length}{listingPages.hasMore ? '+' : ''}</p>
                   <p className="text-sm text-muted-foreground">Listings</p>
                 </div>
               </div>
@@ -264,8 +325,8 @@ const SellerDashboard = ({ user }) => {
                   <DollarSign className="text-emerald-500" size={24} />
                 </div>
                 <div>
-                  <p className="text-2xl font-bold" data-testid="total-revenue">${totalRevenue.toFixed(2)}</p>
-                  <p className="text-sm text-muted-foreground">Revenue</p>
+                  <p className="text-2xl font-bold" data-testid="total-revenue">${totals.revenue.toFixed(2)}</p>
+                  <p className="text-sm text-muted-foreground">Revenue (30 days)</p>
                 </div>
               </div>
             </CardContent>
@@ -277,8 +338,8 @@ const SellerDashboard = ({ user }) => {
                   <TrendingUp className="text-blue-500" size={24} />
                 </div>
                 <div>
-                  <p className="text-2xl font-bold" data-testid="total-orders">{orders.length}</p>
-                  <p className="text-sm text-muted-foreground">Orders</p>
+                  <p className="text-2xl font-bold" data-testid="total-orders">{totals.orders}</p>
+                  <p className="text-sm text-muted-foreground">Orders (30 days)</p>
                 </div>
               </div>
             </CardContent>
@@ -290,8 +351,8 @@ const SellerDashboard = ({ user }) => {
                   <Eye className="text-purple-500" size={24} />
                 </div>
                 <div>
-                  <p className="text-2xl font-bold">{totalViews}</p>
-                  <p className="text-sm text-muted-foreground">Total Views</p>
+                  <p className="text-2xl font-bold">{totals.views}</p>
+                  <p className="text-sm text-muted-foreground">Views (30 days)</p>
                 </div>
               </div>
             </CardContent>
@@ -354,9 +415,23 @@ const SellerDashboard = ({ user }) => {
                 </CardContent>
               </Card>
             )}
+            <LoadMoreButton
+              hasMore={listingPages.hasMore}
+              loading={listingPages.loadingMore}
+              onClick={() => listingPages.loadMore().catch(() => toast.error('Failed to load more listings'))}
+              data-testid="load-more-listings"
+            />
           </TabsContent>
 
           <TabsContent value="orders" className="mt-6">
+            {orders.length > 0 && (
+              <div className="flex justify-end mb-4">
+                <Button variant="outline" size="sm" onClick={() => handleExport('orders')} data-testid="export-orders-button">
+                  <Download size={16} className="mr-2" />
+                  Export orders
+                </Button>
+              </div>
+            )}
             {orders.length > 0 ? (
               <div className="space-y-4" data-testid="orders-list">
                 {orders.map((order) => (
@@ -406,6 +481,12 @@ const SellerDashboard = ({ user }) => {
                 </CardContent>
               </Card>
             )}
+            <LoadMoreButton
+              hasMore={orderPages.hasMore}
+              loading={orderPages.loadingMore}
+              onClick={() => orderPages.loadMore().catch(() => toast.error('Failed to load more orders'))}
+              data-testid="load-more-orders"
+            />
           </TabsContent>
         </Tabs>
       </div>
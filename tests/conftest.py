@@ -0,0 +1,62 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "marketplace_test")
+os.environ.setdefault("JWT_SECRET", "test-secret")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """A fresh in-memory database swapped in for server.db."""
+    database = mongomock_motor.AsyncMongoMockClient(tz_aware=True)["marketplace_test"]
+    monkeypatch.setattr(server, "db", database)
+    return database
+
+
+
+@pytest.fixture
+async def client(db, monkeypatch):
+    """HTTP client for the app without its startup hooks, with empty caches and search index."""
+    import httpx
+
+    monkeypatch.setattr(server, "response_cache", server.ResponseCache(1000, 30))
+    monkeypatch.setattr(server, "search_index", server.SearchIndex())
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        yield http
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """Local upload storage and temp dir under tmp_path."""
+    root, temp_dir = tmp_path / "uploads", tmp_path / "upload_tmp"
+    root.mkdir()
+    temp_dir.mkdir()
+    monkeypatch.setattr(server, "UPLOAD_TMP_DIR", temp_dir)
+    monkeypatch.setattr(server, "storage", server.LocalStorage(root, "http://testserver/uploads"))
+    return server.storage
+
+
+@pytest.fixture
+def user():
+    """A signed-in user for endpoints behind get_current_user or get_token_user."""
+    current = server.User(id="u1", email="u1@example.com", name="Uma", role="seller")
+    overrides = {server.get_current_user: lambda: current, server.get_token_user: lambda: current}
+    server.app.dependency_overrides.update(overrides)
+    yield current
+    for dependency in overrides:
+        server.app.dependency_overrides.pop(dependency, None)
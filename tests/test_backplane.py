@@ -0,0 +1,116 @@
+import asyncio
+
+import pytest
+
+import server
+
+fakeredis = pytest.importorskip("fakeredis")
+
+pytestmark = pytest.mark.anyio
+
+
+class Worker:
+    """A RedisBackplane plus the events its handler received."""
+
+    def __init__(self, redis_client, presence_ttl=30):
+        self.events = []
+        self.received = asyncio.Event()
+        self.backplane = server.RedisBackplane(redis_client, presence_ttl=presence_ttl)
+
+    async def handle(self, event):
+        self.events.append(event)
+        self.received.set()
+
+    async def next_events(self, count):
+        while len(self.events) < count:
+            self.received.clear()
+            await asyncio.wait_for(self.received.wait(), 5)
+        return self.events
+
+
+@pytest.fixture
+async def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+async def workers(redis_server):
+    started = []
+
+    async def start(**kwargs):
+        worker = Worker(fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True), **kwargs)
+        await worker.backplane.start(worker.handle)
+        started.append(worker)
+        return worker
+
+    yield start
+    for worker in started:
+        await worker.backplane.stop()
+
+
+async def test_user_messages_reach_only_the_subscribed_worker(workers):
+    a, b = await workers(), await workers()
+    await b.backplane.subscribe_user("bob")
+
+    await a.backplane.publish_to_users(["bob"], '{"type": "message"}')
+    await a.backplane.publish_to_users(["bob", "carol"], '{"type": "typing"}')
+
+    assert await b.next_events(2) == [
+        {"user_id": "bob", "payload": '{"type": "message"}'},
+        {"user_id": "bob", "payload": '{"type": "typing"}'},
+    ]
+    assert a.events == []
+
+
+async def test_broadcast_reaches_every_worker(workers):
+    a, b = await workers(), await workers()
+
+    await a.backplane.broadcast('{"type": "announcement"}')
+
+    for worker in (a, b):
+        assert await worker.next_events(1) == [{"user_id": None, "payload": '{"type": "announcement"}'}]
+
+
+async def test_presence_spans_workers(workers):
+    a, b = await workers(), await workers()
+    await a.backplane.subscribe_user("alice")
+    await b.backplane.subscribe_user("bob")
+
+    assert await a.backplane.filter_online(["alice", "bob", "carol"]) == ["alice", "bob"]
+    assert await a.backplane.filter_online([]) == []
+
+    await b.backplane.unsubscribe_user("bob")
+    assert await a.backplane.filter_online(["alice", "bob"]) == ["alice"]
+
+
+async def test_stopped_worker_drops_its_users(workers):
+    a, b = await workers(), await workers()
+    await b.backplane.subscribe_user("bob")
+
+    await b.backplane.stop()
+
+    assert await a.backplane.filter_online(["bob"]) == []
+
+
+async def test_crashed_worker_expires_after_presence_ttl(workers, redis_server, monkeypatch):
+    a = await workers()
+    crashed = server.RedisBackplane(fakeredis.FakeAsyncRedis(server=redis_server, decode_responses=True))
+    crashed.pubsub = crashed.redis.pubsub()
+    await crashed._heartbeat()
+    await crashed.subscribe_user("bob")
+    assert await a.backplane.filter_online(["bob"]) == ["bob"]
+
+    # No heartbeat since: past the TTL the worker is pruned from the registry
+    now = server.time.time()
+    monkeypatch.setattr(server.time, "time", lambda: now + a.backplane.presence_ttl + 1)
+    assert await a.backplane.filter_online(["bob"]) == []
+    assert await a.backplane.redis.zscore(a.backplane.workers_key, crashed.worker_id) is None
+    await crashed.pubsub.aclose()
+
+
+async def test_redis_backplane_without_redis_url_fails_clearly(monkeypatch):
+    monkeypatch.setattr(server, "REDIS_URL", None)
+    backplane = server.RedisBackplane()
+
+    with pytest.raises(RuntimeError, match="REDIS_URL"):
+        await backplane.start(lambda event: None)
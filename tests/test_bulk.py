@@ -0,0 +1,61 @@
+import orjson
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+SELLER = server.User(id="seller-1", email="seller@example.com", name="Seller", role="seller")
+FIELDS = ["title", "description", "price", "category", "images", "tags", "stock", "type"]
+
+
+async def chunked(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def run_import(data: bytes, format: str) -> server.ImportResult:
+    lines = server.iter_lines(chunked(data), server.MAX_IMPORT_LINE_BYTES)
+    rows = server.iter_csv_rows(lines) if format == "csv" else server.iter_ndjson_rows(lines)
+    return await server.import_listings(rows, SELLER, batch_size=2)
+
+
+async def run_export(db, format: str) -> bytes:
+    cursor = db.listings.find({"seller_id": SELLER.id}, server.listing_serializer.projection).sort("timestamp", -1)
+    chunks = server.stream_export(cursor, server.listing_serializer, server.LISTING_EXPORT_COLUMNS, format)
+    return b"".join([chunk async for chunk in chunks])
+
+
+async def stored_listings(db) -> list:
+    docs = await db.listings.find({}, {"_id": 0}).to_list(None)
+    return sorted(({k: doc[k] for k in FIELDS} for doc in docs), key=lambda d: d["title"])
+
+
+SOURCE = [
+    {"title": "Lamp", "description": 'Brass, "vintage"\nworks', "price": 25.5, "category": "Home",
+     "images": ["http://x/1.jpg", "http://x/2.jpg"], "tags": ["retro", "light"], "stock": 3},
+    {"title": "No photos", "description": "d", "price": 1, "category": "Books", "images": []},
+    {"title": "Tutoring", "description": "d", "price": 40, "category": "Services", "images": ["http://x/t.jpg"],
+     "stock": None, "type": "service"},
+]
+
+
+async def test_import_reports_row_errors(db):
+    data = b"\n".join([orjson.dumps(SOURCE[0]), b"{oops", b"", orjson.dumps({"title": "x"}), orjson.dumps(SOURCE[1])])
+    result = await run_import(data, "ndjson")
+    assert (result.imported, result.failed) == (2, 2)
+    assert [e.row for e in result.errors] == [2, 4]
+    assert "price: Field required" in result.errors[1].error
+
+
+@pytest.mark.parametrize("format", ["csv", "ndjson"])
+async def test_export_round_trips_through_import(db, format):
+    await run_import(b"\n".join(orjson.dumps(doc) for doc in SOURCE), "ndjson")
+    original = await stored_listings(db)
+
+    exported = await run_export(db, format)
+    await db.listings.delete_many({})
+    result = await run_import(exported, format)
+
+    assert (result.imported, result.failed) == (3, 0), result.errors
+    assert await stored_listings(db) == original
@@ -0,0 +1,171 @@
+import asyncio
+import gc
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.close_codes = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.close_codes.append(code)
+
+
+class YieldingBackplane(server.InMemoryBackplane):
+    """Suspends in every presence lookup, like a network round trip."""
+
+    async def filter_online(self, user_ids):
+        await asyncio.sleep(0)
+        return await super().filter_online(user_ids)
+
+
+async def settle():
+    """Let socket writer tasks drain their queues."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.fixture
+async def manager(db):
+    backplane = server.InMemoryBackplane()
+    await backplane.start(lambda event: None)
+    manager = server.ConnectionManager(backplane)
+    yield manager
+    await manager.stop()
+
+
+async def open_connection(manager, user_id):
+    connection = server.ClientConnection(FakeWebSocket(), user_id, manager)
+    manager.active_connections.setdefault(user_id, []).append(connection)
+    await manager.backplane.subscribe_user(user_id)
+    return connection
+
+
+async def test_evict_keeps_the_disconnect_task_until_it_finishes(manager):
+    connection = await open_connection(manager, "alice")
+
+    manager.evict(connection)
+    gc.collect()
+
+    assert len(manager._evictions) == 1
+    await asyncio.gather(*manager._evictions)
+    assert manager._evictions == set()
+    assert connection.closed
+    assert "alice" not in manager.active_connections
+    assert await manager.backplane.filter_online(["alice"]) == []
+    assert manager.evicted_connections == 1
+
+
+async def test_stop_waits_for_pending_evictions(manager):
+    connection = await open_connection(manager, "alice")
+
+    manager.evict(connection)
+    await manager.stop()
+
+    assert manager._evictions == set()
+    assert connection.websocket.close_codes == [1000]
+
+
+async def test_concurrent_connects_for_one_user_keep_both_sockets(db):
+    backplane = YieldingBackplane()
+    manager = server.ConnectionManager(backplane)
+    await manager.start()
+    try:
+        first, second = await asyncio.gather(
+            manager.connect(FakeWebSocket(), "alice"), manager.connect(FakeWebSocket(), "alice")
+        )
+        assert manager.active_connections["alice"] == [first, second]
+
+        await manager.send_personal_message("alice", {"type": "message", "message": "hi"})
+        await settle()
+        for connection in (first, second):
+            assert '{"type": "message", "message": "hi"}' in connection.websocket.sent
+
+        await manager.disconnect(second)
+        assert await backplane.filter_online(["alice"]) == ["alice"]
+    finally:
+        await manager.stop()
+
+
+class ScriptedWebSocket(FakeWebSocket):
+    """Delivers the given text frames, then disconnects."""
+
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = list(frames)
+
+    async def receive_text(self):
+        await settle()
+        if not self.frames:
+            raise server.WebSocketDisconnect()
+        return self.frames.pop(0)
+
+
+async def test_malformed_chat_frames_get_error_events(db, monkeypatch):
+    manager = server.ConnectionManager(server.InMemoryBackplane())
+    await manager.start()
+    monkeypatch.setattr(server, "connection_manager", manager)
+    websocket = ScriptedWebSocket([
+        "not json",
+        "[1, 2]",
+        '{"type": "read"}',
+        '{"message": "no receiver"}',
+        '{"receiver_id": null, "message": "hi"}',
+        '{"type": "pong"}',
+        '{"receiver_id": "bob", "message": "hi"}',
+    ])
+    try:
+        await server.chat_endpoint(websocket, "alice")
+    finally:
+        await manager.stop()
+
+    events = [json.loads(text) for text in websocket.sent if '"presence"' not in text]
+    assert [e["type"] for e in events] == ["error"] * 5 + ["chat"]
+    assert events[0]["detail"] == "Frame is not valid JSON"
+    assert events[1]["detail"].startswith("frame: ")
+    assert events[2]["detail"].startswith("other_user_id: ")
+    assert events[3]["detail"].startswith("receiver_id: ")
+    assert events[5]["data"]["receiver_id"] == "bob"
+    assert [m["message"] for m in await db.messages.find().to_list(None)] == ["hi"]
+
+
+async def test_closing_one_of_two_sockets_keeps_the_user_online(db, monkeypatch):
+    monkeypatch.setattr(server, "PRESENCE_DEBOUNCE_SECONDS", 0)
+    await db.conversations.insert_one({"participants": ["alice", "bob"]})
+    manager = server.ConnectionManager(server.InMemoryBackplane())
+    await manager.start()
+    try:
+        bob = await manager.connect(FakeWebSocket(), "bob")
+        first = await manager.connect(FakeWebSocket(), "alice")
+        second = await manager.connect(FakeWebSocket(), "alice")
+        await settle()
+
+        def presence_diffs():
+            events = [json.loads(text) for text in bob.websocket.sent]
+            return [(e["joined"], e["left"]) for e in events if e["type"] == "presence" and "joined" in e]
+
+        assert presence_diffs() == [(["alice"], [])]
+
+        await manager.disconnect(first)
+        await settle()
+        assert presence_diffs() == [(["alice"], [])]
+        assert await manager.backplane.filter_online(["alice"]) == ["alice"]
+
+        await manager.disconnect(second)
+        await settle()
+        assert presence_diffs() == [(["alice"], []), ([], ["alice"])]
+    finally:
+        await manager.stop()
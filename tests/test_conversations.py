@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def message(n, sender, receiver):
+    return {"id": f"m{n}", "sender_id": sender, "receiver_id": receiver, "message": f"message {n}",
+            "read": False, "timestamp": datetime(2026, 1, 1, 12, n, tzinfo=timezone.utc), "seq": n}
+
+
+def conflicting_paths(update):
+    return {path for op in ("$set", "$inc", "$setOnInsert") for path in update.get(op, {})
+            if sum(path in update.get(other, {}) for other in ("$set", "$inc", "$setOnInsert")) > 1}
+
+
+async def test_messages_count_as_unread_for_the_receiver(db):
+    await server.record_conversation_message(message(1, "alice", "bob"))
+    await server.record_conversation_message(message(2, "alice", "bob"))
+
+    conversation = await db.conversations.find_one({"id": "alice:bob"})
+    assert conversation["unread"] == {"alice": 0, "bob": 2}
+    assert conversation["last_message_id"] == "m2"
+
+
+async def test_note_to_self_has_no_conflicting_update_paths(db):
+    op = server.conversation_update(message(1, "alice", "alice"))
+
+    assert conflicting_paths(op._doc) == set()
+    await server.record_conversation_message(message(1, "alice", "alice"))
+    await server.record_conversation_message(message(2, "alice", "alice"))
+    conversation = await db.conversations.find_one({"id": "alice:alice"})
+    assert conversation["unread"] == {"alice": 0}
+    assert conversation["last_message_id"] == "m2"
+
+
+async def test_rebuild_matches_incremental_updates(db):
+    for doc in [message(1, "alice", "bob"), message(2, "bob", "alice"), message(3, "alice", "bob"),
+                message(4, "alice", "alice")]:
+        await db.messages.insert_one(server.stored_message(doc))
+        await server.record_conversation_message(doc)
+    incremental = {c["id"]: c["unread"] for c in await db.conversations.find().to_list(None)}
+
+    await db.conversations.delete_many({})
+    assert await server.rebuild_conversations() == 2
+
+    rebuilt = {c["id"]: c["unread"] for c in await db.conversations.find().to_list(None)}
+    assert rebuilt == incremental == {"alice:bob": {"alice": 1, "bob": 2}, "alice:alice": {"alice": 0}}
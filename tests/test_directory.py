@@ -0,0 +1,49 @@
+import orjson
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def users(db):
+    await db.users.insert_many([
+        {"id": "me", "name": "Me", "email": "me@example.com", "role": "buyer",
+         **server.directory_fields("Me", "me@example.com")},
+        {"id": "u1", "name": "Ann Lee", "email": "ann@example.com", "role": "seller",
+         **server.directory_fields("Ann Lee", "ann@example.com")},
+        {"id": "u3", "name": "Cleo Park", "email": "cleo@example.com", "role": "buyer",
+         **server.directory_fields("Cleo Park", "cleo@example.com")},
+        # Registered before the directory existed
+        {"id": "u2", "name": "Bea Stone", "email": "bea@example.com", "role": "buyer"},
+    ])
+    return db.users
+
+
+async def list_users(**params):
+    me = server.User(id="me", email="me@example.com", name="Me")
+    pages, cursor = [], None
+    while True:
+        response = await server.get_users(**{"q": None, "role": None, "limit": 1, **params},
+                                          cursor=cursor, current_user=me)
+        pages.append([u["id"] for u in orjson.loads(response.body)])
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return pages
+
+
+async def test_startup_backfills_users_missing_directory_keys(users):
+    await server.backfill_user_directory()
+
+    assert await list_users() == [["u1"], ["u2"], ["u3"]]
+    assert await list_users(q="stone") == [["u2"]]
+    assert await users.find_one({"name_key": {"$exists": False}}) is None
+
+
+async def test_backfill_fills_partially_keyed_users(users):
+    await users.update_one({"id": "u3"}, {"$unset": {"name_key": ""}})
+
+    assert await server.backfill_directory_fields() == 2
+    assert (await users.find_one({"id": "u3"}))["name_key"] == "cleo park"
+    assert await server.backfill_directory_fields() == 0
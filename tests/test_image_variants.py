@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from PIL import Image
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+KEY = "a" * 64 + ".png"
+
+
+@pytest.fixture
+async def jobs(db):
+    await db.image_variants.create_index("key", unique=True)
+    return db.image_variants
+
+
+@pytest.fixture
+def image(storage, monkeypatch):
+    Image.new("RGB", (800, 600), "red").save(storage.path(KEY))
+    monkeypatch.setattr(server, "IMAGE_VARIANT_WIDTHS", [320])
+    monkeypatch.setattr(server, "IMAGE_VARIANT_FORMATS", ["webp"])
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        monkeypatch.setattr(server, "get_image_pool", lambda: pool)
+        yield KEY
+
+
+def ago(seconds):
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+
+async def test_a_job_is_claimed_once_while_in_progress(jobs):
+    assert await server.claim_image_job(KEY) is True
+    assert await server.claim_image_job(KEY) is False
+    assert (await jobs.find_one({"key": KEY}))["status"] == "pending"
+
+
+@pytest.mark.parametrize("job, claimable", [
+    ({"status": "ready"}, False),
+    ({"status": "failed", "error": "boom"}, True),
+    ({"status": "pending", "claimed_at": ago(60)}, False),
+    ({"status": "pending", "claimed_at": ago(3600)}, True),
+    ({"status": "pending", "created_at": ago(60)}, False),
+    ({"status": "pending", "created_at": ago(3600)}, True),
+])
+async def test_failed_and_stale_jobs_can_be_reclaimed(jobs, job, claimable):
+    await jobs.insert_one({"key": KEY, **job})
+
+    assert await server.claim_image_job(KEY) is claimable
+    if claimable:
+        doc = await jobs.find_one({"key": KEY})
+        assert doc["status"] == "pending"
+        assert "error" not in doc
+        assert doc["claimed_at"] > ago(60)
+
+
+async def test_failed_generation_is_retried(jobs, image, monkeypatch):
+    render = server.render_image_variants
+
+    def crash(*args):
+        raise OSError("worker crashed")
+
+    monkeypatch.setattr(server, "render_image_variants", crash)
+    await server.build_image_variants(image)
+    assert (await jobs.find_one({"key": image}))["status"] == "failed"
+
+    monkeypatch.setattr(server, "render_image_variants", render)
+    await server.build_image_variants(image)
+
+    job = await jobs.find_one({"key": image})
+    assert job["status"] == "ready"
+    assert job["variants"] == {"webp": {"320": "a" * 64 + "-w320.webp"}}
+    assert server.storage.path("a" * 64 + "-w320.webp").exists()
+
+
+async def test_broken_pool_is_replaced(jobs, monkeypatch):
+    class BrokenPool:
+        def submit(self, *args, **kwargs):
+            raise server.BrokenProcessPool("a worker died")
+
+        def shutdown(self, **kwargs):
+            pass
+
+    monkeypatch.setattr(server, "image_pool", BrokenPool())
+    await server.build_image_variants(KEY)
+
+    assert server.image_pool is None
+    assert (await jobs.find_one({"key": KEY}))["status"] == "failed"
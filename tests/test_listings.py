@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def add_listing(db, listing_id, title, price, minutes=0):
+    listing = {
+        "id": listing_id, "seller_id": "s1", "title": title, "description": "", "category": "sports",
+        "tags": [], "price": price, "type": "product", "stock": 1, "images": [],
+        "timestamp": datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minutes),
+    }
+    await db.listings.insert_one(dict(listing))
+    server.search_index.add(listing)
+
+
+async def test_sorted_search_only_considers_the_best_matches(client, db, monkeypatch):
+    await add_listing(db, "exact", "bike", 300)
+    await add_listing(db, "prefix", "bikepacking bag", 20)
+    await add_listing(db, "typo", "bkie stand", 10)
+    monkeypatch.setattr(server, "SEARCH_MAX_CANDIDATES", 2)
+
+    response = await client.get("/api/listings", params={"search": "bike", "sort": "price_asc"})
+
+    assert response.status_code == 200
+    assert [listing["id"] for listing in response.json()] == ["prefix", "exact"]
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+import manage
+
+
+class Client:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = Client()
+    monkeypatch.setattr(manage, "client", client)
+    return client
+
+
+def test_commands_share_connection_handling_and_flags(db, client, capsys):
+    asyncio.run(db.reviews.insert_many([
+        {"id": "r1", "listing_id": "l1", "rating": 4},
+        {"id": "r2", "listing_id": "l1", "rating": 5},
+    ]))
+    asyncio.run(db.listings.insert_one({"id": "l1"}))
+
+    assert manage.main(["reconcile-ratings", "l1", "--batch-size", "1"]) == 0
+
+    assert client.closed
+    assert capsys.readouterr().out == "Reconciled rating aggregates for 1 reviewed listings\n"
+    assert asyncio.run(db.listings.find_one({"id": "l1"}))["rating"] == 4.5
+
+
+def test_batch_size_defaults():
+    parser = manage.build_parser()
+
+    assert parser.parse_args(["migrate-timestamps"]).batch_size == 1000
+    assert parser.parse_args(["reconcile-ratings"]).batch_size == 500
+    assert not hasattr(parser.parse_args(["rebuild-conversations"]), "batch_size")
+
+
+def test_unknown_command_is_rejected(client):
+    with pytest.raises(SystemExit):
+        manage.main(["drop-everything"])
+    assert client.closed is False
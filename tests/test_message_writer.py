@@ -0,0 +1,113 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import orjson
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+ALICE = "alice"
+BOB = "bob"
+
+
+def message(n, sender=ALICE, receiver=BOB, **fields):
+    return {
+        "id": f"m{n}",
+        "sender_id": sender,
+        "receiver_id": receiver,
+        "message": f"message {n}",
+        "read": False,
+        "timestamp": datetime(2026, 1, 1, tzinfo=timezone.utc).isoformat(),
+        **fields,
+    }
+
+
+def writer(journal_dir):
+    return server.MessageWriter(enabled=True, journal_dir=journal_dir, max_batch=2, interval=60)
+
+
+async def stored_ids(db):
+    return sorted(m["id"] for m in await db.messages.find({}, {"id": 1}).to_list(None))
+
+
+@pytest.fixture
+async def messages(db):
+    await db.messages.create_index("id", unique=True)
+    return db.messages
+
+
+async def test_concurrent_recovery_replays_each_segment_once(db, messages, tmp_path):
+    # Left by a worker that exited without flushing: nothing holds its lock
+    (tmp_path / "journal-deadbeef-00000001.ndjson").write_text(
+        "".join(json.dumps(message(n, seq=n)) + "\n" for n in range(5))
+    )
+    first, second = writer(tmp_path), writer(tmp_path)
+
+    await asyncio.gather(first.recover(), second.recover())
+
+    assert await stored_ids(db) == [f"m{n}" for n in range(5)]
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_segment_claimed_by_another_worker_is_skipped(db, messages, tmp_path):
+    path = tmp_path / "journal-deadbeef-00000001.ndjson"
+    path.write_text(json.dumps(message(1, seq=1)) + "\n")
+    first, second = writer(tmp_path), writer(tmp_path)
+
+    claimed_path, segment = first._claim_segment(path)
+    try:
+        assert second._claim_segment(path) is None
+        assert second._claim_segment(claimed_path) is None
+    finally:
+        segment.close()
+
+
+async def test_recovery_skips_segments_of_a_running_writer(db, messages, tmp_path):
+    live = writer(tmp_path)
+    await live.start()
+    try:
+        await live.submit(message(1))
+        await writer(tmp_path).recover()
+        assert await stored_ids(db) == []
+    finally:
+        await live.close()
+    assert await stored_ids(db) == ["m1"]
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_messages_page_by_seq_not_timestamp(db, messages):
+    now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    # The sender's clock runs behind, so timestamps disagree with send order
+    for n in range(5):
+        doc = message(n, sender=[ALICE, BOB][n % 2], receiver=[BOB, ALICE][n % 2], seq=100 + n,
+                      timestamp=now - timedelta(seconds=n))
+        await db.messages.insert_one(server.stored_message(doc))
+    alice = server.User(id=ALICE, email="alice@example.com", name="Alice")
+
+    latest = await server.get_messages(BOB, before=None, after=None, limit=3, current_user=alice)
+    older = await server.get_messages(BOB, before=latest.headers["x-next-cursor"], after=None, limit=3,
+                                      current_user=alice)
+    newer = await server.get_messages(BOB, before=None, after="m1", limit=3, current_user=alice)
+
+    assert [m["id"] for m in orjson.loads(latest.body)] == ["m2", "m3", "m4"]
+    assert [m["id"] for m in orjson.loads(older.body)] == ["m0", "m1"]
+    assert "x-next-cursor" not in older.headers
+    assert [m["id"] for m in orjson.loads(newer.body)] == ["m2", "m3", "m4"]
+
+
+async def test_backfill_message_sequence(db, messages):
+    sent = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    await db.messages.insert_one({**message(1), "timestamp": sent})
+    await db.messages.insert_one({**message(2, sender=BOB, receiver=ALICE), "timestamp": sent, "seq": 7})
+
+    assert await server.backfill_message_sequence() == 2
+    assert await server.backfill_message_sequence() == 0
+
+    first = await db.messages.find_one({"id": "m1"})
+    second = await db.messages.find_one({"id": "m2"})
+    assert first["conversation_id"] == second["conversation_id"] == "alice:bob"
+    assert first["seq"] == server.clock_seq(sent)
+    assert second["seq"] == 7
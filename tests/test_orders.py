@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def place_order(db, stock=5, quantity=2, reserved_for=timedelta(minutes=15)):
+    """A stocked listing with a pending order holding `quantity` of it."""
+    await db.listings.insert_one({"id": "listing-1", "seller_id": "seller-1", "title": "Lamp", "stock": stock - quantity})
+    await db.orders.insert_one({
+        "id": "order-1", "buyer_id": "buyer-1", "buyer_name": "Buyer", "seller_id": "seller-1",
+        "listing_id": "listing-1", "listing_title": "Lamp", "quantity": quantity, "total_amount": 20.0,
+        "status": "pending", "payment_status": "pending", "reservation": "held",
+        "reserved_until": datetime.now(timezone.utc) + reserved_for, "timestamp": datetime.now(timezone.utc),
+    })
+
+
+async def state(db):
+    order = await db.orders.find_one({"id": "order-1"})
+    listing = await db.listings.find_one({"id": "listing-1"})
+    return order["status"], order["reservation"], listing["stock"]
+
+
+async def test_confirm_commits_held_stock(db):
+    await place_order(db)
+    assert await server.confirm_order_payment("order-1") is not None
+    assert await state(db) == ("confirmed", "committed", 3)
+    # A second webhook or status poll loses the transition and changes nothing
+    assert await server.confirm_order_payment("order-1") is None
+    assert await state(db) == ("confirmed", "committed", 3)
+
+
+async def test_expire_releases_stock_once(db):
+    await place_order(db)
+    assert await server.expire_order("order-1") is not None
+    assert await server.expire_order("order-1") is None
+    assert await state(db) == ("expired", "released", 5)
+
+
+async def test_late_payment_takes_stock_again(db):
+    await place_order(db)
+    await server.expire_order("order-1")
+    await server.confirm_order_payment("order-1")
+    assert await state(db) == ("confirmed", "committed", 3)
+
+
+async def test_late_payment_after_stock_sold_is_short(db):
+    await place_order(db)
+    await server.expire_order("order-1")
+    await db.listings.update_one({"id": "listing-1"}, {"$set": {"stock": 1}})
+    await server.confirm_order_payment("order-1")
+    assert await state(db) == ("confirmed", "short", 1)
+
+
+async def test_confirm_during_expiry_does_not_oversell(db, monkeypatch):
+    """Payment confirmed between the expiry's transition and its stock release."""
+    await place_order(db)
+    transition_order = server.transition_order
+
+    async def confirm_after_expiry(order_id, from_status, update, extra=None):
+        before = await transition_order(order_id, from_status, update, extra)
+        if update["status"] == "expired" and before is not None:
+            await server.confirm_order_payment(order_id)
+        return before
+
+    monkeypatch.setattr(server, "transition_order", confirm_after_expiry)
+    await server.expire_order("order-1")
+    assert await state(db) == ("confirmed", "committed", 3)
+
+
+async def test_expiry_during_confirm_does_not_oversell(db, monkeypatch):
+    """The sweeper expires the order after confirm read it but before confirm's update."""
+    await place_order(db)
+    transition_order = server.transition_order
+    interleaved = []
+
+    async def expire_before_confirm(order_id, from_status, update, extra=None):
+        if update["status"] == "confirmed" and not interleaved:
+            interleaved.append(await transition_order(
+                order_id, ["pending"], {"status": "expired", "reservation": "released"}, {"reservation": "held"}))
+            await db.listings.update_one({"id": "listing-1"}, {"$inc": {"stock": 2}})
+        return await transition_order(order_id, from_status, update, extra)
+
+    monkeypatch.setattr(server, "transition_order", expire_before_confirm)
+    assert await server.confirm_order_payment("order-1") is not None
+    assert interleaved[0] is not None
+    assert await state(db) == ("confirmed", "committed", 3)
+
+
+async def test_sweeper_releases_only_lapsed_orders(db):
+    await place_order(db, reserved_for=timedelta(minutes=-1))
+    assert await server.release_expired_reservations() == 1
+    assert await state(db) == ("expired", "released", 5)
+
+
+async def test_paid_status_is_retried_after_confirm_fails(db, monkeypatch):
+    await place_order(db)
+    await db.payment_transactions.insert_one(
+        {"session_id": "cs_1", "order_id": "order-1", "buyer_id": "buyer-1", "payment_status": "pending"})
+    confirm_order_payment = server.confirm_order_payment
+
+    async def failing_confirm(order_id):
+        raise RuntimeError("connection reset")
+
+    monkeypatch.setattr(server, "confirm_order_payment", failing_confirm)
+    with pytest.raises(RuntimeError):
+        await server.apply_session_status("cs_1", "paid", "complete")
+    monkeypatch.setattr(server, "confirm_order_payment", confirm_order_payment)
+
+    # Stripe redelivers; the transaction is already paid but the order still gets confirmed
+    await server.apply_session_status("cs_1", "paid", "complete")
+    assert await state(db) == ("confirmed", "committed", 3)
@@ -0,0 +1,95 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("values", [
+    [datetime(2026, 3, 1, 12, 30, 15, 250000, tzinfo=timezone.utc), "listing-1"],
+    ["mountain bike", "listing-2"],
+    [42, "listing-3"],
+    [None, "listing-4"],
+])
+def test_cursor_round_trip(values):
+    cursor = server.encode_cursor(values)
+
+    assert "=" not in cursor
+    assert server.decode_cursor(cursor) == values
+
+
+def test_naive_datetimes_are_encoded_as_utc():
+    cursor = server.encode_cursor([datetime(2026, 3, 1, 12, 0), "a"])
+
+    assert server.decode_cursor(cursor)[0] == datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    server.encode_cursor(["only one"])[:-2],
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    base64.urlsafe_b64encode(b'[1, 2, 3]').decode(),
+    base64.urlsafe_b64encode(b'[{"$date": "yesterday"}, "a"]').decode(),
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as exc:
+        server.decode_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+async def walk(collection, conditions, sort_field, direction, limit):
+    pages, cursor = [], None
+    while True:
+        docs, cursor = await server.fetch_page(collection, conditions, sort_field, direction, limit, cursor)
+        pages.append([d["id"] for d in docs])
+        if cursor is None:
+            return pages
+
+
+@pytest.fixture
+async def listings(db):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    # Pairs of listings share a timestamp, so pages must break ties on id
+    await db.listings.insert_many([
+        {"id": f"l{n}", "seller_id": "s1" if n % 3 else "s2", "timestamp": start + timedelta(minutes=n // 2)}
+        for n in range(10)
+    ])
+    return db.listings
+
+
+async def test_fetch_page_walks_every_document_once(listings):
+    pages = await walk(listings, [], "timestamp", -1, 3)
+
+    assert pages == [["l9", "l8", "l7"], ["l6", "l5", "l4"], ["l3", "l2", "l1"], ["l0"]]
+
+
+async def test_fetch_page_ascending_with_conditions(listings):
+    pages = await walk(listings, [{"seller_id": "s1"}], "timestamp", 1, 2)
+
+    assert pages == [["l1", "l2"], ["l4", "l5"], ["l7", "l8"]]
+
+
+async def test_exact_final_page_has_no_cursor(listings):
+    docs, cursor = await server.fetch_page(listings, [], "timestamp", -1, 10)
+
+    assert len(docs) == 10
+    assert cursor is None
+
+
+async def test_startup_migrates_string_dates_so_later_pages_find_them(db):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    await db.listings.insert_many([{"id": "new", "timestamp": start + timedelta(days=1)}] + [
+        # Written by a version that stored ISO strings
+        {"id": f"old{n}", "timestamp": (start - timedelta(days=n)).isoformat()} for n in range(2)
+    ])
+    await db.reviews.insert_one({"id": "r1", "timestamp": start.isoformat()})
+
+    await server.migrate_timestamps()
+
+    assert await walk(db.listings, [], "timestamp", -1, 1) == [["new"], ["old0"], ["old1"]]
+    assert (await db.reviews.find_one({"id": "r1"}))["timestamp"] == start
+    assert await server.migrate_datetime_fields() == {name: 0 for name in server.DATETIME_FIELDS}
@@ -0,0 +1,73 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def histogram(**counts):
+    return {**server.empty_rating_histogram(), **{rating[1:]: n for rating, n in counts.items()}}
+
+
+async def aggregates(db, listing_id):
+    listing = await db.listings.find_one({"id": listing_id})
+    return {field: listing.get(field) for field in ("rating_sum", "reviews_count", "rating_histogram", "rating")}
+
+
+async def review(client, listing_id, rating):
+    response = await client.post("/api/reviews", json={"listing_id": listing_id, "rating": rating, "comment": "ok"})
+    assert response.status_code == 200
+
+
+async def test_reviews_update_running_aggregates(client, db, user):
+    listing = (await client.post("/api/listings", json={
+        "title": "Lamp", "description": "", "price": 20, "category": "home", "images": [],
+    })).json()
+
+    for rating in (5, 4, 4):
+        await review(client, listing["id"], rating)
+
+    assert await aggregates(db, listing["id"]) == {
+        "rating_sum": 13, "reviews_count": 3, "rating_histogram": histogram(r4=2, r5=1), "rating": 4.3,
+    }
+    assert (await client.get(f"/api/listings/{listing['id']}")).json()["rating"] == 4.3
+
+
+async def legacy_listing(db, listing_id, ratings):
+    # Written before running aggregates: a stale count and average, no sum or histogram
+    await db.listings.insert_one({"id": listing_id, "seller_id": "s1", "title": "Old", "description": "",
+                                  "price": 1, "category": "home", "images": [], "reviews_count": 1, "rating": 1.0})
+    for n, rating in enumerate(ratings):
+        await db.reviews.insert_one({"id": f"{listing_id}-r{n}", "listing_id": listing_id, "rating": rating})
+
+
+async def test_first_review_on_a_legacy_listing_reconciles_it(client, db, user):
+    await legacy_listing(db, "old", [2, 5])
+
+    await review(client, "old", 5)
+
+    assert await aggregates(db, "old") == {
+        "rating_sum": 12, "reviews_count": 3, "rating_histogram": histogram(r2=1, r5=2), "rating": 4.0,
+    }
+    await review(client, "old", 1)
+    assert (await aggregates(db, "old"))["rating"] == 3.2
+
+
+async def test_reconcile_rebuilds_every_listing(db):
+    await legacy_listing(db, "a", [3, 4])
+    await legacy_listing(db, "b", [])
+    await db.listings.insert_one({"id": "drifted", "rating_sum": 99, "reviews_count": 9,
+                                  "rating_histogram": histogram(r5=9), "rating": 5.0})
+    await db.reviews.insert_one({"id": "d1", "listing_id": "drifted", "rating": 1})
+
+    assert await server.reconcile_rating_aggregates(batch_size=1) == 2
+
+    assert await aggregates(db, "a") == {
+        "rating_sum": 7, "reviews_count": 2, "rating_histogram": histogram(r3=1, r4=1), "rating": 3.5,
+    }
+    assert await aggregates(db, "b") == {
+        "rating_sum": 0, "reviews_count": 0, "rating_histogram": histogram(), "rating": 0.0,
+    }
+    assert await aggregates(db, "drifted") == {
+        "rating_sum": 1, "reviews_count": 1, "rating_histogram": histogram(r1=1), "rating": 1.0,
+    }
@@ -0,0 +1,168 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def bumped(monkeypatch):
+    """Tags passed to response_cache.invalidate, in call order."""
+    tags = []
+    invalidate = server.ResponseCache.invalidate
+
+    async def recording_invalidate(self, *args):
+        tags.extend(args)
+        await invalidate(self, *args)
+
+    monkeypatch.setattr(server.ResponseCache, "invalidate", recording_invalidate)
+    return tags
+
+
+async def create_listing(client, **fields):
+    listing = {"title": "Road bike", "description": "Fast", "price": 500, "category": "sports",
+               "images": [], "stock": 3, **fields}
+    response = await client.post("/api/listings", json=listing)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def listing_ids(client):
+    return [listing["id"] for listing in (await client.get("/api/listings")).json()]
+
+
+async def test_cached_pages_survive_direct_writes(client, db, user):
+    listing = await create_listing(client)
+    assert await listing_ids(client) == [listing["id"]]
+
+    # Bypasses the API, so nothing is invalidated and the cached page is served
+    await db.listings.delete_one({"id": listing["id"]})
+
+    assert await listing_ids(client) == [listing["id"]]
+
+
+async def test_creating_a_listing_evicts_list_pages(client, user, bumped):
+    first = await create_listing(client)
+    assert await listing_ids(client) == [first["id"]]
+    bumped.clear()
+
+    second = await create_listing(client, title="Gravel bike")
+
+    assert bumped == ["listings"]
+    assert set(await listing_ids(client)) == {first["id"], second["id"]}
+
+
+async def test_updating_a_listing_evicts_its_page_and_list_pages(client, user, bumped):
+    listing = await create_listing(client)
+    await client.get(f"/api/listings/{listing['id']}")
+    await client.get("/api/listings")
+    bumped.clear()
+
+    await client.put(f"/api/listings/{listing['id']}", json={"title": "Touring bike"})
+
+    assert bumped == ["listings", f"listing:{listing['id']}"]
+    assert (await client.get(f"/api/listings/{listing['id']}")).json()["title"] == "Touring bike"
+    assert (await client.get("/api/listings")).json()[0]["title"] == "Touring bike"
+
+
+async def test_deleting_a_listing_evicts_its_page(client, user, bumped):
+    listing = await create_listing(client)
+    assert (await client.get(f"/api/listings/{listing['id']}")).status_code == 200
+    bumped.clear()
+
+    await client.delete(f"/api/listings/{listing['id']}")
+
+    assert bumped == ["listings", f"listing:{listing['id']}"]
+    assert (await client.get(f"/api/listings/{listing['id']}")).status_code == 404
+    assert await listing_ids(client) == []
+
+
+async def test_adding_a_review_evicts_reviews_and_rating(client, user, bumped):
+    listing = await create_listing(client)
+    assert (await client.get(f"/api/reviews/{listing['id']}")).json() == []
+    await client.get(f"/api/listings/{listing['id']}")
+    bumped.clear()
+
+    await client.post("/api/reviews", json={"listing_id": listing["id"], "rating": 4, "comment": "Good"})
+
+    assert bumped == ["listings", f"listing:{listing['id']}", f"reviews:{listing['id']}"]
+    assert [r["rating"] for r in (await client.get(f"/api/reviews/{listing['id']}")).json()] == [4]
+    assert (await client.get(f"/api/listings/{listing['id']}")).json()["rating"] == 4.0
+
+
+async def test_stock_changes_evict_the_listing(client, user, bumped):
+    listing = await create_listing(client, stock=3)
+    await client.get(f"/api/listings/{listing['id']}")
+    bumped.clear()
+
+    order = (await client.post("/api/orders", params={"listing_id": listing["id"], "quantity": 2})).json()
+
+    assert bumped == ["listings", f"listing:{listing['id']}"]
+    assert (await client.get(f"/api/listings/{listing['id']}")).json()["stock"] == 1
+
+    bumped.clear()
+    await server.expire_order(order["id"])
+
+    assert bumped == ["listings", f"listing:{listing['id']}"]
+    assert (await client.get(f"/api/listings/{listing['id']}")).json()["stock"] == 3
+
+
+async def test_etag_revalidation(client, user):
+    listing = await create_listing(client)
+    url = f"/api/listings/{listing['id']}"
+    first = await client.get(url)
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    not_modified = await client.get(url, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+    assert (await client.get(url, headers={"If-None-Match": f'"other", {etag}'})).status_code == 304
+    assert (await client.get(url, headers={"If-None-Match": "*"})).status_code == 304
+
+    await client.put(url, json={"price": 450})
+    changed = await client.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["price"] == 450
+
+
+class BrokenRedis:
+    """A shared cache that is configured but unreachable."""
+
+    def __getattr__(self, name):
+        async def fail(*args, **kwargs):
+            raise ConnectionError("redis is down")
+        return fail
+
+    def pipeline(self, **kwargs):
+        raise ConnectionError("redis is down")
+
+
+async def test_unreachable_redis_bypasses_the_cache(client, db, user, monkeypatch):
+    listing = await create_listing(client)
+    monkeypatch.setattr(server, "get_redis", lambda: BrokenRedis())
+
+    assert await listing_ids(client) == [listing["id"]]
+    await db.listings.delete_one({"id": listing["id"]})
+    # Versions cannot be read, so nothing is served from (or stored in) the cache
+    assert await listing_ids(client) == []
+    await server.invalidate_listing(listing["id"])
+
+
+async def test_redis_shares_invalidation_between_workers(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    monkeypatch.setattr(server, "get_redis", lambda: shared)
+    shared = fakeredis.FakeAsyncRedis(decode_responses=True)
+    worker_a, worker_b = server.ResponseCache(100, 30), server.ResponseCache(100, 30)
+
+    key, _ = await worker_a.lookup("listing", {"id": "l1"}, ["listing:l1"])
+    await worker_a.store(key, b'{"title": "old"}', {})
+    _, entry = await worker_b.lookup("listing", {"id": "l1"}, ["listing:l1"])
+    assert entry["body"] == '{"title": "old"}'
+
+    await worker_a.invalidate("listing:l1")
+
+    for worker in (worker_a, worker_b):
+        assert (await worker.lookup("listing", {"id": "l1"}, ["listing:l1"]))[1] is None
@@ -0,0 +1,92 @@
+import pytest
+
+import server
+
+LISTINGS = [
+    {"id": "bike", "title": "Mountain bike", "description": "Aluminium frame, barely ridden",
+     "category": "sports", "tags": ["cycling"]},
+    {"id": "helmet", "title": "Cycling helmet", "description": "Fits any mountain bike rider",
+     "category": "sports", "tags": []},
+    {"id": "lamp", "title": "Desk lamp", "description": "Warm light", "category": "home", "tags": ["lighting"]},
+]
+
+
+@pytest.fixture
+def index():
+    index = server.SearchIndex()
+    for listing in LISTINGS:
+        index.add(listing)
+    return index
+
+
+def ids(results):
+    return [listing_id for listing_id, _ in results]
+
+
+def test_title_hits_outrank_description_hits(index):
+    assert ids(index.search("mountain bike")) == ["bike", "helmet"]
+
+
+def test_every_token_must_match(index):
+    assert ids(index.search("mountain lamp")) == []
+    assert index.search("") == []
+
+
+def test_prefix_and_typo_matches(index):
+    assert ids(index.search("mount")) == ["bike", "helmet"]
+    assert ids(index.search("lmap")) == ["lamp"]
+    assert ids(index.search("helmte")) == ["helmet"]
+
+
+def test_category_filter(index):
+    assert ids(index.search("light", category="home")) == ["lamp"]
+    assert ids(index.search("bike", category="home")) == []
+
+
+def test_remove_drops_listing_and_its_terms(index):
+    index.remove("lamp")
+
+    assert len(index) == 2
+    assert index.search("lamp") == []
+    assert "lamp" not in index.postings
+    assert "lmp" not in index.delete_map
+    index.remove("lamp")
+
+
+def test_add_replaces_existing_listing(index):
+    index.add({"id": "lamp", "title": "Floor lamp", "description": "", "category": "home", "tags": []})
+
+    assert len(index) == 3
+    assert ids(index.search("floor")) == ["lamp"]
+    assert index.search("desk") == []
+
+
+@pytest.fixture
+def unicode_index():
+    index = server.SearchIndex()
+    for listing in [
+        {"id": "coffee", "title": "Зерновой кофе", "description": "", "category": "food", "tags": []},
+        {"id": "guide", "title": "日本 travel guide", "description": "", "category": "books", "tags": []},
+        {"id": "cafe", "title": "Café table", "description": "Crème finish", "category": "home", "tags": []},
+        {"id": "book", "title": "हिन्दी किताब", "description": "", "category": "books", "tags": []},
+    ]:
+        index.add(listing)
+    return index
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("кофе", ["coffee"]),
+    ("КОФ", ["coffee"]),
+    ("日本", ["guide"]),
+    ("café", ["cafe"]),
+    ("cafe", ["cafe"]),
+    ("CRÈME", ["cafe"]),
+    ("creme", ["cafe"]),
+    ("किताब", ["book"]),
+])
+def test_non_ascii_text_is_searchable(unicode_index, query, expected):
+    assert ids(unicode_index.search(query)) == expected
+
+
+def test_accented_words_stay_whole():
+    assert server.tokenize("Crème brûlée, café_au_lait") == ["creme", "brulee", "cafe", "au", "lait"]
@@ -0,0 +1,133 @@
+import hashlib
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+CONTENT = bytes(range(256)) * 4
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+KEY = f"{DIGEST}.bin"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("bytes= 10-20", (10, 20)),
+])
+def test_parse_range(header, expected):
+    assert server.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    "items=0-10", "bytes=0-10,20-30", "bytes=a-b", "bytes=-", "bytes=-0", "bytes=5", "bytes=-x",
+])
+def test_unusable_ranges_are_ignored(header):
+    assert server.parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=2000-3000", "bytes=50-10"])
+def test_unsatisfiable_ranges_raise_416(header):
+    with pytest.raises(HTTPException) as exc:
+        server.parse_range(header, 1000)
+    assert exc.value.status_code == 416
+    assert exc.value.headers == {"Content-Range": "bytes */1000"}
+
+
+@pytest.fixture
+def stored(storage):
+    storage.path(KEY).write_bytes(CONTENT)
+    return f"/uploads/{KEY}"
+
+
+@pytest.mark.anyio
+async def test_full_response(client, stored):
+    response = await client.get(stored)
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-length"] == "1024"
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"] == f'"{DIGEST}"'
+    assert response.headers["cache-control"] == server.IMMUTABLE_CACHE_CONTROL
+    assert response.headers["content-type"] == "application/octet-stream"
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=100-199", 100, 199),
+    ("bytes=1000-", 1000, 1023),
+    ("bytes=-24", 1000, 1023),
+    ("bytes=1020-4000", 1020, 1023),
+])
+async def test_partial_response(client, stored, header, start, end):
+    response = await client.get(stored, headers={"Range": header})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/1024"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+
+@pytest.mark.anyio
+async def test_unsatisfiable_range(client, stored):
+    response = await client.get(stored, headers={"Range": "bytes=2000-"})
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+@pytest.mark.anyio
+async def test_multiple_ranges_get_the_whole_file(client, stored):
+    response = await client.get(stored, headers={"Range": "bytes=0-1,5-6"})
+
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+@pytest.mark.anyio
+async def test_if_range(client, stored):
+    etag = f'"{DIGEST}"'
+    current = await client.get(stored, headers={"Range": "bytes=0-9", "If-Range": etag})
+    stale = await client.get(stored, headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+
+    assert current.status_code == 206
+    assert current.content == CONTENT[:10]
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+
+@pytest.mark.anyio
+async def test_if_none_match(client, stored):
+    response = await client.get(stored, headers={"If-None-Match": f'"{DIGEST}"', "Range": "bytes=0-9"})
+
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+@pytest.mark.anyio
+async def test_head(client, stored):
+    full = await client.head(stored)
+    partial = await client.head(stored, headers={"Range": "bytes=10-19"})
+
+    assert full.status_code == 200
+    assert full.headers["content-length"] == "1024"
+    assert full.content == b""
+    assert partial.status_code == 206
+    assert partial.headers["content-length"] == "10"
+    assert partial.headers["content-range"] == "bytes 10-19/1024"
+
+
+@pytest.mark.anyio
+async def test_uploads_outside_storage_are_not_served(client, storage):
+    (storage.root / "name.txt").write_bytes(b"mutable")
+
+    assert (await client.get("/uploads/missing.bin")).status_code == 404
+    assert (await client.get("/uploads/.hidden")).status_code == 404
+    mutable = await client.get("/uploads/name.txt")
+    assert mutable.headers["cache-control"] == server.MUTABLE_CACHE_CONTROL
+    assert mutable.headers["etag"].startswith('"7-')
@@ -0,0 +1,105 @@
+import hashlib
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setattr(server, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(server, "UPLOAD_CHUNK_SIZE", 4)
+
+
+async def upload(client, content, filename="notes.txt", **fields):
+    return await client.post("/api/upload", files={"file": (filename, content, "text/plain")}, data=fields)
+
+
+async def test_multipart_upload_is_stored_under_its_content_hash(client, storage, user):
+    response = await upload(client, b"hello world", note="ignored")
+
+    assert response.status_code == 200
+    digest = hashlib.sha256(b"hello world").hexdigest()
+    assert response.json() == {"file_url": f"http://testserver/uploads/{digest}.txt", "file_name": "notes.txt"}
+    assert storage.path(f"{digest}.txt").read_bytes() == b"hello world"
+    assert list(server.UPLOAD_TMP_DIR.iterdir()) == []
+
+
+async def test_identical_uploads_share_one_file(client, storage, user):
+    first = await upload(client, b"same bytes", filename="a.txt")
+    second = await client.put("/api/upload/stream", params={"filename": "b.txt"}, content=b"same bytes")
+
+    assert first.json()["file_url"] == second.json()["file_url"]
+    assert len(list(storage.root.iterdir())) == 1
+    assert list(server.UPLOAD_TMP_DIR.iterdir()) == []
+
+
+async def test_oversized_uploads_are_refused(client, storage, user, small_limits):
+    multipart = await upload(client, b"x" * 1025)
+    streamed = await client.put("/api/upload/stream", params={"filename": "big.txt"}, content=b"x" * 1025)
+
+    assert multipart.status_code == 400
+    assert multipart.json()["detail"] == "File size must be less than 1KB"
+    assert streamed.status_code == 413
+    assert list(storage.root.iterdir()) == []
+    assert list(server.UPLOAD_TMP_DIR.iterdir()) == []
+
+
+async def test_oversized_body_without_content_length_is_cut_off(client, storage, user, small_limits):
+    async def body():
+        yield b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.txt\"\r\n\r\n"
+        for _ in range(40):
+            yield b"x" * 100
+
+    response = await client.post("/api/upload", content=body(),
+                                 headers={"content-type": "multipart/form-data; boundary=b"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "File size must be less than 1KB"
+    assert list(server.UPLOAD_TMP_DIR.iterdir()) == []
+
+
+async def test_multipart_upload_requires_a_file_field(client, storage, user):
+    response = await client.post("/api/upload", data={"note": "no file"}, files={"other": ("a.txt", b"x")})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Missing file field"
+
+
+async def test_chunked_upload_resumes_from_the_received_offset(client, storage, user, small_limits):
+    session = (await client.post("/api/upload/sessions", json={"filename": "data.txt", "size": 10})).json()
+    url = f"/api/upload/sessions/{session['upload_id']}"
+
+    assert (await client.put(url, params={"offset": 0}, content=b"abcd")).json()["received"] == 4
+    # A retried chunk at a stale offset is refused and tells the client where to resume
+    stale = await client.put(url, params={"offset": 0}, content=b"abcd")
+    assert stale.status_code == 409
+    assert stale.json()["detail"] == "Expected offset 4"
+    assert (await client.put(url, params={"offset": 4}, content=b"efghi")).status_code == 413
+    assert (await client.get(url)).json()["received"] == 4
+
+    assert (await client.put(url, params={"offset": 4}, content=b"efgh")).json()["received"] == 8
+    assert (await client.post(f"{url}/complete")).status_code == 409
+    assert (await client.put(url, params={"offset": 8}, content=b"ij")).json()["received"] == 10
+
+    completed = await client.post(f"{url}/complete")
+    digest = hashlib.sha256(b"abcdefghij").hexdigest()
+    assert completed.json()["file_url"] == f"http://testserver/uploads/{digest}.txt"
+    assert storage.path(f"{digest}.txt").read_bytes() == b"abcdefghij"
+
+
+async def test_interrupted_chunk_tail_is_discarded(client, storage, user, small_limits):
+    session = (await client.post("/api/upload/sessions", json={"filename": "data.txt", "size": 8})).json()
+    url = f"/api/upload/sessions/{session['upload_id']}"
+    await client.put(url, params={"offset": 0}, content=b"abcd")
+    # Bytes written by a chunk whose request died before the session was updated
+    with open(server.partial_upload_path(session["upload_id"]), "ab") as partial:
+        partial.write(b"zz")
+
+    await client.put(url, params={"offset": 4}, content=b"efgh")
+    completed = await client.post(f"{url}/complete")
+
+    digest = hashlib.sha256(b"abcdefgh").hexdigest()
+    assert completed.json()["file_url"].endswith(f"/{digest}.txt")